@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+
+
+#
+# api_metrics.py version 1
+# boto3
+# python version 2.7.14
+#
+# Per service / per operation API call instrumentation using botocore event hooks:
+#
+# Registered on every session created by client_registry, so all clients are instrumented
+# Records call counts, errors, latency (including retries), retry attempts and throttling errors
+# print_summary prints a table per operation, write_report writes the same data as JSON
+# The report file is set with the optional apiMetricsReport variable (default api_metrics.json)
+
+# Upper bounds in milliseconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+THROTTLING_ERROR_CODES = set([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'RequestThrottled', 'RequestLimitExceeded', 'TooManyRequestsException', 'SlowDown',
+    'PriorRequestNotComplete', 'EC2ThrottledException', 'BandwidthLimitExceeded',
+    'ProvisionedThroughputExceededException', 'TransactionInProgressException'
+])
+
+# Keys stored in the per-request context botocore passes to every hook of one API call
+_START_TIME_KEY = 'api_metrics_start'
+_OPERATION_KEY = 'api_metrics_operation'
+
+
+class OperationMetrics(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.error_codes = {}
+
+    def record(self, elapsed_ms, retries, error_code):
+        self.calls += 1
+        self.retries += retries
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.histogram[bucket_index(elapsed_ms)] += 1
+        if error_code:
+            self.errors += 1
+            self.error_codes[error_code] = self.error_codes.get(error_code, 0) + 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the percentile, None when it falls in the unbounded bucket
+        target = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= target:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+        return None
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'errorCodes': self.error_codes,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'totalMs': round(self.total_ms, 1),
+            'avgMs': round(self.total_ms / self.calls, 1) if self.calls else 0,
+            'maxMs': round(self.max_ms, 1),
+            'histogram': dict(zip(bucket_labels(), self.histogram))
+        }
+
+
+class ApiMetrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.started = time.time()
+
+    def register(self, event_system):
+        event_system.register('before-call', self.before_call)
+        event_system.register('after-call', self.after_call)
+        event_system.register('after-call-error', self.after_call_error)
+        event_system.register('needs-retry', self.needs_retry)
+
+    def before_call(self, model, context, **kwargs):
+        context[_OPERATION_KEY] = (model.service_model.service_name, model.name)
+        context[_START_TIME_KEY] = time.time()
+
+    def after_call(self, parsed, context, **kwargs):
+        metadata = parsed.get('ResponseMetadata', {})
+        error_code = parsed.get('Error', {}).get('Code')
+        self.record(context, metadata.get('RetryAttempts', 0), error_code)
+
+    def after_call_error(self, exception, context, **kwargs):
+        # Raised without a parsed response, e.g. connection errors once the retries are used up
+        self.record(context, 0, exception.__class__.__name__)
+
+    def needs_retry(self, response, request_dict, **kwargs):
+        # Fires once per attempt, so throttles on attempts that were later retried are counted too
+        if response is None or _OPERATION_KEY not in request_dict['context']:
+            return None
+        error_code = response[1].get('Error', {}).get('Code')
+        if error_code in THROTTLING_ERROR_CODES:
+            with self.lock:
+                self.operation(*request_dict['context'][_OPERATION_KEY]).throttles += 1
+        return None
+
+    def record(self, context, retries, error_code):
+        if _OPERATION_KEY not in context:
+            return
+        started = context.pop(_START_TIME_KEY)
+        elapsed_ms = (time.time() - started) * 1000
+        with self.lock:
+            self.operation(*context[_OPERATION_KEY]).record(elapsed_ms, retries, error_code)
+
+    def operation(self, service, operation):
+        # Called with the lock held
+        key = (service, operation)
+        if key not in self.operations:
+            self.operations[key] = OperationMetrics()
+        return self.operations[key]
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return sorted((key, metrics.to_dict()) for key, metrics in self.operations.items())
+
+    def totals(self):
+        totals = {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0, 'totalMs': 0.0}
+        for key, metrics in self.snapshot():
+            for field in totals:
+                totals[field] += metrics[field]
+        totals['totalMs'] = round(totals['totalMs'], 1)
+        return totals
+
+    def report(self):
+        return {
+            'started': self.started,
+            'elapsedSeconds': round(time.time() - self.started, 1),
+            'totals': self.totals(),
+            'latencyBucketsMs': LATENCY_BUCKETS_MS,
+            'operations': [dict(service=service, operation=operation, **metrics)
+                           for (service, operation), metrics in self.snapshot()]
+        }
+
+    def print_summary(self):
+        row_format = "%-16s %-40s %7s %7s %7s %9s %9s %9s %9s"
+        print(row_format % ('Service', 'Operation', 'Calls', 'Errors', 'Retries', 'Throttles',
+                            'Avg ms', 'p95 ms', 'Max ms'))
+        with self.lock:
+            operations = sorted(self.operations.items())
+        for (service, operation), metrics in operations:
+            p95 = metrics.percentile(0.95)
+            print(row_format % (service, operation, metrics.calls, metrics.errors, metrics.retries,
+                                metrics.throttles, "%.1f" % (metrics.total_ms / metrics.calls),
+                                p95 if p95 is not None else ">%d" % LATENCY_BUCKETS_MS[-1],
+                                "%.1f" % metrics.max_ms))
+        totals = self.totals()
+        print(row_format % ('Total', '', totals['calls'], totals['errors'], totals['retries'],
+                            totals['throttles'], '', '', ''))
+
+    def write_report(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2, sort_keys=True)
+        print("Wrote API call report: " + path)
+
+
+def bucket_index(elapsed_ms):
+    for index, upper_bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= upper_bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+def bucket_labels():
+    return ["<=%d" % upper_bound for upper_bound in LATENCY_BUCKETS_MS] + [">%d" % LATENCY_BUCKETS_MS[-1]]
+
+
+# One collector per process, shared by every session and client
+metrics = ApiMetrics()
+
+
+def report_run(awsvars):
+    # Prints the summary and writes the JSON report for the run, then starts counting afresh
+    metrics.print_summary()
+    metrics.write_report(awsvars.get('apiMetricsReport', 'api_metrics.json'))
+    metrics.reset()
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import create_architecture
+import teardown_aws_architecture
+from stack_context import StackContext
+import stage_tracing
+from stage_scheduler import PendingWait, StageFailedError, resolve_dependencies
+
+
+#
+# async_engine.py version 1
+# boto3
+# python version 3.7+ (asyncio), the threaded engine remains the default for python 2.7
+#
+# asyncio execution mode for creating and deleting the architecture:
+#
+# Runs the same stage graphs as create_architecture and teardown_aws_architecture as coroutines
+# Blocking botocore calls run in one bounded executor shared by every stack on the event loop
+# A stage waiting on AWS (NAT Gateways available, RDS, instances, Load Balancer, NAT Gateways
+# or AutoScaling Group deleted) returns the waiter multiplexer's future as a PendingWait,
+# which is awaited on the event loop with asyncio.wrap_future, so no executor thread is held while it is pending.
+# The rest of the stage then runs in the executor again
+# Short waits inside a single call, e.g. the VPC becoming available, still run in the executor
+# Many stacks can be driven from one event loop with provision_stacks / teardown_stacks, as batch.py --engine async does
+#
+# command to run example: python awsMenu.py --engine async --action create
+
+
+class SkippedStageError(Exception):
+    pass
+
+
+class AsyncEngine(object):
+    def __init__(self, max_workers=16):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def call(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, lambda: function(*args))
+
+    async def run_stage(self, stage, stack=None):
+        span = stage_tracing.open_stage(stage.name, stack)
+        try:
+            result = await self.call(stage_tracing.run_in_stage, span, stage.action)
+            while isinstance(result, PendingWait):
+                # The error of a failed wait is raised by the rest of the stage
+                await asyncio.wait([asyncio.wrap_future(result.future)])
+                result = await self.call(stage_tracing.run_in_stage, span, result.resume, result.future)
+        except Exception:
+            stage_tracing.close_stage(span, failed=True)
+            raise
+        stage_tracing.close_stage(span)
+        return result
+
+    async def run_stages(self, stages, stack=None):
+        dependencies = resolve_dependencies(stages)
+        stage_tracing.tracer.record_dependencies(dependencies, stack)
+        tasks = {}
+
+        async def run_stage(stage):
+            for dependency in sorted(dependencies[stage.name]):
+                try:
+                    await tasks[dependency]
+                except Exception:
+                    print("Skipping stage %s as %s did not complete" % (stage.name, dependency))
+                    raise SkippedStageError(stage.name)
+            print("Starting stage: " + stage.name)
+            result = await self.run_stage(stage, stack)
+            print("Finished stage: " + stage.name)
+            return result
+
+        for stage in stages:
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        results = {}
+        failures = {}
+        skipped = set()
+        for name, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, SkippedStageError):
+                skipped.add(name)
+            elif isinstance(outcome, BaseException):
+                print("Stage %s failed: %s" % (name, outcome))
+                failures[name] = outcome
+            else:
+                results[name] = outcome
+        if failures:
+            raise StageFailedError(failures, skipped)
+        return results
+
+    async def provision(self, awsvars, access_key_id, secret_access_key, resume=False):
+        if resume:
+            print("Resuming Scalable AWS Architecture Creation (async engine)")
+            context, stages = await self.call(create_architecture.resume_stages,
+                                              awsvars, access_key_id, secret_access_key)
+        else:
+            print("Creating Scalable AWS Architecture (async engine)")
+            context = StackContext()
+            stages = create_architecture.create_stages(awsvars, access_key_id, secret_access_key, context)
+        await self.run_stages(stages, stage_tracing.stack_label(awsvars))
+        print("Finished Scalable AWS Architecture Creation")
+        return context
+
+    async def teardown(self, awsvars, access_key_id, secret_access_key):
+        print("Deleting Scalable AWS Architecture (async engine)")
+        # Reading the state file checks the recorded VPC, so it runs in the executor too
+        stages = await self.call(teardown_aws_architecture.delete_stages, awsvars, access_key_id, secret_access_key)
+        await self.run_stages(stages, stage_tracing.stack_label(awsvars))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_engine(coroutine_factory, max_workers):
+    engine = AsyncEngine(max_workers)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine_factory(engine))
+    finally:
+        loop.close()
+        engine.shutdown()
+
+
+def run_create_script(awsvars, access_key_id, secret_access_key):
+    return run_engine(lambda engine: engine.provision(awsvars, access_key_id, secret_access_key),
+                      awsvars.get('asyncWorkers', 16))
+
+
+def run_resume_script(awsvars, access_key_id, secret_access_key):
+    return run_engine(lambda engine: engine.provision(awsvars, access_key_id, secret_access_key, resume=True),
+                      awsvars.get('asyncWorkers', 16))
+
+
+def run_delete_script(awsvars, access_key_id, secret_access_key):
+    return run_engine(lambda engine: engine.teardown(awsvars, access_key_id, secret_access_key),
+                      awsvars.get('asyncWorkers', 16))
+
+
+def provision_stacks(stack_vars, access_key_id, secret_access_key, max_workers=32, max_stacks=None, resume=False):
+    # Drives every stack from one event loop, returns (context or exception, seconds) per stack
+    return run_stacks(lambda engine, awsvars: engine.provision(awsvars, access_key_id, secret_access_key, resume),
+                      stack_vars, max_workers, max_stacks)
+
+
+def teardown_stacks(stack_vars, access_key_id, secret_access_key, max_workers=32, max_stacks=None):
+    return run_stacks(lambda engine, awsvars: engine.teardown(awsvars, access_key_id, secret_access_key),
+                      stack_vars, max_workers, max_stacks)
+
+
+def run_stacks(run_stack, stack_vars, max_workers, max_stacks):
+    # At most max_stacks stacks run at a time, all of them sharing the engine's executor
+    async def run_all(engine):
+        running = asyncio.Semaphore(max_stacks or len(stack_vars) or 1)
+
+        async def timed(awsvars):
+            async with running:
+                print("Starting stack %s in %s" % (awsvars.get('stackId'), awsvars['region']))
+                started = time.time()
+                try:
+                    outcome = await run_stack(engine, awsvars)
+                except Exception as error:
+                    outcome = error
+                return outcome, time.time() - started
+
+        return await asyncio.gather(*[timed(awsvars) for awsvars in stack_vars])
+
+    return run_engine(run_all, max_workers)
@@ -1,13 +1,8 @@
-from ansible_vault import Vault
-import yaml
-import create_vpc
-import create_rds
-import create_alb
-import create_autoscaling_group
-import create_ec2_instance
-import create_cloudwatch_monitoring
-import create_sns_topics
-import teardown_aws_architecture
+from __future__ import print_function
+import argparse
+import cli
+import credentials
+import preflight
 
 #
 # (c) 23/10/2018 A.Dowling
@@ -19,43 +14,74 @@ import teardown_aws_architecture
 # Script creates cli interface to select menu options for creating aws infrastructure.
 # Allows users to create Fully Scalable Architecture.
 # Allows users to delete / tear down previously created Fully Scalable Architecture.
+# Allows users to resume a failed creation from the stages that did not complete.
 # Loads all Architecture variables for awsVariables.yml
 # Loads AWS API keys for use with boto3 from password protected encrypted ansible vault file vault.yml
+# Prints a summary of the API calls made and writes them to a JSON report after every action
+# Prints the critical path of every action and writes its timeline as a Chrome trace file
+# The actions, credentials and reports are shared with cli.py, the menu only adds the prompt loop
+# Create and resume are preflight checked first (preflight.py)
+#
+# Optional --engine async runs the stages on the asyncio engine (python 3.7+)
+# Optional --action create|delete|resume runs one action without the interactive menu
 #
 # command to run example: python awsMenu.py
+# command to run example: python awsMenu.py --engine async --action create
+
+try:
+    input = raw_input
+except NameError:
+    pass
+
+parser = argparse.ArgumentParser(description="Create or delete the Scalable AWS Architecture.")
+parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded',
+                    help="execution engine for the create and delete stages")
+parser.add_argument('--action', choices=['create', 'delete', 'resume'],
+                    help="run a single action instead of showing the menu")
+args = parser.parse_args()
+
+awsvars = cli.load_vars("awsVariables.yml")
 
-awsvars = yaml.load(open("awsVariables.yml"))
+access_key_id, secret_access_key = credentials.load_credentials('vault.yml', awsvars=awsvars)
 
-password = raw_input("Please enter API Key password: ")
-print("you entered" + password)
-vault = Vault(password)
+# Menu actions and the cli subcommands they run
+actions = {
+    'create': 'create',
+    'delete': 'destroy',
+    'resume': 'resume'
+}
 
-key_data = vault.load(open('vault.yml').read())
-secret_access_key = list(key_data.values())[0]
-access_key_id = list(key_data.values())[1]
+
+def run_action(action):
+    if action != 'delete':
+        try:
+            preflight.check(awsvars)
+        except preflight.PreflightError as error:
+            print(error)
+            return
+    cli.run_action(actions[action], awsvars, access_key_id, secret_access_key, args.engine)
+
+
+if args.action is not None:
+    run_action(args.action)
 
 menu = {}
 menu['1'] = "Create Scalable AWS Architecture."
 menu['2'] = "Delete Scalable AWS Architecture."
-menu['3'] = "Exit"
-while True:
-    options = menu.keys()
-    options.sort()
-    for entry in options:
-        print entry, menu[entry]
-
-    selection = raw_input("Please Select an Option:")
+menu['3'] = "Resume Scalable AWS Architecture Creation."
+menu['4'] = "Exit"
+while args.action is None:
+    for entry in sorted(menu):
+        print(entry, menu[entry])
+
+    selection = input("Please Select an Option:")
     if selection == '1':
-        create_vpc.run_vpc_script(awsvars, access_key_id, secret_access_key)
-        create_rds.run_rds_script(awsvars, access_key_id, secret_access_key)
-        create_ec2_instance.run_ec2_script(awsvars, access_key_id, secret_access_key)
-        create_alb.run_alb_script(awsvars, access_key_id, secret_access_key)
-        create_autoscaling_group.run_asg_script(awsvars, access_key_id, secret_access_key)
-        create_cloudwatch_monitoring.run_cloudwatch_script(awsvars, access_key_id, secret_access_key)
-        create_sns_topics.run_sns_topics_script(awsvars, access_key_id, secret_access_key)
+        run_action('create')
     elif selection == '2':
-        teardown_aws_architecture.run_delete_script(awsvars, access_key_id, secret_access_key)
+        run_action('delete')
     elif selection == '3':
+        run_action('resume')
+    elif selection == '4':
         break
     else:
-        print "Unknown Option Selected!"
+        print("Unknown Option Selected!")
@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import api_metrics
+import config_loader
+import create_architecture
+import credentials
+import preflight
+import rate_limiter
+import stage_tracing
+import teardown_aws_architecture
+from stage_scheduler import StageFailedError
+from subnet_planner import NAME_PREFIX_DEFAULTS
+
+
+#
+# batch.py version 1
+# boto3
+# python version 2.7.14
+#
+# Batch mode creating, resuming or deleting many copies of the Scalable AWS Architecture at once:
+#
+# Stacks are read from a list of variable files (stackId defaults to the file name)
+# or from one base file plus a stacks file of per-stack overrides, e.g.
+#   stacks:
+#     - stackId: team-a
+#     - stackId: team-b
+#       region: eu-west-2
+#       asgMaxSize: 6
+# A stack with a regions list is deployed to every region in it, regionOverrides sets per-region variables, e.g.
+#   regions: [eu-west-1, us-east-1]
+#   regionOverrides:
+#     us-east-1: {availabilityZone1: us-east-1a, availabilityZone2: us-east-1b, publicServerAMI: ami-0abc}
+# Every resource name variable is prefixed with the stack id, so stacks sharing an account and region never collide
+# Stacks run concurrently, at most --max-stacks at a time, each one on its own stage scheduler,
+# or with --engine async all of them on one event loop sharing one executor
+# Before a create or resume every stack is preflight checked, along with name and CIDR collisions between stacks
+# A failed stack does not stop the others, the result of every stack is printed (and written as JSON with --output)
+# API calls from every stack share the process wide rate limiter, clients and rate limits are kept per region
+# Results are also summed up per region, a multi-region run takes as long as its slowest region
+#
+# command to run example: python batch.py create --vars team-a.yml team-b.yml
+# command to run example: python batch.py create --vars awsVariables.yml --regions eu-west-1 us-east-1 ap-southeast-2
+# command to run example: python batch.py delete --base awsVariables.yml --stacks stacks.yml --max-stacks 8
+
+# Variables naming a resource that has to be unique per account and region, or is looked up by name
+NAME_VARIABLES = [
+    'vpcName', 'igName', 'publicSubnet1Name', 'publicSubnet2Name', 'privateSubnet1Name', 'privateSubnet2Name',
+    'publicSubnetNamePrefix', 'privateSubnetNamePrefix',
+    'publicRouteTable', 'privateRouteTable', 'eipName', 'natGatewayName',
+    'appGroupName', 'albGroupName', 'rdsGroupName',
+    'applicationSecurityGroupName', 'albSecurityGroupName', 'rdsSecurityGroupName',
+    'albName', 'albTag', 'targetGroupName', 'rdsSubnetGroupName', 'rdsDBId', 'publicServerName',
+    'asgLaunchConfigName', 'autoScalingGroupName', 'autoScalingGroupTag',
+    'statusCheckAlarmName', 'cpuAlarmName', 'scaleUpTopicName', 'scaleDownTopicName'
+]
+
+# RDS stores its identifiers in lower case
+LOWER_CASE_NAMES = set(['rdsDBId', 'rdsSubnetGroupName'])
+
+# Letters, digits and hyphens starting with a letter, which is valid inside every AWS resource name above
+STACK_ID_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9-]*$')
+
+ACTIONS = ['create', 'delete', 'resume']
+
+
+def namespace_names(awsvars, stack):
+    if not STACK_ID_PATTERN.match(stack):
+        raise ValueError("Invalid stack id %r, use letters, digits and hyphens starting with a letter" % stack)
+    stack_vars = dict(awsvars)
+    stack_vars['stackId'] = stack
+    for variable in NAME_VARIABLES:
+        # Planned subnet names are namespaced through their prefixes, defaults included
+        value = awsvars.get(variable, NAME_PREFIX_DEFAULTS.get(variable))
+        if value is None:
+            continue
+        name = "%s-%s" % (stack, value)
+        if variable in LOWER_CASE_NAMES:
+            name = name.lower()
+        stack_vars[variable] = name
+    return stack_vars
+
+
+def expand_regions(awsvars, regions=None):
+    # One set of variables per region, regions given on the command line replace the stack's own list
+    regions = regions or awsvars.get('regions') or [awsvars['region']]
+    region_overrides = awsvars.get('regionOverrides') or {}
+    region_stacks = []
+    for region in regions:
+        region_vars = dict(awsvars, region=region)
+        region_vars.pop('regions', None)
+        region_vars.pop('regionOverrides', None)
+        region_vars.update(region_overrides.get(region) or {})
+        region_stacks.append(region_vars)
+    return region_stacks
+
+
+def load_stacks(var_files=None, base_file=None, stacks_file=None, regions=None):
+    stacks = []
+    for path in var_files or []:
+        awsvars = config_loader.load_config(path)
+        stack = awsvars.get('stackId') or os.path.splitext(os.path.basename(path))[0]
+        stacks.extend(namespace_names(region_vars, stack) for region_vars in expand_regions(awsvars, regions))
+
+    if base_file is not None:
+        base = config_loader.load_config(base_file)
+        for index, overrides in enumerate(stack_entries(stacks_file)):
+            if not isinstance(overrides, dict):
+                raise ValueError("Entry %d in %s must be a mapping of variables, not %s %r"
+                                 % (index, stacks_file, type(overrides).__name__, overrides))
+            if not overrides.get('stackId'):
+                raise ValueError("Entry %d in %s needs a stackId" % (index, stacks_file))
+            config_loader.validate(overrides, "%s stack %s" % (stacks_file, overrides['stackId']), partial=True)
+            awsvars = dict(base, **overrides)
+            stacks.extend(namespace_names(region_vars, overrides['stackId'])
+                          for region_vars in expand_regions(awsvars, regions))
+
+    seen = set()
+    for awsvars in stacks:
+        key = (awsvars['stackId'], awsvars['region'])
+        if key in seen:
+            raise ValueError("Stack %s is listed twice for region %s" % key)
+        seen.add(key)
+    return stacks
+
+
+def stack_entries(stacks_file):
+    document = config_loader.load_yaml(stacks_file)
+    entries = document.get('stacks') if isinstance(document, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError("%s must be a mapping with a stacks list" % stacks_file)
+    return entries
+
+
+# Threaded engine script run by each action, every stack on its own stage scheduler
+ACTION_SCRIPTS = {
+    'create': create_architecture.run_create_script,
+    'delete': teardown_aws_architecture.run_delete_script,
+    'resume': create_architecture.run_resume_script
+}
+
+
+def run_stack(script, action, awsvars, access_key_id, secret_access_key):
+    print("Starting %s of stack %s in %s" % (action, awsvars['stackId'], awsvars['region']))
+    started = time.time()
+    error = None
+    try:
+        script(awsvars, access_key_id, secret_access_key)
+    except Exception as failure:
+        # One broken stack must not stop the others, the error is reported with its result
+        error = failure
+    return stack_result(action, awsvars, error, time.time() - started)
+
+
+def stack_result(action, awsvars, error, seconds):
+    result = {
+        'stackId': awsvars['stackId'],
+        'region': awsvars['region'],
+        'action': action,
+        'status': 'ok',
+        'failedStages': [],
+        'skippedStages': [],
+        'error': None
+    }
+    if isinstance(error, StageFailedError):
+        result['status'] = 'failed'
+        result['failedStages'] = sorted(error.failures)
+        result['skippedStages'] = sorted(error.skipped)
+        result['error'] = str(error)
+    elif error is not None:
+        result['status'] = 'failed'
+        result['error'] = "%s: %s" % (error.__class__.__name__, error)
+    result['seconds'] = round(seconds, 1)
+    print("Finished %s of stack %s in %s: %s" % (action, awsvars['stackId'], awsvars['region'], result['status']))
+    return result
+
+
+def run_batch(action, stacks, access_key_id, secret_access_key, max_stacks=4, engine='threaded'):
+    if engine == 'async':
+        return run_async_batch(action, stacks, access_key_id, secret_access_key, max_stacks)
+    script = ACTION_SCRIPTS[action]
+    executor = ThreadPoolExecutor(max_workers=max_stacks)
+    try:
+        futures = [executor.submit(run_stack, script, action, awsvars, access_key_id, secret_access_key)
+                   for awsvars in stacks]
+        # Results are kept in the order the stacks were listed
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=True)
+
+
+def run_async_batch(action, stacks, access_key_id, secret_access_key, max_stacks):
+    # Every stack runs on one event loop and one executor, rather than a loop and executor per stack
+    import async_engine
+    max_workers = max(awsvars.get('asyncWorkers', 16) for awsvars in stacks)
+    if action == 'delete':
+        runs = async_engine.teardown_stacks(stacks, access_key_id, secret_access_key, max_workers, max_stacks)
+    else:
+        runs = async_engine.provision_stacks(stacks, access_key_id, secret_access_key, max_workers, max_stacks,
+                                             resume=action == 'resume')
+    return [stack_result(action, awsvars, outcome if isinstance(outcome, Exception) else None, seconds)
+            for awsvars, (outcome, seconds) in zip(stacks, runs)]
+
+
+def region_summary(results):
+    regions = {}
+    for result in results:
+        summary = regions.setdefault(result['region'], {'region': result['region'], 'stacks': 0, 'failed': 0,
+                                                        'slowestSeconds': 0.0})
+        summary['stacks'] += 1
+        if result['status'] != 'ok':
+            summary['failed'] += 1
+        summary['slowestSeconds'] = max(summary['slowestSeconds'], result['seconds'])
+    return [regions[region] for region in sorted(regions)]
+
+
+def print_results(results, wall_seconds):
+    row_format = "%-24s %-14s %-8s %-8s %9s %s"
+    print(row_format % ('Stack', 'Region', 'Action', 'Status', 'Seconds', 'Failed stages'))
+    for result in results:
+        print(row_format % (result['stackId'], result['region'], result['action'], result['status'],
+                            "%.1f" % result['seconds'], ', '.join(result['failedStages']) or '-'))
+        if result['error'] and not result['failedStages']:
+            print("    " + result['error'])
+    regions = region_summary(results)
+    if len(regions) > 1:
+        region_format = "%-14s %7s %7s %16s"
+        print(region_format % ('Region', 'Stacks', 'Failed', 'Slowest stack s'))
+        for summary in regions:
+            print(region_format % (summary['region'], summary['stacks'], summary['failed'],
+                                   "%.1f" % summary['slowestSeconds']))
+    failed = len([result for result in results if result['status'] != 'ok'])
+    print("%d of %d stacks succeeded in %.1fs (%.1fs if run one after another)" % (
+        len(results) - failed, len(results), wall_seconds, sum(result['seconds'] for result in results)))
+
+
+def write_results(results, wall_seconds, path):
+    with open(path, 'w') as results_file:
+        json.dump({'wallSeconds': wall_seconds, 'regions': region_summary(results), 'stacks': results},
+                  results_file, indent=2, sort_keys=True)
+    print("Wrote batch results: " + path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create, resume or delete many Scalable AWS Architecture stacks.")
+    parser.add_argument('action', choices=ACTIONS, help="action to run on every stack")
+    parser.add_argument('--vars', nargs='+', metavar='FILE', help="one variables file per stack")
+    parser.add_argument('--base', metavar='FILE', help="variables shared by every stack in --stacks")
+    parser.add_argument('--stacks', metavar='FILE', help="per-stack overrides of the --base variables")
+    parser.add_argument('--regions', nargs='+', metavar='REGION',
+                        help="deploy every stack to these regions instead of its own region or regions list")
+    parser.add_argument('--max-stacks', type=int, default=4, help="stacks run at the same time")
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded',
+                        help="execution engine for the stages of each stack")
+    parser.add_argument('--vault', default='vault.yml', help="ansible vault file holding the AWS API keys")
+    parser.add_argument('--vault-password-file', help="file holding the vault password")
+    parser.add_argument('--profile', help="AWS profile to use instead of the vault")
+    parser.add_argument('--allow-cidr-overlap', action='store_true',
+                        help="allow stacks in the same region to use overlapping VPC CIDR blocks")
+    parser.add_argument('--output', help="write the per-stack results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if not args.vars and not args.base:
+        parser.error("give --vars or --base with --stacks")
+    if bool(args.base) != bool(args.stacks):
+        parser.error("--base and --stacks are used together")
+    if args.max_stacks < 1:
+        parser.error("--max-stacks must be at least 1")
+
+    try:
+        stacks = load_stacks(args.vars, args.base, args.stacks, args.regions)
+        if not stacks:
+            raise ValueError("%s lists no stacks" % args.stacks)
+        if args.action in ('create', 'resume'):
+            preflight.check_stacks(stacks, args.allow_cidr_overlap)
+    except ValueError as error:
+        parser.error(str(error))
+
+    # Decrypted once for the whole batch, however many stacks share the keys
+    access_key_id, secret_access_key = credentials.load_credentials(
+        args.vault, args.vault_password_file, args.profile, stacks[0])
+
+    started = time.time()
+    try:
+        results = run_batch(args.action, stacks, access_key_id, secret_access_key, args.max_stacks, args.engine)
+    finally:
+        # Metrics, limiter stats and the trace cover the whole batch, the critical path follows the stack
+        # that finished last
+        api_metrics.report_run(stacks[0])
+        rate_limiter.report_run(stacks[0])
+        stage_tracing.report_run(stacks[0])
+
+    wall_seconds = round(time.time() - started, 1)
+    print_results(results, wall_seconds)
+    if args.output:
+        write_results(results, wall_seconds, args.output)
+    return results
+
+
+if __name__ == '__main__':
+    sys.exit(0 if all(result['status'] == 'ok' for result in main()) else 1)
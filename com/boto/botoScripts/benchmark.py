@@ -0,0 +1,289 @@
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from botocore.awsrequest import AWSResponse
+# moto has to be imported before the boto3 session is created so its request hook is installed
+from moto import mock_aws
+import api_metrics
+import client_registry
+import config_loader
+import create_architecture
+import rate_limiter
+import stage_tracing
+import teardown_aws_architecture
+import waiter_multiplexer
+from stage_scheduler import StageFailedError
+
+
+#
+# benchmark.py version 1
+# boto3, moto 5
+# python version 3.8+ (moto 5 mock_aws)
+#
+# Offline benchmark of the create and teardown flows, no AWS account or credentials needed:
+#
+# Runs the full create (create_architecture) and teardown (run_delete_script) against moto in process
+# Injects per-operation API latency with botocore before-call hooks
+# Models the time real resources take to become available or deleted (RDS ~10 min, NAT ~2 min)
+# by rewriting the states moto reports until the modelled delay has passed
+# All latencies, delays, waiter intervals and rate limits are compressed by --time-scale
+# Every phase starts with fresh rate limiter buckets, so the modes can be run in any order
+# Reports wall time, API call count, peak concurrency and rate limiter wait time for each execution mode:
+#   sequential: one stage at a time, parallel: threaded stage scheduler, async: asyncio engine
+#
+# command to run example: python benchmark.py --vars awsVariables.yml --time-scale 0.01
+# command to run example: python benchmark.py --modes parallel async --latency CreateVpc=2 --output bench.json
+
+# Modelled API latency in seconds for operations not listed in OPERATION_LATENCY
+READ_LATENCY = 0.15
+WRITE_LATENCY = 0.4
+
+OPERATION_LATENCY = {
+    'CreateVpc': 1.0,
+    'RunInstances': 2.0,
+    'CreateLoadBalancer': 3.0,
+    'CreateDBInstance': 2.0,
+    'CreateLaunchConfiguration': 1.0,
+    'CreateAutoScalingGroup': 1.5,
+    'DeleteAutoScalingGroup': 2.0,
+    'DeleteLoadBalancer': 1.0,
+}
+
+# Modelled seconds for a resource to reach its final state
+RESOURCE_DELAYS = {
+    'rds_available': 600,
+    'rds_deleted': 300,
+    'nat_available': 120,
+    'nat_deleted': 60,
+    'instances_terminated': 60,
+}
+
+MODES = ['sequential', 'parallel', 'async']
+
+ACCESS_KEY_ID = 'testing'
+SECRET_ACCESS_KEY = 'testing'
+
+
+class AwsStandIn(object):
+    def __init__(self, time_scale, latency=None, delays=None):
+        self.time_scale = time_scale
+        self.latency = dict(OPERATION_LATENCY, **(latency or {}))
+        self.delays = dict(RESOURCE_DELAYS, **(delays or {}))
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.in_flight = 0
+            self.peak_in_flight = 0
+            # Times at which a modelled delay started, keyed by (event, resource id)
+            self.started = {}
+
+    def register(self, event_system):
+        event_system.register('before-call', self.before_call)
+        event_system.register('before-call.autoscaling.PutNotificationConfiguration', self.stub_response)
+        event_system.register('after-call', self.after_call)
+        event_system.register('after-call-error', self.call_finished)
+
+    def operation_latency(self, operation):
+        if operation in self.latency:
+            return self.latency[operation]
+        if operation.startswith(('Describe', 'List', 'Get')):
+            return READ_LATENCY
+        return WRITE_LATENCY
+
+    def before_call(self, model, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        time.sleep(self.operation_latency(model.name) * self.time_scale)
+
+    def stub_response(self, **kwargs):
+        # Operations moto does not implement are answered with an empty successful response
+        return AWSResponse(None, 200, {}, None), {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def call_finished(self, **kwargs):
+        with self.lock:
+            self.in_flight -= 1
+
+    def after_call(self, model, parsed, **kwargs):
+        self.call_finished()
+        rewrite = getattr(self, 'after_' + model.name, None)
+        if rewrite is not None and 'Error' not in parsed:
+            rewrite(parsed)
+
+    def start_delay(self, event, resource_id):
+        with self.lock:
+            self.started[(event, resource_id)] = time.time()
+
+    def delayed(self, event, resource_id):
+        started = self.started.get((event, resource_id))
+        return started is not None and time.time() - started < self.delays[event] * self.time_scale
+
+    def after_CreateDBInstance(self, parsed):
+        self.start_delay('rds_available', parsed['DBInstance']['DBInstanceIdentifier'])
+
+    def after_DescribeDBInstances(self, parsed):
+        for instance in parsed['DBInstances']:
+            if self.delayed('rds_available', instance['DBInstanceIdentifier']):
+                instance['DBInstanceStatus'] = 'creating'
+
+    def after_DeleteDBInstance(self, parsed):
+        # moto removes the instance straight away, so the deletion time is spent in the call itself
+        time.sleep(self.delays['rds_deleted'] * self.time_scale)
+
+    def after_CreateNatGateway(self, parsed):
+        self.start_delay('nat_available', parsed['NatGateway']['NatGatewayId'])
+
+    def after_DeleteNatGateway(self, parsed):
+        self.start_delay('nat_deleted', parsed['NatGatewayId'])
+
+    def after_DescribeNatGateways(self, parsed):
+        for nat_gateway in parsed['NatGateways']:
+            if self.delayed('nat_deleted', nat_gateway['NatGatewayId']):
+                nat_gateway['State'] = 'deleting'
+            elif self.delayed('nat_available', nat_gateway['NatGatewayId']):
+                nat_gateway['State'] = 'pending'
+
+    def after_TerminateInstances(self, parsed):
+        for instance in parsed['TerminatingInstances']:
+            self.start_delay('instances_terminated', instance['InstanceId'])
+
+    def after_DescribeInstances(self, parsed):
+        for reservation in parsed['Reservations']:
+            for instance in reservation['Instances']:
+                if self.delayed('instances_terminated', instance['InstanceId']):
+                    instance['State'] = {'Code': 32, 'Name': 'shutting-down'}
+
+    def after_PutScalingPolicy(self, parsed):
+        # moto leaves the policy ARN out of the response
+        parsed.setdefault('PolicyARN', 'arn:aws:autoscaling:policy/benchmark-%d' % id(parsed))
+
+
+def engine_scripts(mode):
+    if mode == 'async':
+        import async_engine
+        return async_engine.run_create_script, async_engine.run_delete_script
+    return create_architecture.run_create_script, teardown_aws_architecture.run_delete_script
+
+
+def peak_stage_concurrency():
+    # Largest number of stage spans open at the same time
+    changes = []
+    for span in stage_tracing.tracer.spans:
+        if span.category == stage_tracing.STAGE:
+            changes.append((span.start, 1))
+            changes.append((span.start + span.duration(), -1))
+    peak = running = 0
+    for _, change in sorted(changes):
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def run_phase(name, script, awsvars, stand_in):
+    stand_in.reset()
+    api_metrics.metrics.reset()
+    stage_tracing.tracer.reset()
+    # Fresh buckets for every run, refilling in modelled time like the latencies and delays they are compared with
+    rate_limiter.limiter.reset(stand_in.time_scale)
+    rate_limiter.limiter.configure(awsvars)
+    failed = []
+    started = time.time()
+    try:
+        script(awsvars, ACCESS_KEY_ID, SECRET_ACCESS_KEY)
+    except StageFailedError as error:
+        failed = sorted(error.failures)
+        print("%s stages failed: %s" % (name, error))
+    return {
+        'wallSeconds': round(time.time() - started, 2),
+        'apiCalls': api_metrics.metrics.totals()['calls'],
+        'peakApiCallsInFlight': stand_in.peak_in_flight,
+        'peakStagesRunning': peak_stage_concurrency(),
+        'rateLimitWaitSeconds': round(rate_limiter.limiter.wait_seconds(), 2),
+        'failedStages': failed
+    }
+
+
+def run_mode(mode, awsvars, stand_in):
+    mode_vars = dict(awsvars)
+    mode_vars['stateDir'] = tempfile.mkdtemp(prefix='benchmark-state-')
+    if mode == 'sequential':
+        mode_vars['maxStageWorkers'] = 1
+    create_script, delete_script = engine_scripts(mode)
+
+    print("Benchmarking %s mode" % mode)
+    try:
+        with mock_aws():
+            create = run_phase('create', create_script, mode_vars, stand_in)
+            teardown = run_phase('teardown', delete_script, mode_vars, stand_in)
+    finally:
+        shutil.rmtree(mode_vars['stateDir'], ignore_errors=True)
+    return {'mode': mode, 'create': create, 'teardown': teardown}
+
+
+def print_results(results, time_scale):
+    print("Benchmark results (time scale %s, modelled seconds = wall seconds / time scale)" % time_scale)
+    row_format = "%-12s %-9s %10s %12s %10s %14s %12s %14s %s"
+    print(row_format % ('Mode', 'Phase', 'Wall s', 'Modelled s', 'API calls', 'Peak in flight',
+                        'Peak stages', 'Rate limit s', 'Failed stages'))
+    for result in results:
+        for phase in ('create', 'teardown'):
+            measured = result[phase]
+            print(row_format % (result['mode'], phase, "%.2f" % measured['wallSeconds'],
+                                "%.0f" % (measured['wallSeconds'] / time_scale), measured['apiCalls'],
+                                measured['peakApiCallsInFlight'], measured['peakStagesRunning'],
+                                "%.2f" % measured['rateLimitWaitSeconds'],
+                                ', '.join(measured['failedStages']) or '-'))
+
+
+def parse_overrides(pairs, known=None):
+    overrides = {}
+    for pair in pairs or []:
+        name, _, seconds = pair.partition('=')
+        if not seconds or (known is not None and name not in known):
+            raise ValueError("Invalid override %r, expected NAME=SECONDS%s" % (
+                pair, " with NAME one of " + ", ".join(sorted(known)) if known else ""))
+        overrides[name] = float(seconds)
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the create and teardown flows against moto.")
+    parser.add_argument('--vars', default='awsVariables.yml', help="architecture variables file")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES, help="execution modes to run")
+    parser.add_argument('--time-scale', type=float, default=0.01,
+                        help="factor applied to every modelled latency, delay and waiter interval")
+    parser.add_argument('--latency', action='append', metavar='OPERATION=SECONDS',
+                        help="override the modelled latency of one API operation")
+    parser.add_argument('--delay', action='append', metavar='EVENT=SECONDS',
+                        help="override a modelled resource delay: " + ", ".join(sorted(RESOURCE_DELAYS)))
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if 'async' in args.modes and sys.version_info < (3, 7):
+        parser.error("the async mode needs python 3.7+")
+
+    awsvars = config_loader.load_config(args.vars)
+
+    stand_in = AwsStandIn(args.time_scale, parse_overrides(args.latency),
+                          parse_overrides(args.delay, RESOURCE_DELAYS))
+    # Hooks are copied into clients when they are created, so register before any client exists
+    stand_in.register(client_registry.get_session(ACCESS_KEY_ID, SECRET_ACCESS_KEY).events)
+    waiter_multiplexer.set_time_scale(args.time_scale)
+
+    results = [run_mode(mode, awsvars, stand_in) for mode in args.modes]
+    print_results(results, args.time_scale)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'timeScale': args.time_scale, 'results': results}, output_file, indent=2)
+        print("Wrote benchmark results: " + args.output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import importlib
+import sys
+
+
+#
+# cli.py version 1
+# boto3
+# python version 2.7.14
+#
+# Non-interactive command line entry point for scripted use (CI, cron):
+#
+# Subcommands: create, destroy, resume, plan, status and stage (runs one create stage standalone)
+# Modules are imported when a subcommand needs them, so --help starts without loading boto3 or the vault,
+# plan makes no API calls and needs no credentials, and status only creates an EC2 client
+# create, resume and stage run the preflight checks before loading credentials or calling AWS
+# Credentials come from credentials.py: a vault password file, an AWS profile or the environment,
+# otherwise the vault password is prompted for without echo
+#
+# command to run example: python cli.py create --vault-password-file ~/.vault_pass
+# command to run example: AWS_PROFILE=ci python cli.py status
+# command to run example: python cli.py stage alb --vars team-a.yml
+
+# Commands creating resources, preflight checked before any credentials are loaded
+PREFLIGHT_COMMANDS = ['create', 'resume', 'stage']
+
+# (module, function) run by each action, per execution engine
+ACTION_SCRIPTS = {
+    'threaded': {
+        'create': ('create_architecture', 'run_create_script'),
+        'destroy': ('teardown_aws_architecture', 'run_delete_script'),
+        'resume': ('create_architecture', 'run_resume_script')
+    },
+    'async': {
+        'create': ('async_engine', 'run_create_script'),
+        'destroy': ('async_engine', 'run_delete_script'),
+        'resume': ('async_engine', 'run_resume_script')
+    }
+}
+
+# (module, function) of each create stage run standalone, reading the other stages' ids from the state file
+STAGE_SCRIPTS = {
+    'vpc': ('create_vpc', 'run_vpc_script'),
+    'rds': ('create_rds', 'run_rds_script'),
+    'ec2': ('create_ec2_instance', 'run_ec2_script'),
+    'alb': ('create_alb', 'run_alb_script'),
+    'asg': ('create_autoscaling_group', 'run_asg_script'),
+    'cloudwatch': ('create_cloudwatch_monitoring', 'run_cloudwatch_script'),
+    'sns': ('create_sns_topics', 'run_sns_topics_script')
+}
+
+
+def load_function(target):
+    module_name, function_name = target
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def load_vars(path):
+    import config_loader
+    return config_loader.load_config(path)
+
+
+def report_run(awsvars):
+    import api_metrics
+    import rate_limiter
+    import stage_tracing
+    api_metrics.report_run(awsvars)
+    rate_limiter.report_run(awsvars)
+    stage_tracing.report_run(awsvars)
+
+
+def run_action(action, awsvars, access_key_id, secret_access_key, engine='threaded'):
+    script = load_function(ACTION_SCRIPTS[engine][action])
+    try:
+        return script(awsvars, access_key_id, secret_access_key)
+    finally:
+        report_run(awsvars)
+
+
+def run_stage(name, awsvars, access_key_id, secret_access_key):
+    from stack_state import StackState
+    script = load_function(STAGE_SCRIPTS[name])
+    try:
+        result = script(awsvars, access_key_id, secret_access_key)
+    finally:
+        report_run(awsvars)
+    # Checkpointed like a stage of a full create, so a later resume skips it
+    StackState(awsvars).mark_completed(name)
+    return result
+
+
+def show_plan(awsvars):
+    # Makes no API calls, the stage graph and the state file are enough
+    from create_architecture import create_stages
+    from stack_context import StackContext
+    from stack_state import StackState
+    from stage_scheduler import resolve_dependencies
+    from subnet_planner import plan_nat_gateways, plan_subnets
+
+    state = StackState(awsvars)
+    stages = create_stages(awsvars, None, None, StackContext(), state)
+    dependencies = resolve_dependencies(stages)
+    print("Stack %s in %s, state file %s (%s)" % (
+        state.stack_id, state.region, state.path, "found" if state.exists() else "not found"))
+    for stage in stages:
+        status = "completed, resume skips it" if state.is_completed(stage.name) else "to run"
+        after = ", ".join(sorted(dependencies[stage.name])) or "-"
+        print("  %-12s after %-24s %s" % (stage.name, after, status))
+    print("Resources: VPC %s (%s), Load Balancer %s, AutoScaling Group %s, RDS %s" % (
+        awsvars['vpcName'], awsvars['vpcCidrBlock'], awsvars['albName'], awsvars['autoScalingGroupName'],
+        awsvars['rdsDBId']))
+    try:
+        planned = plan_subnets(awsvars)
+    except ValueError as error:
+        # Reported with the preflight checks
+        print("Subnets: " + str(error))
+        return
+    print("Subnets:")
+    for subnet in planned:
+        print("  %-24s %-8s %-16s %s" % (subnet.name, subnet.tier, subnet.zone, subnet.cidr))
+    print("NAT Gateways:")
+    for nat_gateway in plan_nat_gateways(awsvars):
+        print("  %-24s %-8s %-16s %s" % (nat_gateway.name, 'public', nat_gateway.zone, nat_gateway.route_table_name))
+
+
+def show_status(awsvars, access_key_id, secret_access_key):
+    # Only the EC2 client is created, every lookup is filtered on the stack's VPC
+    import client_registry
+    from botocore.exceptions import ClientError
+    from stack_state import StackState
+    from tagging import STACK_TAG_KEY
+
+    state = StackState(awsvars)
+    print("Stack %s in %s, completed stages: %s" % (
+        state.stack_id, state.region, ", ".join(state.completed_stages) or "-"))
+    ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+
+    vpcs = []
+    if state.get('vpc_id'):
+        try:
+            vpcs = ec2_client.describe_vpcs(VpcIds=[state.get('vpc_id')])['Vpcs']
+        except ClientError as error:
+            if 'NotFound' not in error.response['Error']['Code']:
+                raise
+    if not vpcs:
+        vpcs = ec2_client.describe_vpcs(
+            Filters=[{'Name': 'tag:' + STACK_TAG_KEY, 'Values': [state.stack_id]}])['Vpcs']
+    if not vpcs:
+        print("Stack is not deployed")
+        return False
+
+    vpc_filter = [{'Name': 'vpc-id', 'Values': [vpcs[0]['VpcId']]}]
+    subnets = ec2_client.describe_subnets(Filters=vpc_filter)['Subnets']
+    nat_gateways = ec2_client.describe_nat_gateways(Filters=vpc_filter)['NatGateways']
+    reservations = ec2_client.describe_instances(Filters=vpc_filter)['Reservations']
+    instance_states = {}
+    for reservation in reservations:
+        for instance in reservation['Instances']:
+            name = instance['State']['Name']
+            instance_states[name] = instance_states.get(name, 0) + 1
+
+    print("VPC %s: %s" % (vpcs[0]['VpcId'], vpcs[0]['State']))
+    print("Subnets: %d" % len(subnets))
+    print("NAT Gateways: " + (", ".join("%s %s" % (nat['NatGatewayId'], nat['State'])
+                                        for nat in nat_gateways) or "-"))
+    print("Instances: " + (", ".join("%d %s" % (count, name)
+                                     for name, count in sorted(instance_states.items())) or "-"))
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Create, inspect or delete the Scalable AWS Architecture.")
+    parser.add_argument('--vars', default='awsVariables.yml', help="architecture variables file")
+    parser.add_argument('--vault', default='vault.yml', help="ansible vault file holding the AWS API keys")
+    parser.add_argument('--vault-password-file', help="file holding the vault password")
+    parser.add_argument('--profile', help="AWS profile to use instead of the vault")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    for action, description in [('create', "create the architecture"),
+                                ('destroy', "delete the architecture"),
+                                ('resume', "continue a failed create from the stages that did not complete")]:
+        action_parser = subparsers.add_parser(action, help=description)
+        action_parser.add_argument('--engine', choices=sorted(ACTION_SCRIPTS), default='threaded',
+                                   help="execution engine for the stages")
+    subparsers.add_parser('plan', help="show the stages a create would run, without calling AWS")
+    subparsers.add_parser('status', help="show the deployed VPC, subnets, NAT Gateways and instances")
+    stage_parser = subparsers.add_parser('stage', help="run one create stage on its own")
+    stage_parser.add_argument('name', choices=sorted(STAGE_SCRIPTS))
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        awsvars = load_vars(args.vars)
+    except ValueError as error:
+        # Invalid variables fail here, before any resource is created
+        parser.error(str(error))
+
+    import preflight
+    if args.command == 'plan':
+        show_plan(awsvars)
+        try:
+            preflight.check(awsvars)
+        except preflight.PreflightError as error:
+            print(error)
+            return 1
+        return 0
+    if args.command in PREFLIGHT_COMMANDS:
+        try:
+            preflight.check(awsvars)
+        except preflight.PreflightError as error:
+            print(error)
+            return 1
+
+    import credentials
+    try:
+        access_key_id, secret_access_key = credentials.load_credentials(
+            args.vault, args.vault_password_file, args.profile, awsvars)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.command == 'status':
+        return 0 if show_status(awsvars, access_key_id, secret_access_key) else 1
+    if args.command == 'stage':
+        run_stage(args.name, awsvars, access_key_id, secret_access_key)
+        return 0
+
+    from stage_scheduler import StageFailedError
+    try:
+        run_action(args.command, awsvars, access_key_id, secret_access_key, args.engine)
+    except StageFailedError as error:
+        print(error)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import threading
+import boto3
+import api_metrics
+import rate_limiter
+from botocore.config import Config
+
+
+#
+# client_registry.py version 1
+# boto3
+# python version 2.7.14
+#
+# Shared boto3 session and client registry used by all scripts:
+#
+# One boto3 session per set of API keys, created once per process
+# Clients cached per service and region, sharing the session's loaded service models
+# Resources cached per thread as boto3 resources are not thread safe
+# Connection pool size, TCP keep-alive and retry mode read from awsVariables.yml:
+#   maxPoolConnections (default 25), tcpKeepAlive (default True),
+#   retryMode (default standard), retryMaxAttempts (default 5)
+# Every session is registered with api_metrics, so all API calls are counted and timed
+# and with rate_limiter, so all API calls share the per service token buckets
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_resources = threading.local()
+
+
+def client_config(awsvars):
+    return Config(
+        region_name=awsvars['region'],
+        max_pool_connections=awsvars.get('maxPoolConnections', 25),
+        tcp_keepalive=awsvars.get('tcpKeepAlive', True),
+        retries={
+            'mode': awsvars.get('retryMode', 'standard'),
+            'max_attempts': awsvars.get('retryMaxAttempts', 5)
+        }
+    )
+
+
+def get_session(access_key_id, secret_access_key):
+    with _lock:
+        return _get_session(access_key_id, secret_access_key)
+
+
+def _get_session(access_key_id, secret_access_key):
+    key = (access_key_id, secret_access_key)
+    if key not in _sessions:
+        _sessions[key] = boto3.session.Session(
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key
+        )
+        # Clients copy the session's event hooks when they are created
+        api_metrics.metrics.register(_sessions[key].events)
+        rate_limiter.limiter.register(_sessions[key].events)
+    return _sessions[key]
+
+
+def _cache_key(service, awsvars, access_key_id, secret_access_key):
+    return (service, awsvars['region'], access_key_id, secret_access_key,
+            awsvars.get('maxPoolConnections', 25), awsvars.get('tcpKeepAlive', True),
+            awsvars.get('retryMode', 'standard'), awsvars.get('retryMaxAttempts', 5))
+
+
+def get_client(service, awsvars, access_key_id, secret_access_key):
+    key = _cache_key(service, awsvars, access_key_id, secret_access_key)
+    with _lock:
+        if key not in _clients:
+            # Session.client is not thread safe, so clients are only ever built under the lock
+            session = _get_session(access_key_id, secret_access_key)
+            rate_limiter.limiter.configure(awsvars)
+            _clients[key] = session.client(service, config=client_config(awsvars))
+            rate_limiter.limiter.add_client(_clients[key])
+        return _clients[key]
+
+
+def get_resource(service, awsvars, access_key_id, secret_access_key):
+    key = _cache_key(service, awsvars, access_key_id, secret_access_key)
+    cache = getattr(_resources, 'cache', None)
+    if cache is None:
+        cache = _resources.cache = {}
+    if key not in cache:
+        with _lock:
+            session = _get_session(access_key_id, secret_access_key)
+            rate_limiter.limiter.configure(awsvars)
+            cache[key] = session.resource(service, config=client_config(awsvars))
+            rate_limiter.limiter.add_client(cache[key].meta.client)
+    return cache[key]
@@ -0,0 +1,411 @@
+import copy
+import difflib
+import hashlib
+import threading
+import yaml
+from rate_limiter import DESCRIBE, MUTATE, RATE_LIMIT_SCOPES
+from security_group_rules import PROTOCOLS, RULE_KEYS, TIERS, port_range
+
+
+#
+# config_loader.py version 1
+# boto3
+# python version 2.7.14
+#
+# Loads and validates awsVariables.yml before anything is created:
+#
+# Typed schema of every variable the scripts read, required and optional
+# The two zone subnet variables are only required when availabilityZones is not set
+# Parsed with the libyaml C loader when PyYAML was built with it
+# Every problem is collected and raised together as one ConfigError:
+#   missing or mistyped variables, values outside their choices or ranges,
+#   and unknown variables (with the closest known name)
+#   rateLimits entries for a service the rate limiter does not know, which would never apply,
+#   and rateLimits categories that are not a mapping of a positive rate and burst
+#   securityGroupRules tiers, rule keys, protocols, ports and source groups (the CIDRs are parsed by preflight.py)
+# Validated configs are cached per process keyed by the SHA-256 of the file,
+# so batch runs loading the same file for many stacks parse and validate it once
+
+STRING = 'string'
+INTEGER = 'integer'
+NUMBER = 'number'
+BOOLEAN = 'boolean'
+LIST = 'list'
+MAPPING = 'mapping'
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+PYTHON_TYPES = {
+    STRING: STRING_TYPES,
+    INTEGER: (int,),
+    NUMBER: (int, float),
+    BOOLEAN: (bool,),
+    LIST: (list,),
+    MAPPING: (dict,)
+}
+
+REQUIRED_VARIABLES = {
+    # VPC
+    'region': STRING,
+    'vpcCidrBlock': STRING,
+    'vpcName': STRING,
+    'igName': STRING,
+    'publicRouteTable': STRING,
+    'privateRouteTable': STRING,
+    'eipName': STRING,
+    'natGatewayName': STRING,
+    # Security Groups
+    'appGroupName': STRING,
+    'albGroupName': STRING,
+    'rdsGroupName': STRING,
+    'applicationSecurityGroupName': STRING,
+    'albSecurityGroupName': STRING,
+    'rdsSecurityGroupName': STRING,
+    # Load Balancer
+    'albName': STRING,
+    'scheme': STRING,
+    'albTag': STRING,
+    'lbType': STRING,
+    'ipAddressType': STRING,
+    'targetGroupName': STRING,
+    'protocol': STRING,
+    'port': INTEGER,
+    'httpPort': STRING,
+    'pathPattern': STRING,
+    'healthCheckIntervalSeconds': INTEGER,
+    'healthCheckTimeoutSeconds': INTEGER,
+    'healthyThresholdCount': INTEGER,
+    'unhealthyThresholdCount': INTEGER,
+    'httpCode': STRING,
+    'targetType': STRING,
+    'listenerType': STRING,
+    'forwardType': STRING,
+    # RDS
+    'rdsSubnetGroupName': STRING,
+    'subnetGroupDesc': STRING,
+    'rdsDBId': STRING,
+    'rdsStorage': INTEGER,
+    'rdsDBName': STRING,
+    'rdsEngine': STRING,
+    'rdsStorageType': STRING,
+    'rdsMasterUser': STRING,
+    'rdsMasterPassword': STRING,
+    'rdsInstanceClass': STRING,
+    # EC2
+    'publicServerAMI': STRING,
+    'publicServerName': STRING,
+    'instanceType': STRING,
+    'keyPairName': STRING,
+    'ec2Count': INTEGER,
+    # AutoScaling
+    'asgLaunchConfigName': STRING,
+    'asgAMI': STRING,
+    'autoScalingGroupName': STRING,
+    'asgMinSize': INTEGER,
+    'asgMaxSize': INTEGER,
+    'asgDesiredSize': INTEGER,
+    'asgCoolDown': INTEGER,
+    'asgHealthCheckType': STRING,
+    'asgTerminationPolicies': STRING,
+    'autoScalingGroupTag': STRING,
+    'scaleOutPolicyNameSC': STRING,
+    'scaleInPolicyNameSC': STRING,
+    'scaleOutPolicyNameCPU': STRING,
+    'scaleInPolicyNameCPU': STRING,
+    'scalingPolicyType': STRING,
+    'adjustmentType': STRING,
+    'adjustmentCount': INTEGER,
+    'scaleInAdjustment': INTEGER,
+    'scalingCoolDown': INTEGER,
+    # CloudWatch
+    'statusCheckAlarmName': STRING,
+    'cpuAlarmName': STRING,
+    'operator': STRING,
+    'evaluationPeriods': INTEGER,
+    'statusCheckMetric': STRING,
+    'cpuMetric': STRING,
+    'nameSpace': STRING,
+    'period': INTEGER,
+    'scStatistic': STRING,
+    'cpuStatistic': STRING,
+    'scThreshold': NUMBER,
+    'cpuThreshold': NUMBER,
+    'scFailDescription': STRING,
+    'cpuHighDescription': STRING,
+    'scUnit': STRING,
+    'cpuUnit': STRING,
+    # SNS
+    'scaleUpTopicName': STRING,
+    'scaleDownTopicName': STRING,
+    'attributeName': STRING,
+    'scaleUpNotificationName': STRING,
+    'scaleDownNotificationName': STRING,
+    'topicProtocol': STRING,
+    'emailAddress': STRING,
+    'instanceLaunchNotification': STRING,
+    'instanceTerminateNotification': STRING
+}
+
+# Two zone subnets, required unless availabilityZones has the subnets planned (subnet_planner.py)
+SUBNET_VARIABLES = {
+    'publicSubnet1CidrBlock': STRING,
+    'publicSubnet2CidrBlock': STRING,
+    'privateSubnet1CidrBlock': STRING,
+    'privateSubnet2CidrBlock': STRING,
+    'availabilityZone1': STRING,
+    'availabilityZone2': STRING,
+    'azZone1': STRING,
+    'azZone2': STRING,
+    'publicSubnet1Name': STRING,
+    'publicSubnet2Name': STRING,
+    'privateSubnet1Name': STRING,
+    'privateSubnet2Name': STRING
+}
+
+OPTIONAL_VARIABLES = {
+    'stackId': STRING,
+    # Planned subnets
+    'availabilityZones': LIST,
+    'subnetPrefixLength': INTEGER,
+    'publicSubnetNamePrefix': STRING,
+    'privateSubnetNamePrefix': STRING,
+    'natGatewayPerZone': BOOLEAN,
+    'sshCidrBlock1': STRING,
+    'sshCidrBlock2': STRING,
+    'sshCidrBlock3': STRING,
+    'securityGroupRules': MAPPING,
+    # Execution
+    'maxStageWorkers': INTEGER,
+    'asyncWorkers': INTEGER,
+    'stateDir': STRING,
+    # Clients
+    'maxPoolConnections': INTEGER,
+    'tcpKeepAlive': BOOLEAN,
+    'retryMode': STRING,
+    'retryMaxAttempts': INTEGER,
+    'rateLimiting': BOOLEAN,
+    'rateLimits': MAPPING,
+    # Reports
+    'apiMetricsReport': STRING,
+    'traceFile': STRING,
+    # Credentials
+    'vaultAccessKeyName': STRING,
+    'vaultSecretKeyName': STRING,
+    'credentialCacheTtl': INTEGER,
+    'credentialCacheDir': STRING,
+    # Multi-region
+    'regions': LIST,
+    'regionOverrides': MAPPING
+}
+
+CHOICES = {
+    'scheme': ['internet-facing', 'internal'],
+    'ipAddressType': ['ipv4', 'dualstack'],
+    'asgHealthCheckType': ['EC2', 'ELB'],
+    'retryMode': ['legacy', 'standard', 'adaptive']
+}
+
+# Type of every item of a list variable
+ITEM_TYPES = {
+    'availabilityZones': STRING,
+    'regions': STRING
+}
+
+# Counts and sizes that cannot be negative
+NON_NEGATIVE_VARIABLES = [
+    'rdsStorage', 'ec2Count', 'asgMinSize', 'asgMaxSize', 'asgDesiredSize', 'asgCoolDown', 'scalingCoolDown',
+    'retryMaxAttempts', 'credentialCacheTtl', 'subnetPrefixLength'
+]
+
+# Worker and connection pool sizes, a pool of 0 workers cannot run anything
+POSITIVE_VARIABLES = ['maxStageWorkers', 'asyncWorkers', 'maxPoolConnections']
+
+SCHEMA = dict(REQUIRED_VARIABLES, **dict(SUBNET_VARIABLES, **OPTIONAL_VARIABLES))
+
+# The libyaml loader is many times faster, PyYAML falls back to the pure python loader without it
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_lock = threading.Lock()
+# Validated configs keyed by the SHA-256 of the file they were loaded from
+_configs = {}
+
+
+class ConfigError(ValueError):
+    def __init__(self, source, errors):
+        self.source = source
+        self.errors = errors
+        super(ConfigError, self).__init__(
+            "Invalid variables in %s:\n  %s" % (source, "\n  ".join(errors)))
+
+
+def type_error(name, value, expected):
+    article = 'an' if expected[0] in 'aeiou' else 'a'
+    # bool is an int in python, so True is not accepted as a size or count
+    if isinstance(value, bool) and expected != BOOLEAN:
+        return "%s must be %s %s, not %r" % (name, article, expected, value)
+    if not isinstance(value, PYTHON_TYPES[expected]):
+        return "%s must be %s %s, not %s %r" % (name, article, expected, type(value).__name__, value)
+    return None
+
+
+def validate(awsvars, source='awsVariables.yml', partial=False):
+    # partial checks only the variables present, e.g. per-region overrides
+    if not isinstance(awsvars, dict):
+        raise ConfigError(source, ["expected a mapping of variables, not %s" % type(awsvars).__name__])
+    errors = []
+    if not partial:
+        required = list(REQUIRED_VARIABLES)
+        if not awsvars.get('availabilityZones'):
+            required.extend(SUBNET_VARIABLES)
+        missing = sorted(name for name in required if name not in awsvars)
+        if missing:
+            errors.append("missing: " + ", ".join(missing))
+
+    for name in sorted(awsvars):
+        value = awsvars[name]
+        if name not in SCHEMA:
+            close = difflib.get_close_matches(name, list(SCHEMA), 1)
+            errors.append("unknown variable %s%s" % (name, ", did you mean %s?" % close[0] if close else ""))
+            continue
+        error = type_error(name, value, SCHEMA[name])
+        if error:
+            errors.append(error)
+        elif name in CHOICES and value not in CHOICES[name]:
+            errors.append("%s must be one of %s, not %r" % (name, ", ".join(CHOICES[name]), value))
+        elif name in NON_NEGATIVE_VARIABLES and value < 0:
+            errors.append("%s must not be negative, not %r" % (name, value))
+        elif name in POSITIVE_VARIABLES and value < 1:
+            errors.append("%s must be at least 1, not %r" % (name, value))
+        elif name in ITEM_TYPES:
+            errors.extend(filter(None, (type_error("%s[%d]" % (name, index), item, ITEM_TYPES[name])
+                                        for index, item in enumerate(value))))
+        elif name == 'rateLimits':
+            errors.extend(rate_limit_errors(value))
+        elif name == 'securityGroupRules':
+            errors.extend(security_group_rule_errors(value))
+
+    for region, overrides in sorted((awsvars.get('regionOverrides') or {}).items()):
+        try:
+            validate(overrides or {}, "%s regionOverrides %s" % (source, region), partial=True)
+        except ConfigError as error:
+            errors.extend("regionOverrides %s: %s" % (region, message) for message in error.errors)
+
+    if errors:
+        raise ConfigError(source, errors)
+    return awsvars
+
+
+def rate_limit_errors(rate_limits):
+    errors = []
+    for scope in sorted(rate_limits):
+        if scope not in RATE_LIMIT_SCOPES:
+            close = difflib.get_close_matches(scope, RATE_LIMIT_SCOPES, 1)
+            errors.append("unknown rateLimits service %s%s (services are named by endpoint prefix: %s)" % (
+                scope, ", did you mean %s?" % close[0] if close else "", ", ".join(RATE_LIMIT_SCOPES[1:])))
+        elif not isinstance(rate_limits[scope], dict):
+            errors.append(type_error("rateLimits %s" % scope, rate_limits[scope], MAPPING))
+        else:
+            for category in sorted(rate_limits[scope]):
+                if category not in (DESCRIBE, MUTATE):
+                    errors.append("unknown rateLimits %s category %s, use %s or %s"
+                                  % (scope, category, DESCRIBE, MUTATE))
+                else:
+                    errors.extend(limit_errors("rateLimits %s %s" % (scope, category), rate_limits[scope][category]))
+    return errors
+
+
+def limit_errors(name, limits):
+    # Either setting can be left out to keep its default
+    if not isinstance(limits, dict):
+        return [type_error(name, limits, MAPPING)]
+    errors = ["unknown %s setting %s, use rate or burst" % (name, key) for key in sorted(limits)
+              if key not in ('rate', 'burst')]
+    for key in ('rate', 'burst'):
+        if key not in limits:
+            continue
+        error = type_error("%s %s" % (name, key), limits[key], NUMBER)
+        if error:
+            errors.append(error)
+        elif limits[key] <= 0:
+            errors.append("%s %s must be greater than 0, not %r" % (name, key, limits[key]))
+        elif key == 'burst' and limits[key] < 1:
+            # A bucket holding less than one token never lets a call through
+            errors.append("%s burst must be at least 1, not %r" % (name, limits[key]))
+    return errors
+
+
+def security_group_rule_errors(rules):
+    errors = []
+    for tier in sorted(rules):
+        name = "securityGroupRules %s" % tier
+        if tier not in TIERS:
+            errors.append("unknown securityGroupRules tier %s, use %s" % (tier, ", ".join(TIERS)))
+        elif not isinstance(rules[tier], list):
+            errors.append(type_error(name, rules[tier], LIST))
+        else:
+            for index, rule in enumerate(rules[tier]):
+                errors.extend(rule_errors("%s[%d]" % (name, index), rule))
+    return errors
+
+
+def rule_errors(name, rule):
+    if not isinstance(rule, dict):
+        return [type_error(name, rule, MAPPING)]
+    errors = ["unknown %s key %s, use %s" % (name, key, ", ".join(RULE_KEYS))
+              for key in sorted(rule) if key not in RULE_KEYS]
+    protocol = rule.get('protocol')
+    if not isinstance(protocol, STRING_TYPES) or protocol.lower() not in PROTOCOLS:
+        errors.append("%s protocol must be one of %s, not %r" % (name, ", ".join(PROTOCOLS), protocol))
+    ports = rule.get('ports')
+    if not isinstance(ports, list) or not ports:
+        errors.append("%s ports must be a list of ports and from-to ranges, not %r" % (name, ports))
+    else:
+        errors.extend(filter(None, (port_error("%s port" % name, port) for port in ports)))
+    for key in ('cidrs', 'sourceGroups'):
+        error = type_error("%s %s" % (name, key), rule.get(key, []), LIST)
+        if error:
+            errors.append(error)
+    if isinstance(rule.get('cidrs', []), list):
+        errors.extend(filter(None, (type_error("%s cidr" % name, cidr, STRING) for cidr in rule.get('cidrs', []))))
+    if isinstance(rule.get('sourceGroups', []), list):
+        errors.extend("%s source group %r is not a tier, use %s" % (name, tier, ", ".join(TIERS))
+                      for tier in rule.get('sourceGroups', []) if tier not in TIERS)
+    if not rule.get('cidrs') and not rule.get('sourceGroups'):
+        errors.append("%s needs cidrs or sourceGroups" % name)
+    return errors
+
+
+def port_error(name, port):
+    invalid = "%s %r must be a port or a from-to range" % (name, port)
+    if isinstance(port, bool) or not isinstance(port, (int,) + STRING_TYPES):
+        return invalid
+    try:
+        from_port, to_port = port_range(port)
+    except ValueError:
+        return invalid
+    if not 0 <= from_port <= to_port <= 65535:
+        return "%s %r must be within 0-65535, the lower port first" % (name, port)
+    return None
+
+
+def parse_yaml(text):
+    return yaml.load(text, Loader=SafeLoader)
+
+
+def load_yaml(path):
+    with open(path, 'rb') as yaml_file:
+        return parse_yaml(yaml_file.read()) or {}
+
+
+def load_config(path='awsVariables.yml'):
+    # Returns a copy, so callers changing their variables never change the cached config
+    with open(path, 'rb') as config_file:
+        text = config_file.read()
+    digest = hashlib.sha256(text).hexdigest()
+    with _lock:
+        if digest not in _configs:
+            _configs[digest] = validate(parse_yaml(text) or {}, path)
+        return copy.deepcopy(_configs[digest])
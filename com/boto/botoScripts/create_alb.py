@@ -1,4 +1,7 @@
-import boto3
+import client_registry
+import stage_tracing
+from stack_context import StackContext
+from tagging import name_tags
 
 
 #
@@ -10,92 +13,51 @@ import boto3
 #
 # Creates full Application Load Balancer Architecture including the following:
 #
-# Application Load Balancer Creation
+# Application Load Balancer Creation, across the Public Subnet of every availability zone
 # Target Group Creation
 # Enables sticky sessions on load balancer
 # Load Balancer Listener and Listener Forwarding Rules creation
 # Tags per resource created
+# Records the Load Balancer, Target Group and Listener ARNs in the stack context
 
 
-def run_alb_script(awsvars, access_key_id, secret_access_key):
+def run_alb_script(awsvars, access_key_id, secret_access_key, context=None):
     print("Creating Application Load Balancer Architecture")
 
-    elbclient = boto3.client('elbv2', aws_access_key_id=access_key_id,
-                             aws_secret_access_key=secret_access_key,
-                             region_name=awsvars['region'])
+    elbclient = client_registry.get_client('elbv2', awsvars, access_key_id, secret_access_key)
 
-    ec2client = boto3.client('ec2', aws_access_key_id=access_key_id,
-                             aws_secret_access_key=secret_access_key,
-                             region_name=awsvars['region'])
+    standalone = context is None
+    if standalone:
+        ec2client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+        context = StackContext.load(awsvars, ec2client)
 
-    create_alb(awsvars, elbclient, ec2client)
+    create_alb(awsvars, elbclient, context)
+    if standalone:
+        context.save_state(awsvars)
 
 
-def create_alb(awsvars, elbclient, ec2client):
-    alb_security_group = ec2client.describe_security_groups(
-        Filters=[
-            {
-                'Name': 'group-name',
-                'Values': [
-                    awsvars['albGroupName'],
-                ]
-            },
-        ]
-    )
-
-    print("Security Group is: ", alb_security_group['SecurityGroups'][0]['GroupId'])
-
-    publicsubnet1 = ec2client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['publicSubnet1Name'],
-                ]
-            },
-        ]
-    )
-
-    print("Retrieving Public Subnet 1: " + publicsubnet1['Subnets'][0]['SubnetId'])
-
-    publicsubnet2 = ec2client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['publicSubnet2Name'],
-                ]
-            },
-        ]
-    )
-
-    print("Retrieving Public Subnet 2: " + publicsubnet2['Subnets'][0]['SubnetId'])
-
+@stage_tracing.traced
+def create_alb(awsvars, elbclient, context):
     alb = elbclient.create_load_balancer(
         Name=awsvars['albName'],
-        Subnets=[
-            publicsubnet1['Subnets'][0]['SubnetId'],
-            publicsubnet2['Subnets'][0]['SubnetId']
-        ],
+        Subnets=context.public_subnet_ids,
         SecurityGroups=[
-            alb_security_group['SecurityGroups'][0]['GroupId']
+            context.security_group_ids['alb']
         ],
         Scheme=awsvars['scheme'],
-        Tags=[
-            {
-                'Key': 'Name',
-                'Value': awsvars['albTag']
-            },
-        ],
+        Tags=name_tags(awsvars, awsvars['albTag']),
         Type=awsvars['lbType'],
         IpAddressType=awsvars['ipAddressType']
     )
 
     print("Created Load Balancer: " + alb['LoadBalancers'][0]['LoadBalancerArn'])
-    create_targetgroup(awsvars, elbclient, alb)
+    context.load_balancer_arn = alb['LoadBalancers'][0]['LoadBalancerArn']
+    stage_tracing.annotate(context.load_balancer_arn)
+    create_targetgroup(awsvars, elbclient, alb, context)
 
 
-def create_targetgroup(awsvars, elbclient, alb):
+@stage_tracing.traced
+def create_targetgroup(awsvars, elbclient, alb, context):
     targetgroup = elbclient.create_target_group(
         Name=awsvars['targetGroupName'],
         Protocol=awsvars['protocol'],
@@ -111,10 +73,13 @@ def create_targetgroup(awsvars, elbclient, alb):
         Matcher={
             'HttpCode': awsvars['httpCode']
         },
-        TargetType=awsvars['targetType']
+        TargetType=awsvars['targetType'],
+        Tags=name_tags(awsvars, awsvars['targetGroupName'])
     )
 
     print("Created Target Group: " + targetgroup['TargetGroups'][0]['TargetGroupArn'])
+    context.target_group_arn = targetgroup['TargetGroups'][0]['TargetGroupArn']
+    stage_tracing.annotate(context.target_group_arn)
 
     elbclient.modify_target_group_attributes(
         Attributes=[
@@ -139,10 +104,11 @@ def create_targetgroup(awsvars, elbclient, alb):
     )
 
     print("Added sticky session details to target group: " + targetgroup['TargetGroups'][0]['TargetGroupArn'])
-    create_lb_listener(awsvars, elbclient, targetgroup, alb)
+    create_lb_listener(awsvars, elbclient, targetgroup, alb, context)
 
 
-def create_lb_listener(awsvars, elbclient, targetgroup, alb):
+@stage_tracing.traced
+def create_lb_listener(awsvars, elbclient, targetgroup, alb, context):
     listener = elbclient.create_listener(
         DefaultActions=[
             {
@@ -156,6 +122,8 @@ def create_lb_listener(awsvars, elbclient, targetgroup, alb):
     )
 
     print("Created Listener: " + listener['Listeners'][0]['ListenerArn'])
+    context.listener_arn = listener['Listeners'][0]['ListenerArn']
+    stage_tracing.annotate(context.listener_arn)
 
     listenerrule = elbclient.create_rule(
         Actions=[
@@ -0,0 +1,207 @@
+import create_vpc
+import create_rds
+import create_alb
+import create_autoscaling_group
+import create_ec2_instance
+import create_cloudwatch_monitoring
+import create_sns_topics
+import client_registry
+import stage_tracing
+import teardown_aws_architecture
+from botocore.exceptions import ClientError
+from stage_scheduler import PendingWait, Stage, StageFailedError, continue_with, run_stages
+from stack_context import StackContext
+from stack_state import StackState
+
+
+#
+# create_architecture.py version 1
+# boto3
+# python version 2.7.14
+#
+# Creates the Fully Scalable Architecture as a graph of dependent stages:
+#
+# VPC stage provides the subnets and security groups every other stage needs
+# RDS, the public EC2 instance and the Application Load Balancer are created concurrently
+# AutoScaling Group follows the Load Balancer as it needs the Target Group
+# CloudWatch Monitoring and SNS Topics follow the AutoScaling Group
+# Stages share one StackContext so resource ids are passed on rather than looked up again
+# RDS comes up while the other stages run, its stage finishes once the instance is available
+# The stack's state file is updated with the context after every stage
+# Completed stages are checkpointed in the state file, RDS only once its endpoint has resolved.
+# A resumed create verifies each completed stage with one existence check, skips it,
+# and continues from the stages that failed or never ran
+# A stage that failed part way first deletes what it had created (teardown_aws_architecture.cleanup_stages),
+# so running it again neither duplicates its resources nor fails on them. The deletions are stages of the same graph
+#
+# command to run example: python awsMenu.py --action resume
+
+
+def create_stages(awsvars, access_key_id, secret_access_key, context, state=None):
+    if state is None:
+        state = StackState(awsvars)
+
+    def stage_action(run_script):
+        def recorded(outcome):
+            try:
+                return outcome()
+            finally:
+                # Ids created before a failure are recorded too, so teardown can still find them
+                state.update(context.to_dict())
+        return lambda: continue_with(lambda: run_script(awsvars, access_key_id, secret_access_key, context),
+                                     recorded)
+
+    def unshared_stage_action(run_script):
+        return lambda: run_script(awsvars, access_key_id, secret_access_key)
+
+    stages = [
+        Stage('vpc', stage_action(create_vpc.run_vpc_script),
+              provides=['vpc', 'public_subnets', 'private_subnets', 'security_groups']),
+        Stage('rds', stage_action(create_rds.run_rds_script),
+              requires=['private_subnets', 'security_groups'],
+              provides=['db_instance']),
+        Stage('ec2', stage_action(create_ec2_instance.run_ec2_script),
+              requires=['public_subnets', 'security_groups'],
+              provides=['public_instance']),
+        Stage('alb', stage_action(create_alb.run_alb_script),
+              requires=['public_subnets', 'security_groups'],
+              provides=['load_balancer', 'target_group']),
+        Stage('asg', stage_action(create_autoscaling_group.run_asg_script),
+              requires=['private_subnets', 'security_groups', 'target_group'],
+              provides=['autoscaling_group']),
+        Stage('cloudwatch', unshared_stage_action(create_cloudwatch_monitoring.run_cloudwatch_script),
+              requires=['autoscaling_group'],
+              provides=['scaling_alarms']),
+        Stage('sns', stage_action(create_sns_topics.run_sns_topics_script),
+              requires=['autoscaling_group'],
+              provides=['sns_topics']),
+    ]
+    for stage in stages:
+        stage.action = checkpoint(stage.name, stage.action, state)
+    return stages
+
+
+def checkpoint(name, action, state):
+    # A stage returning a PendingWait is checkpointed once its wait and the rest of the stage are done
+    def checkpointed(outcome):
+        try:
+            result = outcome()
+        except Exception:
+            state.mark_failed(name)
+            raise
+        state.mark_completed(name)
+        return result
+    return lambda: continue_with(action, checkpointed)
+
+
+def resume_stages(awsvars, access_key_id, secret_access_key):
+    state = StackState(awsvars)
+    context = StackContext.from_dict(state.resources)
+    stages = create_stages(awsvars, access_key_id, secret_access_key, context, state)
+    checks = completed_stage_checks(awsvars, access_key_id, secret_access_key, context)
+
+    for stage in list(stages):
+        if state.is_failed(stage.name):
+            cleanup = cleanup_stages(stage.name, awsvars, access_key_id, secret_access_key)
+            stage.requires += tuple(resource for cleanup_stage in cleanup for resource in cleanup_stage.provides)
+            stages.extend(cleanup)
+        if not state.is_completed(stage.name):
+            continue
+        if checks[stage.name]():
+            print("Skipping completed stage: " + stage.name)
+            stage.action = resumed_stage_action(stage.name, awsvars, access_key_id, secret_access_key, context)
+        else:
+            print("Completed stage %s no longer exists, it will be created again" % stage.name)
+            state.clear_completed(stage.name)
+    return context, stages
+
+
+def cleanup_stages(name, awsvars, access_key_id, secret_access_key):
+    # Re-running a failed stage as is would create a second VPC next to the first,
+    # or fail with DBSubnetGroupAlreadyExists, so the teardown stages deleting its partial resources run first,
+    # in the same graph as cleanup_<stage>.<teardown stage>
+    stages = teardown_aws_architecture.cleanup_stages(name, awsvars, access_key_id, secret_access_key)
+    if stages:
+        print("Deleting the resources stage %s created before it failed" % name)
+    prefix = 'cleanup_%s.' % name
+    for stage in stages:
+        stage.name = prefix + stage.name
+        stage.requires = tuple(prefix + resource for resource in stage.requires)
+        stage.provides = tuple(prefix + resource for resource in stage.provides)
+    return stages
+
+
+def resumed_stage_action(name, awsvars, access_key_id, secret_access_key, context):
+    if name == 'rds':
+        # The instance may still be coming up, so the endpoint waiter is attached again
+        rds = client_registry.get_client('rds', awsvars, access_key_id, secret_access_key)
+
+        def wait_for_endpoint():
+            context.db_endpoint = create_rds.rds_available_waiter(awsvars, rds).start()
+            return PendingWait(context.db_endpoint)
+        return wait_for_endpoint
+    return lambda: None
+
+
+def completed_stage_checks(awsvars, access_key_id, secret_access_key, context):
+    # One cheap describe call per stage confirming its main resource still exists
+    ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+    rds = client_registry.get_client('rds', awsvars, access_key_id, secret_access_key)
+    elb_client = client_registry.get_client('elbv2', awsvars, access_key_id, secret_access_key)
+    asg_client = client_registry.get_client('autoscaling', awsvars, access_key_id, secret_access_key)
+    cw_client = client_registry.get_client('cloudwatch', awsvars, access_key_id, secret_access_key)
+    sns_client = client_registry.get_client('sns', awsvars, access_key_id, secret_access_key)
+
+    return {
+        'vpc': lambda: bool(context.vpc_id) and resource_exists(
+            lambda: ec2_client.describe_vpcs(VpcIds=[context.vpc_id])['Vpcs']),
+        'rds': lambda: resource_exists(
+            lambda: rds.describe_db_instances(DBInstanceIdentifier=awsvars['rdsDBId'])['DBInstances']),
+        'ec2': lambda: bool(context.public_instance_ids) and resource_exists(
+            lambda: ec2_client.describe_instances(
+                InstanceIds=context.public_instance_ids,
+                Filters=[{'Name': 'instance-state-name', 'Values': ['pending', 'running']}]
+            )['Reservations']),
+        'alb': lambda: bool(context.load_balancer_arn) and resource_exists(
+            lambda: elb_client.describe_load_balancers(
+                LoadBalancerArns=[context.load_balancer_arn])['LoadBalancers']),
+        'asg': lambda: resource_exists(
+            lambda: asg_client.describe_auto_scaling_groups(
+                AutoScalingGroupNames=[awsvars['autoScalingGroupName']])['AutoScalingGroups']),
+        'cloudwatch': lambda: resource_exists(
+            lambda: cw_client.describe_alarms(
+                AlarmNames=[awsvars['statusCheckAlarmName'], awsvars['cpuAlarmName']])['MetricAlarms']),
+        'sns': lambda: bool(context.sns_topic_arns) and resource_exists(
+            lambda: sns_client.get_topic_attributes(TopicArn=context.sns_topic_arns[0])['Attributes']),
+    }
+
+
+def resource_exists(describe):
+    try:
+        return bool(describe())
+    except ClientError as error:
+        if 'NotFound' in error.response['Error']['Code']:
+            return False
+        raise
+
+
+def run_create_script(awsvars, access_key_id, secret_access_key, resume=False):
+    if resume:
+        print("Resuming Scalable AWS Architecture Creation")
+        context, stages = resume_stages(awsvars, access_key_id, secret_access_key)
+    else:
+        print("Creating Scalable AWS Architecture")
+        context = StackContext()
+        stages = create_stages(awsvars, access_key_id, secret_access_key, context)
+    try:
+        run_stages(stages, max_workers=awsvars.get('maxStageWorkers', 4), stack=stage_tracing.stack_label(awsvars))
+    except StageFailedError:
+        print("Resume with menu option 3 or --action resume to continue from the failed stage")
+        raise
+
+    print("Finished Scalable AWS Architecture Creation")
+    return context
+
+
+def run_resume_script(awsvars, access_key_id, secret_access_key):
+    return run_create_script(awsvars, access_key_id, secret_access_key, resume=True)
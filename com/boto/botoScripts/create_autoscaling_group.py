@@ -1,4 +1,8 @@
-import boto3
+import client_registry
+import stage_tracing
+from stack_context import StackContext
+from subnet_planner import asg_zones
+from tagging import STACK_TAG_KEY, stack_id
 
 
 #
@@ -10,90 +14,38 @@ import boto3
 #
 # Creates full EC2 AutoScaling Group Architecture including the following:
 #
-# Sets ASG VPC details
+# Sets ASG VPC details from the stack context, or looks them up when run standalone
 # Creates ASG Launch Configuration
-# Creates AutoScaling Group
+# Creates AutoScaling Group, spanning the Private Subnet of every availability zone
 # Enables Metric Collection on ASG
 # Tags per resource created
 
 
-def run_asg_script(awsvars, access_key_id, secret_access_key):
+def run_asg_script(awsvars, access_key_id, secret_access_key, context=None):
     print("Creating AutoScaling Group Architecture")
 
-    ec2_client = boto3.client(
-        'ec2',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+    asg_client = client_registry.get_client('autoscaling', awsvars, access_key_id, secret_access_key)
 
-    asg_client = boto3.client(
-        'autoscaling',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+    standalone = context is None
+    if standalone:
+        context = retrieve_vpc_details(awsvars, access_key_id, secret_access_key)
 
-    elb_client = boto3.client('elbv2', aws_access_key_id=access_key_id,
-                              aws_secret_access_key=secret_access_key,
-                              region_name=awsvars['region'])
+    create_autoscaling_group(awsvars, asg_client, context)
+    if standalone:
+        context.save_state(awsvars)
 
-    retrieve_vpc_details(awsvars, ec2_client, asg_client, elb_client)
 
+def retrieve_vpc_details(awsvars, access_key_id, secret_access_key):
+    ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+    elb_client = client_registry.get_client('elbv2', awsvars, access_key_id, secret_access_key)
 
-def retrieve_vpc_details(awsvars, ec2_client, asg_client, elb_client):
-    application_security_group = ec2_client.describe_security_groups(
-        Filters=[
-            {
-                'Name': 'group-name',
-                'Values': [
-                    awsvars['appGroupName'],
-                ]
-            },
-        ]
-    )
+    context = StackContext.load(awsvars, ec2_client)
+    context.discover_target_group(awsvars, elb_client)
+    return context
 
-    print("Application Security Group is: ", application_security_group['SecurityGroups'][0]['GroupId'])
 
-    privatesubnet1 = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['privateSubnet1Name'],
-                ]
-            },
-        ]
-    )
-
-    print("Retrieving Private Subnet 1: " + privatesubnet1['Subnets'][0]['SubnetId'])
-
-    privatesubnet2 = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['privateSubnet2Name'],
-                ]
-            },
-        ]
-    )
-
-    print("Retrieving Private Subnet 2: " + privatesubnet2['Subnets'][0]['SubnetId'])
-
-    targetgroup = elb_client.describe_target_groups(
-        Names=[
-            awsvars['targetGroupName'],
-        ]
-    )
-
-    print("Retrieving Target Group: " + targetgroup['TargetGroups'][0]['TargetGroupArn'])
-    create_autoscaling_group(awsvars, asg_client, application_security_group, targetgroup, privatesubnet1,
-                             privatesubnet2)
-
-
-def create_autoscaling_group(awsvars, asg_client, application_security_group, targetgroup, privatesubnet1,
-                             privatesubnet2):
+@stage_tracing.traced
+def create_autoscaling_group(awsvars, asg_client, context):
     user_data_script = """#!/bin/bash
     rm /var/tmp/aws-mon/instance-id"""
 
@@ -102,7 +54,7 @@ def create_autoscaling_group(awsvars, asg_client, application_security_group, ta
         ImageId=awsvars['asgAMI'],
         KeyName=awsvars['keyPairName'],
         SecurityGroups=[
-            application_security_group['SecurityGroups'][0]['GroupId'],
+            context.security_group_ids['app'],
         ],
         UserData=user_data_script,
         InstanceType=awsvars['instanceType'],
@@ -114,7 +66,7 @@ def create_autoscaling_group(awsvars, asg_client, application_security_group, ta
 
     print("Created Launch Config: ", launch_config)
 
-    subnetlist = [privatesubnet1['Subnets'][0]['SubnetId'], privatesubnet2['Subnets'][0]['SubnetId']]
+    subnetlist = context.private_subnet_ids
     print("Subnet List is: ", subnetlist)
 
     auto_scaling_group = asg_client.create_auto_scaling_group(
@@ -124,15 +76,13 @@ def create_autoscaling_group(awsvars, asg_client, application_security_group, ta
         MaxSize=awsvars['asgMaxSize'],
         DesiredCapacity=awsvars['asgDesiredSize'],
         DefaultCooldown=awsvars['asgCoolDown'],
-        AvailabilityZones=[
-            awsvars['azZone1'], awsvars['azZone2'],
-        ],
+        AvailabilityZones=asg_zones(awsvars),
         TargetGroupARNs=[
-            targetgroup['TargetGroups'][0]['TargetGroupArn'],
+            context.target_group_arn,
         ],
         HealthCheckType=awsvars['asgHealthCheckType'],
         HealthCheckGracePeriod=awsvars['asgCoolDown'],
-        VPCZoneIdentifier=', '.join(map(str, subnetlist)),
+        VPCZoneIdentifier=','.join(subnetlist),
         TerminationPolicies=[
             awsvars['asgTerminationPolicies'],
         ],
@@ -145,10 +95,19 @@ def create_autoscaling_group(awsvars, asg_client, application_security_group, ta
                 'Value': awsvars['autoScalingGroupTag'],
                 'PropagateAtLaunch': True
             },
+            {
+                'ResourceId': awsvars['autoScalingGroupName'],
+                'ResourceType': 'auto-scaling-group',
+                'Key': STACK_TAG_KEY,
+                'Value': stack_id(awsvars),
+                'PropagateAtLaunch': True
+            },
         ]
     )
 
     print("Created AutoScaling Group: ", auto_scaling_group)
+    context.autoscaling_group_name = awsvars['autoScalingGroupName']
+    stage_tracing.annotate(context.autoscaling_group_name)
 
     asg_client.enable_metrics_collection(
         AutoScalingGroupName=awsvars['autoScalingGroupName'],
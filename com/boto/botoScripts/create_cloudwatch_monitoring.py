@@ -1,4 +1,5 @@
-import boto3
+import client_registry
+from tagging import stack_tags
 
 
 #
@@ -17,18 +18,9 @@ import boto3
 def run_cloudwatch_script(awsvars, access_key_id, secret_access_key):
     print("Creating CloudWatch Monitoring for AutoScaling Group")
 
-    asg_client = boto3.client(
-        'autoscaling',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+    asg_client = client_registry.get_client('autoscaling', awsvars, access_key_id, secret_access_key)
 
-    cw_client = boto3.client('cloudwatch',
-                             aws_access_key_id=access_key_id,
-                             aws_secret_access_key=secret_access_key,
-                             region_name=awsvars['region']
-                             )
+    cw_client = client_registry.get_client('cloudwatch', awsvars, access_key_id, secret_access_key)
     create_scaling_policies(awsvars, asg_client, cw_client)
 
 
@@ -105,7 +97,8 @@ def create_cloudwatch_alarms(awsvars, cw_client, status_check_scale_out_policy,
             },
         ],
         AlarmDescription=awsvars['scFailDescription'],
-        Unit=awsvars['scUnit']
+        Unit=awsvars['scUnit'],
+        Tags=stack_tags(awsvars)
     )
 
     print("Created Status Check Failed CloudWatch Alarm with parameters: ", status_check_failed_alarm)
@@ -134,7 +127,8 @@ def create_cloudwatch_alarms(awsvars, cw_client, status_check_scale_out_policy,
             },
         ],
         AlarmDescription=awsvars['cpuHighDescription'],
-        Unit=awsvars['cpuUnit']
+        Unit=awsvars['cpuUnit'],
+        Tags=stack_tags(awsvars)
     )
 
     print("Created High CPU CloudWatch Alarm with parameters: ", high_cpu_alarm)
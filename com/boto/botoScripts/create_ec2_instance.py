@@ -1,4 +1,6 @@
-import boto3
+import client_registry
+from stack_context import StackContext
+from tagging import tag_specifications
 
 
 #
@@ -10,55 +12,25 @@ import boto3
 #
 # Creates an EC2 instance in a public subnet including the following actions:
 #
-# Retrieves VPC details
+# Retrieves VPC details from the stack context, or looks them up when run standalone
 # Creates EC2 instance in public subnet with specified parameters.
 # Tags per resource created
 
 
-def run_ec2_script(awsvars, access_key_id, secret_access_key):
-    ec2 = boto3.resource(
-        'ec2',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
-
-    ec2_client = boto3.client(
-        'ec2',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+def run_ec2_script(awsvars, access_key_id, secret_access_key, context=None):
+    ec2 = client_registry.get_resource('ec2', awsvars, access_key_id, secret_access_key)
 
-    alb_security_group = ec2_client.describe_security_groups(
-        Filters=[
-            {
-                'Name': 'group-name',
-                'Values': [
-                    awsvars['albGroupName'],
-                ]
-            },
-        ]
-    )
-
-    print("Security Group is: ", alb_security_group['SecurityGroups'][0]['GroupId'])
-
-    publicsubnet1 = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['publicSubnet1Name'],
-                ]
-            },
-        ]
-    )
+    standalone = context is None
+    if standalone:
+        ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+        context = StackContext.load(awsvars, ec2_client)
 
-    print("Retrieving Public Subnet 1: " + publicsubnet1['Subnets'][0]['SubnetId'])
-    create_ec2_instance(awsvars, ec2, alb_security_group, publicsubnet1)
+    create_ec2_instance(awsvars, ec2, context)
+    if standalone:
+        context.save_state(awsvars)
 
 
-def create_ec2_instance(awsvars, ec2, alb_security_group, publicsubnet1):
+def create_ec2_instance(awsvars, ec2, context):
     instance = ec2.create_instances(
         ImageId=awsvars['publicServerAMI'],
         InstanceType=awsvars['instanceType'],
@@ -69,20 +41,11 @@ def create_ec2_instance(awsvars, ec2, alb_security_group, publicsubnet1):
             'Enabled': False
         },
         SecurityGroupIds=[
-            alb_security_group['SecurityGroups'][0]['GroupId'],
+            context.security_group_ids['alb'],
         ],
-        SubnetId=publicsubnet1['Subnets'][0]['SubnetId'],
+        SubnetId=context.public_subnet_ids[0],
         EbsOptimized=False,
-        TagSpecifications=[
-            {
-                'ResourceType': awsvars['targetType'],
-                'Tags': [
-                    {
-                        'Key': 'Name',
-                        'Value': awsvars['publicServerName']
-                    },
-                ]
-            },
-        ]
+        TagSpecifications=tag_specifications(awsvars, awsvars['targetType'], awsvars['publicServerName'])
     )
     print("Created ec2 Instance with the following parameters: ", instance)
+    context.public_instance_ids = [created.id for created in instance]
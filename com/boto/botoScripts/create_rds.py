@@ -1,5 +1,9 @@
-import boto3
-import time
+import client_registry
+import stage_tracing
+import waiter_multiplexer
+from stack_context import StackContext
+from stage_scheduler import PendingWait, finish
+from tagging import name_tags
 
 
 #
@@ -11,85 +15,45 @@ import time
 #
 # Creates a Privately available RDS Instance for use with application architecture inside VPC:
 #
-# Retrieves VPC details
-# Creates RDS DB Subnet Group.
+# Retrieves VPC details from the stack context, or looks them up when run standalone
+# Creates RDS DB Subnet Group over the Private Subnet of every availability zone.
 # Creates RDS Instance.
 # Tags per resource created
-# Waits for RDS instance to become available(via status check) before script can finish.
+# Waits for RDS instance to become available(via the waiter multiplexer's batched status checks),
+# the endpoint future is kept in the stack context and the stage only finishes once it resolves.
 
 
-def run_rds_script(awsvars, access_key_id, secret_access_key):
+def run_rds_script(awsvars, access_key_id, secret_access_key, context=None):
     print("Creating RDS Instance")
 
-    ec2_client = boto3.client(
-        'ec2',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
-
-    rds = boto3.client(
-        'rds',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+    rds = client_registry.get_client('rds', awsvars, access_key_id, secret_access_key)
 
-    db_security_group = ec2_client.describe_security_groups(
-        Filters=[
-            {
-                'Name': 'group-name',
-                'Values': [
-                    awsvars['rdsGroupName'],
-                ]
-            },
-        ]
-    )
+    standalone = context is None
+    if standalone:
+        ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+        context = StackContext.load(awsvars, ec2_client)
 
-    privatesubnet1 = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['privateSubnet1Name'],
-                ]
-            },
-        ]
-    )
+    available = PendingWait(create_db_subnet(awsvars, rds, context))
+    if standalone:
+        return finish(available)
+    return available
 
-    privatesubnet2 = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['privateSubnet2Name'],
-                ]
-            },
-        ]
-    )
-    create_db_subnet(awsvars, rds, db_security_group, privatesubnet1, privatesubnet2)
 
-
-def create_db_subnet(awsvars, rds, db_security_group, privatesubnet1, privatesubnet2):
+@stage_tracing.traced
+def create_db_subnet(awsvars, rds, context):
     db_subnet_group = rds.create_db_subnet_group(
         DBSubnetGroupName=awsvars['rdsSubnetGroupName'],
         DBSubnetGroupDescription=awsvars['subnetGroupDesc'],
-        SubnetIds=[
-            privatesubnet1['Subnets'][0]['SubnetId'],
-            privatesubnet2['Subnets'][0]['SubnetId']
-        ],
-        Tags=[
-            {
-                'Key': 'Name',
-                'Value': awsvars['rdsSubnetGroupName']
-            },
-        ]
+        SubnetIds=context.private_subnet_ids,
+        Tags=name_tags(awsvars, awsvars['rdsSubnetGroupName'])
     )
     print("Created RDS DB Subnet Group", db_subnet_group)
-    create_rds_instance(awsvars, rds, db_security_group)
+    stage_tracing.annotate(awsvars['rdsSubnetGroupName'])
+    return create_rds_instance(awsvars, rds, context)
 
 
-def create_rds_instance(awsvars, rds, db_security_group):
+@stage_tracing.traced
+def create_rds_instance(awsvars, rds, context):
     rds.create_db_instance(
         DBSubnetGroupName=awsvars['rdsSubnetGroupName'],
         DBInstanceIdentifier=awsvars['rdsDBId'],
@@ -101,35 +65,18 @@ def create_rds_instance(awsvars, rds, db_security_group):
         MultiAZ=True,
         MasterUsername=awsvars['rdsMasterUser'],
         MasterUserPassword=awsvars['rdsMasterPassword'],
-        VpcSecurityGroupIds=[db_security_group['SecurityGroups'][0]['GroupId']],
+        VpcSecurityGroupIds=[context.security_group_ids['rds']],
         PubliclyAccessible=False,
         DBInstanceClass=awsvars['rdsInstanceClass'],
-        Tags=[
-            {
-                'Key': 'Name',
-                'Value': awsvars['rdsDBId']
-            },
-        ], )
+        Tags=name_tags(awsvars, awsvars['rdsDBId']), )
     print("Starting RDS instance ")
+    stage_tracing.annotate(awsvars['rdsDBId'])
 
-    running = True
-    while running:
-        response = rds.describe_db_instances(DBInstanceIdentifier=awsvars['rdsDBId'])
-
-        db_instances = response['DBInstances']
-        if len(db_instances) != 1:
-            raise Exception('More than one DB instance returned; this should never happen')
-
-        db_instance = db_instances[0]
-
-        status = db_instance['DBInstanceStatus']
-
-        print("Last DB status: %s" % status)
+    context.db_endpoint = rds_available_waiter(awsvars, rds).start()
+    return context.db_endpoint
 
-        time.sleep(5)
-        if status == 'available':
-            endpoint = db_instance['Endpoint']
-            host = endpoint['Address']
 
-            print("DB instance ready with host: %s" % host)
-            running = False
+def rds_available_waiter(awsvars, rds):
+    # Resolves to the endpoint host, polled with every other pending RDS instance in the region
+    return waiter_multiplexer.waiter('RDS instance ' + awsvars['rdsDBId'], waiter_multiplexer.DB_INSTANCE_AVAILABLE,
+                                     rds, awsvars['rdsDBId'], timeout=3600)
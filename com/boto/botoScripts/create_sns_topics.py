@@ -1,5 +1,7 @@
-import boto3
+import client_registry
 from ansible_vault import Vault
+from stack_context import StackContext
+from tagging import stack_tags
 
 
 #
@@ -16,36 +18,37 @@ from ansible_vault import Vault
 # Subscribes to email notifications for topics for a specified email address
 # Assigns the SNS topic notifications to the ASG
 # Tags per resource created
+# Records the topic ARNs in the stack context
 
-def run_sns_topics_script(awsvars, access_key_id, secret_access_key):
+def run_sns_topics_script(awsvars, access_key_id, secret_access_key, context=None):
     print("Creating SNS Topics")
 
-    sns_client = boto3.client(
-        'sns',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+    sns_client = client_registry.get_client('sns', awsvars, access_key_id, secret_access_key)
 
-    asg_client = boto3.client(
-        'autoscaling',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
-    create_topics(awsvars, sns_client, asg_client)
+    asg_client = client_registry.get_client('autoscaling', awsvars, access_key_id, secret_access_key)
+
+    standalone = context is None
+    if standalone:
+        context = StackContext()
+
+    create_topics(awsvars, sns_client, asg_client, context)
+    if standalone:
+        context.save_state(awsvars)
 
 
-def create_topics(awsvars, sns_client, asg_client):
+def create_topics(awsvars, sns_client, asg_client, context):
     scale_up_topic = sns_client.create_topic(
         Name=awsvars['scaleUpTopicName'],
+        Tags=stack_tags(awsvars)
     )
     print("Scale Up Topic Created is: ", scale_up_topic['TopicArn'])
 
     scale_down_topic = sns_client.create_topic(
         Name=awsvars['scaleDownTopicName'],
+        Tags=stack_tags(awsvars)
     )
     print("Scale Down Topic Created is: ", scale_down_topic)
+    context.sns_topic_arns = [scale_up_topic['TopicArn'], scale_down_topic['TopicArn']]
     set_topic_attributes(awsvars, sns_client, asg_client, scale_up_topic, scale_down_topic)
 
 
@@ -1,4 +1,12 @@
-import boto3
+import client_registry
+import stage_tracing
+import waiter_multiplexer
+from concurrent.futures import Future, ThreadPoolExecutor
+from stack_context import StackContext
+from stage_scheduler import PendingWait, finish
+from tagging import tag_specifications
+from security_group_rules import apply_security_group_rules
+from subnet_planner import PUBLIC, PRIVATE, nat_gateway_for, plan_nat_gateways, plan_subnets, tier_subnets
 
 
 #
@@ -11,250 +19,279 @@ import boto3
 # Creates full VPC architecture including the following:
 # A VPC
 # Internet Gateway
-# Associated Public and Private Subnets
+# Associated Public and Private Subnets, one of each per availability zone as planned by subnet_planner.py,
+# created concurrently along with their route table associations and public IP settings
 # Public and Private Route Tables
 # Application, RDS and Application Load Balancer Security Groups
-# Associated Security Group Rules
-# Tags per resource created
+# Associated Security Group Rules, applied from the securityGroupRules table
+# Tags per resource applied at creation time, including the common StackId tag
+# A NAT Gateway in the first Public Subnet, routing the Private Subnets' outbound traffic,
+# or with natGatewayPerZone a NAT Gateway, Elastic IP and Private Route Table per availability zone,
+# all created concurrently, their availability checked with batched calls by the waiter multiplexer
+# The NAT Gateways are started first, the gateways, route tables, private subnets and security groups are created
+# while they come up and only the private default routes wait for them
+# create_vpc returns that wait as a PendingWait, whose rest adds the private default routes,
+# so the stage's thread is not held while the NAT Gateways come up
+# Returns a StackContext holding the created resource ids for the later stages, saved to the state file when run standalone
 
-def run_vpc_script(awsvars, access_key_id, secret_access_key):
-    ec2 = boto3.resource('ec2', aws_access_key_id=access_key_id,
-                         aws_secret_access_key=secret_access_key,
-                         region_name=awsvars['region'])
+# Calls made at the same time within the VPC stage, 6 zones have 12 subnets
+MAX_VPC_WORKERS = 12
 
-    ec2client = boto3.client('ec2', aws_access_key_id=access_key_id,
-                             aws_secret_access_key=secret_access_key,
-                             region_name=awsvars['region'])
 
-    create_vpc(awsvars, ec2, ec2client)
+def run_vpc_script(awsvars, access_key_id, secret_access_key, context=None):
+    ec2 = client_registry.get_resource('ec2', awsvars, access_key_id, secret_access_key)
 
+    ec2client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+
+    if context is not None:
+        return create_vpc(awsvars, ec2, ec2client, context)
+    context = finish(create_vpc(awsvars, ec2, ec2client))
+    context.save_state(awsvars)
+    return context
+
+
+@stage_tracing.traced
+def create_vpc(awsvars, ec2, ec2client, context=None):
+    if context is None:
+        context = StackContext()
 
-def create_vpc(awsvars, ec2, ec2client):
     # Create and tag the VPC
-    vpc = ec2.create_vpc(CidrBlock=awsvars['vpcCidrBlock'])
+    # Every id is recorded in the context as soon as its create call returns,
+    # so the state file written after a failure still lists the resources to delete
+    vpc = ec2.create_vpc(
+        CidrBlock=awsvars['vpcCidrBlock'],
+        TagSpecifications=tag_specifications(awsvars, 'vpc', awsvars['vpcName'])
+    )
+    context.vpc_id = vpc.id
     vpc.wait_until_available()
     print("Creating VPC with id: " + vpc.id)
+    stage_tracing.annotate(vpc.id)
 
     # Enable DNS Hostnames in the VPC
     vpc.modify_attribute(EnableDnsSupport={'Value': True})
     vpc.modify_attribute(EnableDnsHostnames={'Value': True})
     print("Enabling DNS for VPC: " + vpc.id)
 
-    # Create, tag, then attach an internet gateway to the VPC
-    internet_gateway = ec2.create_internet_gateway()
-    vpc.attach_internet_gateway(InternetGatewayId=internet_gateway.id)
-    print("Creating Internet Gateway with id: " + internet_gateway.id)
-
-    # create elastic ip for use with nat gateway
-    eip = ec2client.allocate_address(
-        Domain='vpc'
-    )
-    print("Created Elastic IP: ", eip)
-
-    # Create a Public Route Table
-    public_route_table = vpc.create_route_table()
-    print("Creating Public Route Table with id: " + public_route_table.id)
-
-    # Create a route for internet traffic to from the public route table
-    public_route_table.create_route(
-        RouteTableId=public_route_table.id,
-        DestinationCidrBlock='0.0.0.0/0',
-        GatewayId=internet_gateway.id
-    )
-    print("Creating Route Table public routing rule")
-
-    # Create Public Subnet 1
-    public_subnet1 = ec2.create_subnet(
-        CidrBlock=awsvars['publicSubnet1CidrBlock'],
-        VpcId=vpc.id,
-        AvailabilityZone=awsvars['availabilityZone1']
-    )
-    print("Creating Public Subnet 1 with id: " + public_subnet1.id)
-
-    ec2client.modify_subnet_attribute(
-        MapPublicIpOnLaunch={
-            'Value': True
-        },
-        SubnetId=public_subnet1.id
-    )
-
-    # Create Public Subnet 2
-    public_subnet2 = ec2.create_subnet(
-        CidrBlock=awsvars['publicSubnet2CidrBlock'],
-        VpcId=vpc.id,
-        AvailabilityZone=awsvars['availabilityZone2']
-    )
-    print("Creating Public Subnet 2 with id: " + public_subnet2.id)
-
-    ec2client.modify_subnet_attribute(
-        MapPublicIpOnLaunch={
-            'Value': True
-        },
-        SubnetId=public_subnet2.id
-    )
-
-    # Associate the Public Route Table with the Subnets
-    public_route_table.associate_with_subnet(SubnetId=public_subnet1.id)
-    public_route_table.associate_with_subnet(SubnetId=public_subnet2.id)
+    planned = plan_subnets(awsvars)
+    nat_gateways = plan_nat_gateways(awsvars)
+    public_subnets = tier_subnets(planned, PUBLIC)
+    private_subnets = tier_subnets(planned, PRIVATE)
+    # Filled in by position by the threads creating them
+    context.public_subnet_ids = [None] * len(public_subnets)
+    context.private_subnet_ids = [None] * len(private_subnets)
+    context.eip_allocation_ids = [None] * len(nat_gateways)
+    context.nat_gateway_ids = [None] * len(nat_gateways)
+    context.private_route_table_ids = [None] * len(nat_gateways)
+
+    # Only the private default routes need the NAT Gateways, which take minutes to become available,
+    # so they are started first and the rest of the VPC is built while they come up
+    internet_gateway_attached = Future()
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        nat_future = executor.submit(stage_tracing.in_current_span(start_nat_gateways), awsvars, ec2client, vpc.id,
+                                     public_subnets, nat_gateways, context, internet_gateway_attached)
+        private_future = executor.submit(stage_tracing.in_current_span(create_private_network), awsvars, ec2client,
+                                         vpc.id, private_subnets, nat_gateways, context)
+
+        # Create, tag, then attach an internet gateway to the VPC
+        try:
+            internet_gateway = ec2.create_internet_gateway(
+                TagSpecifications=tag_specifications(awsvars, 'internet-gateway', awsvars['igName'])
+            )
+            context.internet_gateway_id = internet_gateway.id
+            vpc.attach_internet_gateway(InternetGatewayId=internet_gateway.id)
+        except Exception as error:
+            internet_gateway_attached.set_exception(error)
+            raise
+        internet_gateway_attached.set_result(internet_gateway.id)
+        print("Creating Internet Gateway with id: " + internet_gateway.id)
+
+        # Create a Public Route Table
+        public_route_table = vpc.create_route_table(
+            TagSpecifications=tag_specifications(awsvars, 'route-table', awsvars['publicRouteTable'])
+        )
+        context.public_route_table_id = public_route_table.id
+        print("Creating Public Route Table with id: " + public_route_table.id)
+
+        # Create a route for internet traffic to from the public route table
+        public_route_table.create_route(
+            RouteTableId=public_route_table.id,
+            DestinationCidrBlock='0.0.0.0/0',
+            GatewayId=internet_gateway.id
+        )
+        print("Creating Route Table public routing rule")
+
+        create_security_groups(awsvars, vpc, ec2, ec2client, context)
+
+        nat_gateways_available = nat_future.result()
+
+        # Associate the Public Route Table with the Public Subnets
+        run_concurrently(
+            lambda subnet_id: ec2client.associate_route_table(RouteTableId=public_route_table.id, SubnetId=subnet_id),
+            context.public_subnet_ids)
+
+        private_future.result()
+    finally:
+        executor.shutdown(wait=True)
 
-    nat = ec2client.create_nat_gateway(
-        AllocationId=eip['AllocationId'],
-        SubnetId=public_subnet1.id
-    )
     print("Waiting for NAT Gateway creation . . . ")
-    waiter = ec2client.get_waiter('nat_gateway_available')
-    waiter.wait(NatGatewayIds=[
-        nat['NatGateway']['NatGatewayId']
-    ], )
-    print("Nat Gateway created in Public Subnet 1: ", nat)
-
-    # Create a Private Route Table
-    private_route_table = ec2.create_route_table(VpcId=vpc.id)
-    print("Creating Private Route Table with id: " + private_route_table.id)
-
-    # Create Private Subnet 1
-    private_subnet1 = ec2.create_subnet(
-        CidrBlock=awsvars['privateSubnet1CidrBlock'],
-        VpcId=vpc.id,
-        AvailabilityZone=awsvars['availabilityZone1']
-    )
-    print("Creating Private Subnet 1 with id: " + private_subnet1.id)
-
-    # Create Private Subnet 2
-    private_subnet2 = ec2.create_subnet(
-        CidrBlock=awsvars['privateSubnet2CidrBlock'],
-        VpcId=vpc.id,
-        AvailabilityZone=awsvars['availabilityZone2'])
-    print("Creating Private Subnet 2 with id: " + private_subnet2.id)
-
-    # Associate the Private Route Table with the Subnets
-    private_route_table.associate_with_subnet(SubnetId=private_subnet1.id)
-    private_route_table.associate_with_subnet(SubnetId=private_subnet2.id)
 
-    # Associate the Private Route Table with the NatGateway to allow outbound traffic to the internet
-    private_route_table.create_route(
-        DestinationCidrBlock='0.0.0.0/0',
-        NatGatewayId=nat['NatGateway']['NatGatewayId']
+    @stage_tracing.in_current_span
+    def route_private_subnets(nat_gateways_available):
+        nat_gateways_available.result()
+
+        # Route each Private Route Table through its NatGateway to allow outbound traffic to the internet
+        run_concurrently(
+            lambda ids: ec2client.create_route(RouteTableId=ids[0], DestinationCidrBlock='0.0.0.0/0',
+                                               NatGatewayId=ids[1]),
+            zip(context.private_route_table_ids, context.nat_gateway_ids))
+        print("Creating Route Table private routing rules")
+
+        print("Finished VPC Architecture Creation for: " + vpc.id)
+        return context
+
+    return PendingWait(nat_gateways_available, route_private_subnets)
+
+
+@stage_tracing.traced
+def start_nat_gateways(awsvars, ec2client, vpc_id, public_subnets, nat_gateways, context, internet_gateway_attached):
+    # Creates the Public Subnets then the NAT Gateways in them, without waiting for the NAT Gateways
+    # Returns a Future of their availability
+    create_subnets(awsvars, ec2client, vpc_id, public_subnets, subnet_ids=context.public_subnet_ids)
+    # A public NAT Gateway fails with Gateway.NotAttached until the VPC has an attached Internet Gateway
+    internet_gateway_attached.result()
+    create_nat_gateways(awsvars, ec2client, nat_gateways, context.public_subnet_ids,
+                        context.eip_allocation_ids, context.nat_gateway_ids)
+    return nat_gateways_available_waiter(ec2client, context.nat_gateway_ids).start()
+
+
+@stage_tracing.traced
+def create_private_network(awsvars, ec2client, vpc_id, private_subnets, nat_gateways, context):
+    # Creates the Private Route Tables, one shared or one per availability zone, then the Private Subnets
+    # associated with them
+    def create_private_route_table(nat_gateway):
+        context.private_route_table_ids[nat_gateway.index] = create_route_table(
+            awsvars, ec2client, vpc_id, nat_gateway.route_table_name)
+
+    run_concurrently(create_private_route_table, nat_gateways)
+    route_table_ids = [context.private_route_table_ids[nat_gateway_for(nat_gateways, subnet).index]
+                       for subnet in private_subnets]
+    create_subnets(awsvars, ec2client, vpc_id, private_subnets, route_table_ids, context.private_subnet_ids)
+
+
+def run_concurrently(function, items):
+    # Returns function's result for each item, in the order of items
+    items = list(items)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(items), MAX_VPC_WORKERS)))
+    try:
+        return list(executor.map(stage_tracing.in_current_span(function), items))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def create_route_table(awsvars, ec2client, vpc_id, name):
+    response = ec2client.create_route_table(
+        VpcId=vpc_id,
+        TagSpecifications=tag_specifications(awsvars, 'route-table', name)
     )
-
-    # Creating Resource Tags
-    vpc.create_tags(Tags=[{"Key": "Name", "Value": awsvars['vpcName']}])
-    internet_gateway.create_tags(Tags=[{"Key": "Name", "Value": awsvars['igName']}])
-    public_subnet1.create_tags(Tags=[{"Key": "Name", "Value": awsvars['publicSubnet1Name']}])
-    public_subnet2.create_tags(Tags=[{"Key": "Name", "Value": awsvars['publicSubnet2Name']}])
-    private_subnet1.create_tags(Tags=[{"Key": "Name", "Value": awsvars['privateSubnet1Name']}])
-    private_subnet2.create_tags(Tags=[{"Key": "Name", "Value": awsvars['privateSubnet2Name']}])
-    public_route_table.create_tags(Tags=[{"Key": "Name", "Value": awsvars['publicRouteTable']}])
-    private_route_table.create_tags(Tags=[{"Key": "Name", "Value": awsvars['privateRouteTable']}])
-
-    ec2client.create_tags(
-        Resources=[
-            eip['AllocationId'],
-        ],
-        Tags=[
-            {
-                'Key': 'Name',
-                'Value': awsvars['eipName']
-            },
-        ]
-    )
-    ec2client.create_tags(
-        Resources=[
-            nat['NatGateway']['NatGatewayId'],
-        ],
-        Tags=[
-            {
-                'Key': 'Name',
-                'Value': awsvars['natGatewayName']
-            },
-        ]
-    )
-
-    create_security_groups(awsvars, vpc, ec2, ec2client)
-
-
-def create_security_groups(awsvars, vpc, ec2, ec2client):
+    route_table_id = response['RouteTable']['RouteTableId']
+    print("Creating %s Route Table with id: %s" % (name, route_table_id))
+    return route_table_id
+
+
+@stage_tracing.traced
+def create_subnets(awsvars, ec2client, vpc_id, planned, route_table_ids=None, subnet_ids=None):
+    # Returns the subnet ids in the order of planned, each associated with its entry in route_table_ids if given
+    # Each id is stored in subnet_ids, when given, as soon as its subnet has been created
+    # Uses the client rather than the ec2 resource, boto3 resources are not thread safe
+    if subnet_ids is None:
+        subnet_ids = [None] * len(planned)
+
+    def create_subnet(position):
+        subnet = planned[position]
+        response = ec2client.create_subnet(
+            CidrBlock=subnet.cidr,
+            VpcId=vpc_id,
+            AvailabilityZone=subnet.zone,
+            TagSpecifications=tag_specifications(awsvars, 'subnet', subnet.name)
+        )
+        subnet_id = subnet_ids[position] = response['Subnet']['SubnetId']
+        print("Creating %s with id: %s" % (subnet.name, subnet_id))
+
+        if subnet.tier == PUBLIC:
+            ec2client.modify_subnet_attribute(
+                MapPublicIpOnLaunch={
+                    'Value': True
+                },
+                SubnetId=subnet_id
+            )
+
+        # Associate the Route Table with the Subnet
+        if route_table_ids is not None:
+            ec2client.associate_route_table(RouteTableId=route_table_ids[position], SubnetId=subnet_id)
+
+    run_concurrently(create_subnet, range(len(planned)))
+    stage_tracing.annotate(subnet_ids)
+    return subnet_ids
+
+
+@stage_tracing.traced
+def create_nat_gateways(awsvars, ec2client, nat_gateways, public_subnet_ids, allocation_ids, nat_gateway_ids):
+    # Stores the Elastic IP allocation ids and NAT Gateway ids in zone order as each one is created,
+    # without waiting for the NAT Gateways
+    def create_nat_gateway(nat_gateway):
+        # create elastic ip for use with nat gateway
+        eip = ec2client.allocate_address(
+            Domain='vpc',
+            TagSpecifications=tag_specifications(awsvars, 'elastic-ip', nat_gateway.eip_name)
+        )
+        allocation_ids[nat_gateway.index] = eip['AllocationId']
+        print("Created Elastic IP: ", eip['AllocationId'])
+
+        nat = ec2client.create_nat_gateway(
+            AllocationId=eip['AllocationId'],
+            SubnetId=public_subnet_ids[nat_gateway.index],
+            TagSpecifications=tag_specifications(awsvars, 'natgateway', nat_gateway.name)
+        )
+        nat_gateway_ids[nat_gateway.index] = nat['NatGateway']['NatGatewayId']
+        print("Creating %s in %s with id: %s" % (nat_gateway.name, nat_gateway.zone,
+                                                nat['NatGateway']['NatGatewayId']))
+
+    run_concurrently(create_nat_gateway, nat_gateways)
+    stage_tracing.annotate(nat_gateway_ids)
+
+
+def nat_gateways_available_waiter(ec2client, nat_gateway_ids):
+    # Polled with every other pending NAT Gateway in the region, one describe call per check
+    return waiter_multiplexer.waiter('%d NAT Gateways' % len(nat_gateway_ids), waiter_multiplexer.NAT_GATEWAY_AVAILABLE,
+                                     ec2client, nat_gateway_ids, timeout=600)
+
+
+@stage_tracing.traced
+def create_security_groups(awsvars, vpc, ec2, ec2client, context):
     # Create Application Tier Security Group
     application_sec_group = ec2.create_security_group(
         DryRun=False, GroupName=awsvars['appGroupName'], Description=awsvars['applicationSecurityGroupName'],
-        VpcId=vpc.id)
+        VpcId=vpc.id,
+        TagSpecifications=tag_specifications(awsvars, 'security-group', awsvars['applicationSecurityGroupName']))
+    context.security_group_ids['app'] = application_sec_group.id
     print("Creating VPC Public Security Group with id: " + application_sec_group.id)
 
     # Create Web Tier Security Group
     alb_sec_group = ec2.create_security_group(
-        DryRun=False, GroupName=awsvars['albGroupName'], Description=awsvars['albSecurityGroupName'], VpcId=vpc.id)
+        DryRun=False, GroupName=awsvars['albGroupName'], Description=awsvars['albSecurityGroupName'], VpcId=vpc.id,
+        TagSpecifications=tag_specifications(awsvars, 'security-group', awsvars['albSecurityGroupName']))
+    context.security_group_ids['alb'] = alb_sec_group.id
     print("Creating VPC ALB Security Group with id: " + alb_sec_group.id)
 
     # Create RDS Security Group
     rds_sec_group = ec2.create_security_group(
-        DryRun=False, GroupName=awsvars['rdsGroupName'], Description=awsvars['rdsSecurityGroupName'], VpcId=vpc.id)
+        DryRun=False, GroupName=awsvars['rdsGroupName'], Description=awsvars['rdsSecurityGroupName'], VpcId=vpc.id,
+        TagSpecifications=tag_specifications(awsvars, 'security-group', awsvars['rdsSecurityGroupName']))
+    context.security_group_ids['rds'] = rds_sec_group.id
     print("Creating VPC RDS Security Group with id: " + rds_sec_group.id)
 
-    application_sec_group.create_tags(Tags=[{"Key": "Name", "Value": awsvars['applicationSecurityGroupName']}])
-    alb_sec_group.create_tags(Tags=[{"Key": "Name", "Value": awsvars['albSecurityGroupName']}])
-    rds_sec_group.create_tags(Tags=[{"Key": "Name", "Value": awsvars['rdsSecurityGroupName']}])
+    stage_tracing.annotate(sorted(context.security_group_ids.values()))
 
     print("Creating Security Group Rules")
-
-    ec2client.authorize_security_group_ingress(GroupId=alb_sec_group.id,
-                                               IpProtocol='tcp',
-                                               FromPort=80,
-                                               ToPort=80,
-                                               CidrIp='0.0.0.0/0'
-                                               )
-
-    ec2client.authorize_security_group_ingress(GroupId=alb_sec_group.id,
-                                               IpProtocol='tcp',
-                                               FromPort=443,
-                                               ToPort=443,
-                                               CidrIp='0.0.0.0/0'
-                                               )
-
-    ec2client.authorize_security_group_ingress(GroupId=alb_sec_group.id,
-                                               IpProtocol='tcp',
-                                               FromPort=22,
-                                               ToPort=22,
-                                               CidrIp=awsvars['sshCidrBlock1']
-                                               )
-
-    ec2client.authorize_security_group_ingress(GroupId=alb_sec_group.id,
-                                               IpProtocol='tcp',
-                                               FromPort=22,
-                                               ToPort=22,
-                                               CidrIp=awsvars['sshCidrBlock2']
-                                               )
-
-    ec2client.authorize_security_group_ingress(GroupId=alb_sec_group.id,
-                                               IpProtocol='tcp',
-                                               FromPort=22,
-                                               ToPort=22,
-                                               CidrIp=awsvars['sshCidrBlock3']
-                                               )
-
-    # Allow Application Security Group to receive traffic from ALB Security group
-    ec2client.authorize_security_group_ingress(GroupId=application_sec_group.id,
-                                               IpPermissions=[{'IpProtocol': 'tcp',
-                                                               'FromPort': 80,
-                                                               'ToPort': 80,
-                                                               'UserIdGroupPairs': [{'GroupId': alb_sec_group.id}]
-                                                               }]
-                                               )
-
-    ec2client.authorize_security_group_ingress(GroupId=application_sec_group.id,
-                                               IpPermissions=[{'IpProtocol': 'tcp',
-                                                               'FromPort': 22,
-                                                               'ToPort': 22,
-                                                               'UserIdGroupPairs': [{'GroupId': alb_sec_group.id}]
-                                                               }]
-                                               )
-    # Allow RDS Security Group to receive traffic from Application Security group on 3306
-    ec2client.authorize_security_group_ingress(GroupId=rds_sec_group.id,
-                                               IpPermissions=[{'IpProtocol': 'tcp',
-                                                               'FromPort': 3306,
-                                                               'ToPort': 3306,
-                                                               'UserIdGroupPairs': [
-                                                                   {'GroupId': application_sec_group.id}]
-                                                               }]
-                                               )
-
-    print("Finished VPC Architecture Creation for: " + vpc.id)
+    apply_security_group_rules(awsvars, ec2client, context.security_group_ids)
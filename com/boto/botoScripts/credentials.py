@@ -0,0 +1,202 @@
+import base64
+import getpass
+import hashlib
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+
+
+#
+# credentials.py version 1
+# boto3
+# python version 2.7.14
+#
+# AWS API keys for every script, decrypted from the ansible vault at most once:
+#
+# Keys are read from the vault by name: aws_access_key_id and aws_secret_access_key,
+# or the names set with the optional vaultAccessKeyName / vaultSecretKeyName variables
+# Decrypted keys are kept in memory per vault file and modification time, so later calls in the process
+# (menu actions, batch stacks) neither prompt nor decrypt again
+# Optional on-disk cache (credentialCacheTtl seconds, default 0 = off) so later runs skip the vault's slow KDF:
+#   Fernet encrypted with a key derived from the vault password and a random salt, so the password is still needed
+#   The key is derived with PBKDF2-HMAC-SHA256 at many times the iterations of the vault's own KDF,
+#   so guessing the password from a cache file costs more than guessing it from the vault
+#   Stored in a private directory on tmpfs (/dev/shm when it exists, or credentialCacheDir), file mode 0600
+#   Ignored once it is older than the TTL or the vault file has changed since. The TTL is checked by read_cache,
+#   which deletes expired and stale files; a file never read again stays protected by its key and mode
+#   The cache directory is only used when it is owned by the current user and private to them, a directory
+#   another user created first in the shared /dev/shm is ignored
+#
+# Credentials are resolved in this order (load_credentials):
+#   a vault password file (--vault-password-file or ANSIBLE_VAULT_PASSWORD_FILE)
+#   an AWS profile (--profile or AWS_PROFILE) or the AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY environment variables
+#   the vault password prompted for without echo, when running in a terminal
+
+ACCESS_KEY_NAME = 'aws_access_key_id'
+SECRET_KEY_NAME = 'aws_secret_access_key'
+
+CREDENTIAL_ENVIRONMENT = ['AWS_PROFILE', 'AWS_ACCESS_KEY_ID']
+
+CACHE_VERSION = 2
+
+# PBKDF2 iterations of the cache key, ansible vault uses 10000
+CACHE_KDF_ITERATIONS = 600000
+
+_lock = threading.Lock()
+# (access_key_id, secret_access_key) keyed by (vault path, vault modification time)
+_keys = {}
+
+
+def vault_identity(vault_path):
+    path = os.path.abspath(vault_path)
+    return path, os.stat(path).st_mtime
+
+
+def key_names(awsvars):
+    return (awsvars.get('vaultAccessKeyName', ACCESS_KEY_NAME),
+            awsvars.get('vaultSecretKeyName', SECRET_KEY_NAME))
+
+
+def select_keys(key_data, access_key_name, secret_key_name):
+    missing = [name for name in (access_key_name, secret_key_name) if name not in key_data]
+    if missing:
+        raise ValueError("Vault has no %s, it holds: %s. Set vaultAccessKeyName and vaultSecretKeyName "
+                         "to the names used" % (" or ".join(missing), ", ".join(sorted(key_data))))
+    return key_data[access_key_name], key_data[secret_key_name]
+
+
+def decrypt_vault(vault_path, password):
+    from ansible_vault import Vault
+    with open(vault_path) as vault_file:
+        return Vault(password).load(vault_file.read())
+
+
+def cache_dir(awsvars):
+    base = awsvars.get('credentialCacheDir') or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+    return os.path.join(base, 'botoCloudArch-credentials-' + getpass.getuser())
+
+
+def cache_path(awsvars, vault_path):
+    digest = hashlib.sha256(os.path.abspath(vault_path).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(cache_dir(awsvars), digest + '.json')
+
+
+def cache_fernet(password, salt):
+    from cryptography.fernet import Fernet
+    key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, CACHE_KDF_ITERATIONS)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def private_directory(directory):
+    # True when the directory is a real directory owned by the current user, with no group or other access
+    info = os.lstat(directory)
+    owned = info.st_uid == os.getuid() if hasattr(os, 'getuid') else True
+    if stat.S_ISDIR(info.st_mode) and owned and not info.st_mode & 0o077:
+        return True
+    print("Not using the credential cache: %s must be a directory owned by you with mode 0700" % directory)
+    return False
+
+
+def remove_cache(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def read_cache(path, password, vault_mtime, ttl):
+    from cryptography.fernet import InvalidToken
+    if not os.path.exists(path) or not private_directory(os.path.dirname(path)):
+        return None
+    try:
+        with open(path) as cache_file:
+            data = json.load(cache_file)
+        if data.get('version') != CACHE_VERSION or data.get('vaultMtime') != vault_mtime:
+            # Written by an older version or for an earlier vault file
+            remove_cache(path)
+            return None
+        fernet = cache_fernet(password, base64.b64decode(data['salt']))
+        token = data['token'].encode('ascii')
+    except (ValueError, KeyError):
+        remove_cache(path)
+        return None
+    try:
+        # Fernet checks the TTL against the time the token was written
+        return json.loads(fernet.decrypt(token, ttl=ttl).decode('utf-8'))
+    except InvalidToken:
+        pass
+    try:
+        fernet.decrypt(token)
+    except InvalidToken:
+        # Written with another password, the vault is decrypted again and the file replaced if the password is right
+        return None
+    # Readable but expired
+    remove_cache(path)
+    return None
+
+
+def write_cache(path, password, vault_mtime, key_data):
+    directory = os.path.dirname(path)
+    if not os.path.lexists(directory):
+        os.makedirs(directory, 0o700)
+    if not private_directory(directory):
+        return
+    salt = os.urandom(16)
+    token = cache_fernet(password, salt).encrypt(json.dumps(key_data).encode('utf-8'))
+    data = {
+        'version': CACHE_VERSION,
+        'vaultMtime': vault_mtime,
+        'salt': base64.b64encode(salt).decode('ascii'),
+        'token': token.decode('ascii')
+    }
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    os.chmod(temp_path, 0o600)
+    with os.fdopen(handle, 'w') as temp_file:
+        json.dump(data, temp_file)
+    getattr(os, 'replace', os.rename)(temp_path, path)
+
+
+def load_vault_keys(vault_path='vault.yml', password=None, awsvars=None):
+    # Returns (access_key_id, secret_access_key), prompting for the password only when the keys are not in memory
+    awsvars = awsvars or {}
+    identity = vault_identity(vault_path)
+    with _lock:
+        if identity in _keys:
+            return _keys[identity]
+        if password is None:
+            password = getpass.getpass("Please enter API Key password: ")
+
+        ttl = awsvars.get('credentialCacheTtl', 0)
+        path = cache_path(awsvars, vault_path)
+        key_data = read_cache(path, password, identity[1], ttl) if ttl else None
+        if key_data is None:
+            key_data = decrypt_vault(vault_path, password)
+            if ttl:
+                write_cache(path, password, identity[1], key_data)
+
+        _keys[identity] = select_keys(key_data, *key_names(awsvars))
+        return _keys[identity]
+
+
+def read_password_file(path):
+    with open(os.path.expanduser(path)) as password_file:
+        return password_file.readline().rstrip('\r\n')
+
+
+def load_credentials(vault_path='vault.yml', password_file=None, profile=None, awsvars=None):
+    # Returns (access_key_id, secret_access_key), (None, None) leaves boto3 to find the credentials
+    password_file = password_file or os.environ.get('ANSIBLE_VAULT_PASSWORD_FILE')
+    if password_file:
+        return load_vault_keys(vault_path, read_password_file(password_file), awsvars)
+    if profile:
+        # Sessions are created with no keys, so boto3 reads the profile from the environment
+        os.environ['AWS_PROFILE'] = profile
+        return None, None
+    if any(os.environ.get(name) for name in CREDENTIAL_ENVIRONMENT):
+        return None, None
+    if not sys.stdin.isatty() and vault_identity(vault_path) not in _keys:
+        raise ValueError("No credentials found: use --vault-password-file, --profile or the AWS_* environment variables")
+    return load_vault_keys(vault_path, None, awsvars)
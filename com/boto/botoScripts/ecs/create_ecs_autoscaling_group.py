@@ -1,5 +1,5 @@
-import boto3
-from ansible_vault import Vault
+import client_registry
+import credentials
 
 #
 # (c) 07/10/2018 A.Dowling
@@ -10,16 +10,14 @@ from ansible_vault import Vault
 #
 # Application Auto Scaling allows you to configure automatic scaling for Amazon ECS Services
 #
+# command to run example (from com/boto/botoScripts): python -m ecs.create_ecs_autoscaling_group
+#
+region = 'eu-west-1'
+awsvars = {'region': region}
 
-password = raw_input("Please enter API Key password: ")
-print("you entered" + password)
-vault = Vault(password)
-
-key_data = vault.load(open('vault.yml').read())
-secret_access_key = list(key_data.values())[0]
-access_key_id = list(key_data.values())[1]
+access_key_id, secret_access_key = credentials.load_credentials('vault.yml', awsvars=awsvars)
 
-client = boto3.client('application-autoscaling')
+client = client_registry.get_client('application-autoscaling', awsvars, access_key_id, secret_access_key)
 
 
 scalable_target = client.register_scalable_target(
@@ -1,5 +1,5 @@
-import boto3
-from ansible_vault import Vault
+import client_registry
+import credentials
 
 #
 # (c) 07/10/2018 A.Dowling
@@ -8,15 +8,12 @@ from ansible_vault import Vault
 # boto3
 # python version 2.7.14
 #
+# command to run example (from com/boto/botoScripts): python -m ecs.deploy_ecs_container
+#
 region = 'eu-west-1'
+awsvars = {'region': region}
 
-password = raw_input("Please enter API Key password: ")
-print("you entered" + password)
-vault = Vault(password)
-
-key_data = vault.load(open('vault.yml').read())
-secret_access_key = list(key_data.values())[0]
-access_key_id = list(key_data.values())[1]
+access_key_id, secret_access_key = credentials.load_credentials('vault.yml', awsvars=awsvars)
 
 # ECS Details
 cluster_name = "CloudArchitect"
@@ -24,20 +21,10 @@ service_name = "service_cloud_architect"
 task_name = "cloud_architect"
 
 # Let's use Amazon ECS
-ecs_client = boto3.client(
-    'ecs',
-    aws_access_key_id=access_key_id,
-    aws_secret_access_key=secret_access_key,
-    region_name=region
-)
+ecs_client = client_registry.get_client('ecs', awsvars, access_key_id, secret_access_key)
 
 # Let's use Amazon EC2
-ec2_client = boto3.client(
-    'ec2',
-    aws_access_key_id=access_key_id,
-    aws_secret_access_key=secret_access_key,
-    region_name=region
-)
+ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
 
 public_security_group = ec2_client.describe_security_groups(
     Filters=[
@@ -0,0 +1,216 @@
+import re
+import time
+import security_group_rules
+import subnet_planner
+from subnet_planner import parse_network
+from tagging import stack_id
+
+
+#
+# preflight.py version 1
+# boto3
+# python version 2.7.14 (pip install ipaddress)
+#
+# Local checks of a stack's variables run before the first API call of a create, no AWS access needed:
+#
+# VPC and subnet CIDRs are valid, within the sizes AWS allows, inside the VPC and not overlapping each other,
+# for the subnets planned per availability zone (subnet_planner.py) as well as the two zone subnet variables
+# The subnet availability zones differ, there are at least two, they are in the stack's region
+# and, without availabilityZones, match the ASG zones (azZone1/2)
+# AutoScaling sizes are ordered min <= desired <= max
+# Every security group rule CIDR (securityGroupRules or sshCidrBlock1-3) is a valid IPv4 CIDR block
+# Names AWS limits in length or characters: Load Balancer, Target Group, RDS identifiers and SNS topics
+# Across the stacks of a batch: no two stacks in one region share a resource name
+# or have overlapping VPC CIDRs (unless overlaps are allowed),
+# and every stack has the same rate limit settings, as the rate limiter is shared by the whole batch
+# Every problem is collected and raised together as one PreflightError
+
+# AWS allows VPC and subnet CIDR blocks between /16 and /28
+MIN_PREFIX = 16
+MAX_PREFIX = 28
+
+# (pattern, description) per name variable
+ELB_NAME = (re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9-]{0,30}[A-Za-z0-9])?$'),
+            "1-32 letters, digits and hyphens, not starting or ending with a hyphen")
+RDS_IDENTIFIER = (re.compile(r'^[a-zA-Z](?!.*--)(?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?$'),
+                  "1-63 letters, digits and hyphens starting with a letter, not ending with a hyphen "
+                  "or holding two hyphens in a row")
+RDS_SUBNET_GROUP_NAME = (re.compile(r'^[a-zA-Z0-9 ._-]{1,255}$'),
+                         "1-255 letters, digits, spaces, periods, underscores and hyphens")
+TOPIC_NAME = (re.compile(r'^[A-Za-z0-9_-]{1,256}$'), "1-256 letters, digits, underscores and hyphens")
+
+NAME_RULES = {
+    'albName': ELB_NAME,
+    'targetGroupName': ELB_NAME,
+    'rdsDBId': RDS_IDENTIFIER,
+    'rdsSubnetGroupName': RDS_SUBNET_GROUP_NAME,
+    'scaleUpTopicName': TOPIC_NAME,
+    'scaleDownTopicName': TOPIC_NAME
+}
+
+# Names that have to be unique per account and region
+REGIONAL_NAMES = [
+    'albName', 'targetGroupName', 'rdsDBId', 'rdsSubnetGroupName', 'asgLaunchConfigName', 'autoScalingGroupName',
+    'statusCheckAlarmName', 'cpuAlarmName', 'scaleUpTopicName', 'scaleDownTopicName'
+]
+
+
+class PreflightError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super(PreflightError, self).__init__("Preflight checks failed:\n  " + "\n  ".join(errors))
+
+
+def contains(outer, inner):
+    return inner.network_address in outer and inner.broadcast_address in outer
+
+
+def network_errors(awsvars):
+    try:
+        vpc = parse_network(awsvars['vpcCidrBlock'])
+    except ValueError as error:
+        return ["vpcCidrBlock %s is not a valid CIDR block: %s" % (awsvars['vpcCidrBlock'], error)]
+    errors = []
+    if not MIN_PREFIX <= vpc.prefixlen <= MAX_PREFIX:
+        errors.append("vpcCidrBlock %s must be between /%d and /%d" % (vpc, MIN_PREFIX, MAX_PREFIX))
+    try:
+        planned = subnet_planner.plan_subnets(awsvars)
+    except ValueError as error:
+        return errors + [str(error)]
+
+    subnets = []
+    for subnet in planned:
+        try:
+            network = parse_network(subnet.cidr)
+        except ValueError as error:
+            errors.append("%s %s is not a valid CIDR block: %s" % (subnet.name, subnet.cidr, error))
+            continue
+        if not MIN_PREFIX <= network.prefixlen <= MAX_PREFIX:
+            errors.append("%s %s must be between /%d and /%d" % (subnet.name, network, MIN_PREFIX, MAX_PREFIX))
+        subnets.append((subnet.name, network))
+
+    for index, (name, subnet) in enumerate(subnets):
+        if not contains(vpc, subnet):
+            errors.append("%s %s is outside vpcCidrBlock %s" % (name, subnet, vpc))
+        for other_name, other in subnets[index + 1:]:
+            if subnet.overlaps(other):
+                errors.append("%s %s overlaps %s %s" % (name, subnet, other_name, other))
+    return errors
+
+
+def zone_errors(awsvars):
+    errors = []
+    subnet_zones = subnet_planner.zones(awsvars)
+    if len(set(subnet_zones)) < 2:
+        errors.append("The subnets need at least two availability zones, not %s" % ", ".join(subnet_zones))
+    elif len(set(subnet_zones)) < len(subnet_zones):
+        errors.append("Availability zones are listed more than once: %s" % ", ".join(subnet_zones))
+    for zone in subnet_zones:
+        if not zone.startswith(awsvars['region']):
+            errors.append("Availability zone %s is not in region %s" % (zone, awsvars['region']))
+    if subnet_planner.is_planned(awsvars):
+        # The ASG spans the planned zones
+        return errors
+
+    asg_zones = subnet_planner.asg_zones(awsvars)
+    for name in ['azZone1', 'azZone2']:
+        if not awsvars[name].startswith(awsvars['region']):
+            errors.append("%s %s is not in region %s" % (name, awsvars[name], awsvars['region']))
+    if set(asg_zones) != set(subnet_zones):
+        errors.append("ASG zones azZone1/azZone2 (%s) do not match the subnet zones availabilityZone1/2 (%s)"
+                      % (", ".join(asg_zones), ", ".join(subnet_zones)))
+    return errors
+
+
+def security_group_errors(awsvars):
+    errors = []
+    rules = security_group_rules.security_group_rules(awsvars)
+    for tier in sorted(rules):
+        for rule in rules[tier]:
+            for cidr in rule.get('cidrs', []):
+                try:
+                    network = parse_network(cidr)
+                except ValueError as error:
+                    errors.append("%s security group rule CIDR %s is not a valid CIDR block: %s" % (tier, cidr, error))
+                    continue
+                if network.version != 4:
+                    errors.append("%s security group rule CIDR %s must be an IPv4 CIDR block" % (tier, cidr))
+    return errors
+
+
+def capacity_errors(awsvars):
+    sizes = (awsvars['asgMinSize'], awsvars['asgDesiredSize'], awsvars['asgMaxSize'])
+    if not sizes[0] <= sizes[1] <= sizes[2]:
+        return ["AutoScaling sizes must be ordered asgMinSize <= asgDesiredSize <= asgMaxSize, not %d, %d, %d"
+                % sizes]
+    if sizes[2] < 1:
+        return ["asgMaxSize must be at least 1"]
+    return []
+
+
+def name_errors(awsvars):
+    errors = []
+    for name, (pattern, description) in sorted(NAME_RULES.items()):
+        if not pattern.match(awsvars[name]):
+            errors.append("%s %r must be %s" % (name, awsvars[name], description))
+    if awsvars['albName'].lower().startswith('internal-'):
+        errors.append("albName %r must not start with internal-" % awsvars['albName'])
+    return errors
+
+
+def stack_errors(awsvars):
+    return (network_errors(awsvars) + zone_errors(awsvars) + security_group_errors(awsvars) + capacity_errors(awsvars)
+            + name_errors(awsvars))
+
+
+def cross_stack_errors(stacks, allow_cidr_overlap=False):
+    errors = []
+    for name in ('rateLimiting', 'rateLimits'):
+        if any(awsvars.get(name) != stacks[0].get(name) for awsvars in stacks):
+            errors.append("%s differs between stacks, the rate limiter is configured once for the whole batch" % name)
+    by_region = {}
+    for awsvars in stacks:
+        by_region.setdefault(awsvars['region'], []).append(awsvars)
+
+    for region, region_stacks in sorted(by_region.items()):
+        for name in REGIONAL_NAMES:
+            owners = {}
+            for awsvars in region_stacks:
+                owners.setdefault(awsvars[name], []).append(stack_id(awsvars))
+            for value, stack_ids in sorted(owners.items()):
+                if len(stack_ids) > 1:
+                    errors.append("%s %s is used by stacks %s in %s" % (name, value, ", ".join(stack_ids), region))
+        if allow_cidr_overlap:
+            continue
+        for index, awsvars in enumerate(region_stacks):
+            for other in region_stacks[index + 1:]:
+                try:
+                    overlapping = parse_network(awsvars['vpcCidrBlock']).overlaps(parse_network(other['vpcCidrBlock']))
+                except ValueError:
+                    # Reported by the per-stack checks
+                    continue
+                if overlapping:
+                    errors.append("vpcCidrBlock %s of stack %s overlaps %s of stack %s in %s" % (
+                        awsvars['vpcCidrBlock'], stack_id(awsvars),
+                        other['vpcCidrBlock'], stack_id(other), region))
+    return errors
+
+
+def check(awsvars):
+    started = time.time()
+    errors = stack_errors(awsvars)
+    if errors:
+        raise PreflightError(errors)
+    print("Preflight checks passed in %.1fms" % ((time.time() - started) * 1000))
+
+
+def check_stacks(stacks, allow_cidr_overlap=False):
+    started = time.time()
+    errors = []
+    for awsvars in stacks:
+        errors.extend("%s in %s: %s" % (stack_id(awsvars), awsvars['region'], error)
+                      for error in stack_errors(awsvars))
+    errors.extend(cross_stack_errors(stacks, allow_cidr_overlap))
+    if errors:
+        raise PreflightError(errors)
+    print("Preflight checks passed for %d stacks in %.1fms" % (len(stacks), (time.time() - started) * 1000))
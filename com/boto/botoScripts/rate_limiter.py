@@ -0,0 +1,234 @@
+import threading
+import time
+from api_metrics import THROTTLING_ERROR_CODES
+
+
+#
+# rate_limiter.py version 1
+# boto3
+# python version 2.7.14
+#
+# Process wide adaptive rate limiter shared by every client created by client_registry:
+#
+# One token bucket per service, region and API category (describe or mutate),
+# as AWS throttles read only and mutating calls separately
+# Every request attempt, including retries, takes a token before it is sent (botocore before-send hook)
+# Rates tune themselves with AIMD from the responses seen (botocore needs-retry hook):
+#   a throttling error halves the bucket's rate, each successful call adds a little back up to the configured rate
+# Time spent waiting on tokens is reported per bucket after every run
+#
+# Rates are read from the optional rateLimits variable in awsVariables.yml, per service or as defaults, e.g.
+#   rateLimits:
+#     default: {describe: {rate: 20, burst: 100}, mutate: {rate: 5, burst: 50}}
+#     elasticloadbalancing: {mutate: {rate: 2, burst: 10}}
+# Services are named by their endpoint prefix (RATE_LIMIT_SCOPES), e.g. monitoring for CloudWatch
+# rateLimiting: False turns the limiter off
+# Both are read once per process, from the first stack a client is created for, as every stack shares the buckets
+
+DESCRIBE = 'describe'
+MUTATE = 'mutate'
+
+# Keys of rateLimits: default, or the endpoint prefix of a service the scripts create clients for
+RATE_LIMIT_SCOPES = [
+    'default', 'ec2', 'rds', 'elasticloadbalancing', 'autoscaling', 'application-autoscaling', 'monitoring', 'sns',
+    'ecs'
+]
+
+DEFAULT_LIMITS = {
+    DESCRIBE: {'rate': 20, 'burst': 100},
+    MUTATE: {'rate': 5, 'burst': 50}
+}
+
+# Multiplier applied to the rate on a throttling error, and the lowest rate it can fall to
+DECREASE_FACTOR = 0.5
+MIN_RATE = 0.5
+# Tokens per second added back to the rate for each successful call
+ADDITIVE_INCREASE = 0.1
+# Throttles within this many seconds of a decrease count as the same congestion event
+DECREASE_COOLDOWN = 1.0
+
+READ_PREFIXES = ('Describe', 'List', 'Get')
+
+
+def api_category(operation):
+    return DESCRIBE if operation.startswith(READ_PREFIXES) else MUTATE
+
+
+class TokenBucket(object):
+    # time_scale below 1 makes every second of the rate pass that much faster, as in the offline benchmark
+    def __init__(self, name, rate, burst, time_scale=1.0):
+        self.name = name
+        self.time_scale = time_scale
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttles = 0
+        self.min_seen_rate = self.rate
+
+    def refill(self, now):
+        # Called with the lock held
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.time_scale * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # Returns the seconds spent waiting for the token
+        started = time.time()
+        waited = False
+        while True:
+            with self.lock:
+                now = time.time()
+                self.refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.acquired += 1
+                    if waited:
+                        self.waits += 1
+                        self.wait_seconds += now - started
+                    return now - started if waited else 0
+                delay = (1 - self.tokens) / self.rate * self.time_scale
+            time.sleep(delay)
+            waited = True
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttles += 1
+            now = time.time()
+            if now - self.last_decrease < DECREASE_COOLDOWN * self.time_scale:
+                return
+            self.refill(now)
+            self.last_decrease = now
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            self.min_seen_rate = min(self.min_seen_rate, self.rate)
+            print("Throttled on %s, reducing rate to %.1f calls/s" % (self.name, self.rate))
+
+
+class RateLimiter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.limits = {}
+        self.enabled = True
+        # (rateLimiting, rateLimits) of the first stack configured, and the differing ones already reported
+        self.settings = None
+        self.ignored = []
+        # Applied to the buckets created from now on, see TokenBucket
+        self.time_scale = 1.0
+        # Endpoint prefixes keyed by the hyphenized service id used in event names
+        self.services = {}
+
+    def configure(self, awsvars):
+        # The buckets are shared by every stack in the process, so the first stack's settings apply to all of them
+        # rather than each new client changing the limits under the stacks already running
+        settings = (awsvars.get('rateLimiting', True), awsvars.get('rateLimits', {}) or {})
+        with self.lock:
+            if self.settings is None:
+                self.settings = settings
+                self.enabled, self.limits = settings
+            elif settings != self.settings and settings not in self.ignored:
+                self.ignored.append(settings)
+                print("Ignoring the rateLimiting / rateLimits of stack %s, the rate limiter is configured once "
+                      "per process" % awsvars.get('stackId', awsvars['region']))
+
+    def register(self, event_system):
+        # Registered first so the token is taken before any other before-send handler answers the request
+        event_system.register_first('before-send', self.before_send)
+        event_system.register('needs-retry', self.needs_retry)
+
+    def add_client(self, client):
+        # Event names carry the service id (elastic-load-balancing-v2), while buckets and rateLimits
+        # use the endpoint prefix (elasticloadbalancing)
+        service_model = client.meta.service_model
+        with self.lock:
+            self.services[service_model.service_id.hyphenize()] = service_model.endpoint_prefix
+
+    def limit(self, service, category):
+        limits = dict(DEFAULT_LIMITS[category])
+        for scope in ('default', service):
+            limits.update(self.limits.get(scope, {}).get(category, {}))
+        return limits
+
+    def bucket(self, service, region, category):
+        key = (service, region, category)
+        with self.lock:
+            if key not in self.buckets:
+                limits = self.limit(service, category)
+                self.buckets[key] = TokenBucket("%s %s %s" % (service, region, category),
+                                                limits['rate'], limits['burst'], self.time_scale)
+            return self.buckets[key]
+
+    def request_bucket(self, event_name, context):
+        # Event names are <event>.<service id>.<operation>
+        _, service_id, operation = event_name.split('.')[:3]
+        service = self.services.get(service_id, service_id)
+        return self.bucket(service, context.get('client_region'), api_category(operation))
+
+    def before_send(self, request, event_name, **kwargs):
+        if self.enabled:
+            self.request_bucket(event_name, request.context or {}).acquire()
+        return None
+
+    def needs_retry(self, response, request_dict, event_name, **kwargs):
+        if not self.enabled or response is None:
+            return None
+        bucket = self.request_bucket(event_name, request_dict['context'])
+        if response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            bucket.on_throttle()
+        elif response[0].status_code < 400:
+            bucket.on_success()
+        return None
+
+    def print_summary(self):
+        with self.lock:
+            buckets = sorted(self.buckets.items())
+        if not buckets:
+            return
+        row_format = "%-44s %7s %7s %10s %9s %12s %12s"
+        print(row_format % ('Rate Limit Bucket', 'Calls', 'Waits', 'Waited s', 'Throttles', 'Rate now', 'Lowest rate'))
+        for key, bucket in buckets:
+            print(row_format % (bucket.name, bucket.acquired, bucket.waits, "%.2f" % bucket.wait_seconds,
+                                bucket.throttles, "%.1f/s" % bucket.rate, "%.1f/s" % bucket.min_seen_rate))
+
+    def wait_seconds(self):
+        with self.lock:
+            return sum(bucket.wait_seconds for bucket in self.buckets.values())
+
+    def reset(self, time_scale=1.0):
+        # Starts again with no buckets and no configuration, e.g. between the runs the benchmark compares,
+        # so no run inherits another's drained tokens or reduced rates
+        with self.lock:
+            self.buckets = {}
+            self.settings = None
+            self.ignored = []
+            self.enabled = True
+            self.limits = {}
+            self.time_scale = time_scale
+
+    def reset_stats(self):
+        # Learned rates are kept between runs, only the counters start again
+        with self.lock:
+            for bucket in self.buckets.values():
+                with bucket.lock:
+                    bucket.reset_stats()
+
+
+# One limiter per process, shared by every session and client
+limiter = RateLimiter()
+
+
+def report_run(awsvars):
+    limiter.print_summary()
+    limiter.reset_stats()
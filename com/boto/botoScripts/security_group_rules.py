@@ -0,0 +1,129 @@
+#
+# security_group_rules.py version 1
+# boto3
+# python version 2.7.14
+#
+# Applies the 3 tier security group ingress rules from a data table:
+#
+# Rules are read from securityGroupRules in awsVariables.yml, keyed by tier (alb, app, rds), e.g.
+#
+#   securityGroupRules:
+#     alb:
+#       - {protocol: tcp, ports: [80, 443], cidrs: [0.0.0.0/0]}
+#       - {protocol: tcp, ports: [22], cidrs: [10.1.0.0/16, 10.2.0.0/16]}
+#     app:
+#       - {protocol: tcp, ports: [80, 22], sourceGroups: [alb]}
+#     rds:
+#       - {protocol: tcp, ports: [3306], sourceGroups: [app]}
+#
+# Ports are either a single port or a "from-to" range, protocols are tcp or udp in any case
+# The table is checked by config_loader.py (tiers, keys, ports and protocols) and preflight.py (CIDRs)
+# Without a securityGroupRules table the original rules are built from sshCidrBlock1-3
+# Existing rules are described once for all groups and only missing rules are authorized,
+# with one authorize_security_group_ingress call per group
+
+TIERS = ('alb', 'app', 'rds')
+PROTOCOLS = ('tcp', 'udp')
+RULE_KEYS = ('protocol', 'ports', 'cidrs', 'sourceGroups')
+
+
+def default_rules(awsvars):
+    ssh_cidrs = [awsvars[key] for key in ('sshCidrBlock1', 'sshCidrBlock2', 'sshCidrBlock3') if awsvars.get(key)]
+    return {
+        'alb': [
+            {'protocol': 'tcp', 'ports': [80, 443], 'cidrs': ['0.0.0.0/0']},
+            {'protocol': 'tcp', 'ports': [22], 'cidrs': ssh_cidrs},
+        ],
+        'app': [
+            {'protocol': 'tcp', 'ports': [80, 22], 'sourceGroups': ['alb']},
+        ],
+        'rds': [
+            {'protocol': 'tcp', 'ports': [3306], 'sourceGroups': ['app']},
+        ],
+    }
+
+
+def security_group_rules(awsvars):
+    return awsvars.get('securityGroupRules') or default_rules(awsvars)
+
+
+def port_range(port):
+    if isinstance(port, int):
+        return port, port
+    from_port, _, to_port = str(port).partition('-')
+    return int(from_port), int(to_port or from_port)
+
+
+def protocol(rule):
+    # Security groups describe their rules with lower case protocols
+    return rule['protocol'].lower()
+
+
+def rule_keys(rules, group_ids):
+    # Flatten the table into one key per (protocol, from port, to port, source)
+    keys = set()
+    for rule in rules:
+        for port in rule['ports']:
+            from_port, to_port = port_range(port)
+            for cidr in rule.get('cidrs', []):
+                keys.add((protocol(rule), from_port, to_port, 'cidr', cidr))
+            for tier in rule.get('sourceGroups', []):
+                keys.add((protocol(rule), from_port, to_port, 'group', group_ids[tier]))
+    return keys
+
+
+def permission_keys(ip_permissions):
+    keys = set()
+    for permission in ip_permissions:
+        protocol = permission['IpProtocol']
+        from_port = permission.get('FromPort')
+        to_port = permission.get('ToPort')
+        for ip_range in permission.get('IpRanges', []):
+            keys.add((protocol, from_port, to_port, 'cidr', ip_range['CidrIp']))
+        for pair in permission.get('UserIdGroupPairs', []):
+            keys.add((protocol, from_port, to_port, 'group', pair['GroupId']))
+    return keys
+
+
+def ip_permissions(keys):
+    # Group the keys back into one IpPermissions entry per protocol and port range
+    permissions = {}
+    for protocol, from_port, to_port, source_type, source in sorted(keys):
+        permission = permissions.setdefault((protocol, from_port, to_port), {
+            'IpProtocol': protocol,
+            'FromPort': from_port,
+            'ToPort': to_port,
+            'IpRanges': [],
+            'UserIdGroupPairs': []
+        })
+        if source_type == 'cidr':
+            permission['IpRanges'].append({'CidrIp': source})
+        else:
+            permission['UserIdGroupPairs'].append({'GroupId': source})
+    for permission in permissions.values():
+        for source_list in ('IpRanges', 'UserIdGroupPairs'):
+            if not permission[source_list]:
+                del permission[source_list]
+    return [permissions[key] for key in sorted(permissions)]
+
+
+def apply_security_group_rules(awsvars, ec2client, group_ids):
+    rules = security_group_rules(awsvars)
+
+    existing = {}
+    groups = ec2client.describe_security_groups(GroupIds=[group_ids[tier] for tier in rules])
+    for group in groups['SecurityGroups']:
+        existing[group['GroupId']] = permission_keys(group['IpPermissions'])
+
+    for tier in sorted(rules):
+        group_id = group_ids[tier]
+        missing = rule_keys(rules[tier], group_ids) - existing.get(group_id, set())
+        if not missing:
+            print("Security Group Rules already in place for: " + group_id)
+            continue
+
+        ec2client.authorize_security_group_ingress(
+            GroupId=group_id,
+            IpPermissions=ip_permissions(missing)
+        )
+        print("Authorized %d Security Group Rules for: %s" % (len(missing), group_id))
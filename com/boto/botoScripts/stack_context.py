@@ -0,0 +1,171 @@
+from stack_state import StackState
+from subnet_planner import PUBLIC, PRIVATE, plan_subnets, tier_subnets
+
+
+#
+# stack_context.py version 1
+# boto3
+# python version 2.7.14
+#
+# Resolved resource ids for one stack, handed from stage to stage:
+#
+# create_vpc fills in the VPC, subnet, gateway, route table and security group ids
+# create_alb and create_autoscaling_group add the Load Balancer, Target Group and ASG details
+# Stages run standalone read the context from the stack's state file,
+# or build it with one batched lookup per resource type when there is no state file
+
+
+# Fields persisted to the state file, the RDS endpoint Future is only meaningful in process
+STATE_FIELDS = [
+    'vpc_id', 'internet_gateway_id', 'eip_allocation_ids', 'nat_gateway_ids', 'public_route_table_id',
+    'private_route_table_ids', 'public_subnet_ids', 'private_subnet_ids', 'security_group_ids',
+    'public_instance_ids', 'load_balancer_arn', 'target_group_arn', 'listener_arn', 'autoscaling_group_name', 'sns_topic_arns'
+]
+
+# Single ids recorded by state files written before NAT Gateways could be planned per zone, and their list fields
+LEGACY_STATE_FIELDS = {
+    'eip_allocation_id': 'eip_allocation_ids',
+    'nat_gateway_id': 'nat_gateway_ids',
+    'private_route_table_id': 'private_route_table_ids'
+}
+
+
+def state_ids(resources, field):
+    # Ids of a list field, read from the older single id field when only that is recorded
+    for legacy_field, list_field in LEGACY_STATE_FIELDS.items():
+        if list_field == field and resources.get(legacy_field) and not resources.get(field):
+            return [resources[legacy_field]]
+    return resources.get(field) or []
+
+
+class StackContext(object):
+    def __init__(self):
+        # VPC stage
+        self.vpc_id = None
+        self.internet_gateway_id = None
+        self.public_route_table_id = None
+        # Elastic IP, NAT Gateway and Private Route Table ids, one shared or one per availability zone
+        self.eip_allocation_ids = []
+        self.nat_gateway_ids = []
+        self.private_route_table_ids = []
+        # Subnet ids ordered by availability zone (subnet 1 ... subnet N)
+        self.public_subnet_ids = []
+        self.private_subnet_ids = []
+        # Security group ids keyed by tier: 'alb', 'app' and 'rds'
+        self.security_group_ids = {}
+
+        # EC2 stage
+        self.public_instance_ids = []
+
+        # Load Balancer stage
+        self.load_balancer_arn = None
+        self.target_group_arn = None
+        self.listener_arn = None
+
+        # AutoScaling stage
+        self.autoscaling_group_name = None
+
+        # SNS stage
+        self.sns_topic_arns = []
+
+        # RDS stage, a Future resolving to the endpoint address once the instance is available
+        self.db_endpoint = None
+
+    def to_dict(self):
+        # Unset fields are left out so saving a partial context never clears recorded ids,
+        # a list of ids only partly created keeps None for those not created
+        return dict((field, getattr(self, field)) for field in STATE_FIELDS if has_ids(getattr(self, field)))
+
+    @classmethod
+    def from_dict(cls, resources):
+        context = cls()
+        for field in STATE_FIELDS:
+            if resources.get(field) is not None:
+                setattr(context, field, resources[field])
+        for field in LEGACY_STATE_FIELDS.values():
+            setattr(context, field, state_ids(resources, field))
+        return context
+
+    def save_state(self, awsvars):
+        StackState(awsvars).update(self.to_dict())
+
+    @classmethod
+    def load(cls, awsvars, ec2_client):
+        state = StackState(awsvars)
+        context = cls.from_dict(state.resources)
+        if context.vpc_id and has_all_ids(context.public_subnet_ids) and has_all_ids(context.private_subnet_ids) \
+                and len(context.security_group_ids) == 3:
+            print("Read stack resources from state file: " + state.path)
+            return context
+        return cls.discover(awsvars, ec2_client)
+
+    @classmethod
+    def discover(cls, awsvars, ec2_client):
+        context = cls()
+        planned = plan_subnets(awsvars)
+        public_names = [subnet.name for subnet in tier_subnets(planned, PUBLIC)]
+        private_names = [subnet.name for subnet in tier_subnets(planned, PRIVATE)]
+
+        subnets = ec2_client.describe_subnets(
+            Filters=[
+                {
+                    'Name': 'tag:Name',
+                    'Values': public_names + private_names
+                },
+            ]
+        )
+        subnet_ids = {}
+        for subnet in subnets['Subnets']:
+            subnet_ids[tag_value(subnet, 'Name')] = subnet['SubnetId']
+            context.vpc_id = subnet['VpcId']
+        context.public_subnet_ids = [subnet_ids[name] for name in public_names if name in subnet_ids]
+        context.private_subnet_ids = [subnet_ids[name] for name in private_names if name in subnet_ids]
+        print("Retrieved Public Subnets: ", context.public_subnet_ids)
+        print("Retrieved Private Subnets: ", context.private_subnet_ids)
+
+        group_tiers = {
+            awsvars['albGroupName']: 'alb',
+            awsvars['appGroupName']: 'app',
+            awsvars['rdsGroupName']: 'rds'
+        }
+        security_groups = ec2_client.describe_security_groups(
+            Filters=[
+                {
+                    'Name': 'group-name',
+                    'Values': list(group_tiers)
+                },
+            ]
+        )
+        for group in security_groups['SecurityGroups']:
+            context.security_group_ids[group_tiers[group['GroupName']]] = group['GroupId']
+        print("Retrieved Security Groups: ", context.security_group_ids)
+
+        return context
+
+    def discover_target_group(self, awsvars, elb_client):
+        if self.target_group_arn:
+            return
+        targetgroup = elb_client.describe_target_groups(
+            Names=[
+                awsvars['targetGroupName'],
+            ]
+        )
+        self.target_group_arn = targetgroup['TargetGroups'][0]['TargetGroupArn']
+        print("Retrieving Target Group: " + self.target_group_arn)
+
+
+def has_ids(value):
+    if isinstance(value, list):
+        return any(value)
+    return bool(value)
+
+
+def has_all_ids(ids):
+    return bool(ids) and all(ids)
+
+
+def tag_value(resource, key):
+    for tag in resource.get('Tags', []):
+        if tag['Key'] == key:
+            return tag['Value']
+    return None
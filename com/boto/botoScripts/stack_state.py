@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from tagging import stack_id
+
+
+#
+# stack_state.py version 1
+# boto3
+# python version 2.7.14
+#
+# Local state file recording every resource id / ARN created for a stack:
+#
+# One JSON file per stack and region in stateDir (awsVariables.yml, default .stack_state)
+# Written atomically (temporary file then rename) after every create stage
+# Read by teardown and the standalone stage scripts so they can skip describe-by-tag discovery
+# A file written for a different stack id or region is treated as stale and ignored
+# Also checkpoints the create stages that have completed, so a failed create can be resumed,
+# and the stages that failed, which may have left resources behind
+
+STATE_VERSION = 1
+
+
+def state_path(awsvars):
+    filename = "%s-%s.json" % (stack_id(awsvars), awsvars['region'])
+    return os.path.join(awsvars.get('stateDir', '.stack_state'), filename.replace(os.sep, '_'))
+
+
+class StackState(object):
+    def __init__(self, awsvars):
+        self.path = state_path(awsvars)
+        self.stack_id = stack_id(awsvars)
+        self.region = awsvars['region']
+        self.resources = {}
+        self.completed_stages = []
+        self.failed_stages = []
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as state_file:
+            data = json.load(state_file)
+        if (data.get('version') != STATE_VERSION or data.get('stackId') != self.stack_id
+                or data.get('region') != self.region):
+            print("Ignoring stale state file: " + self.path)
+            return
+        self.resources = data.get('resources', {})
+        self.completed_stages = data.get('completedStages', [])
+        self.failed_stages = data.get('failedStages', [])
+
+    def exists(self):
+        return bool(self.resources)
+
+    def get(self, key, default=None):
+        return self.resources.get(key, default)
+
+    def update(self, resources):
+        with self.lock:
+            self.resources.update(resources)
+            self.save()
+
+    def is_completed(self, stage_name):
+        return stage_name in self.completed_stages
+
+    def mark_completed(self, stage_name):
+        with self.lock:
+            if stage_name not in self.completed_stages:
+                self.completed_stages.append(stage_name)
+            if stage_name in self.failed_stages:
+                self.failed_stages.remove(stage_name)
+            self.save()
+
+    def is_failed(self, stage_name):
+        return stage_name in self.failed_stages
+
+    def mark_failed(self, stage_name):
+        with self.lock:
+            if stage_name not in self.failed_stages:
+                self.failed_stages.append(stage_name)
+            self.save()
+
+    def clear_completed(self, stage_name):
+        with self.lock:
+            if stage_name in self.completed_stages:
+                self.completed_stages.remove(stage_name)
+            self.save()
+
+    def save(self):
+        # Called with the lock held
+        directory = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        data = {
+            'version': STATE_VERSION,
+            'stackId': self.stack_id,
+            'region': self.region,
+            'updated': time.time(),
+            'resources': self.resources,
+            'completedStages': self.completed_stages,
+            'failedStages': self.failed_stages
+        }
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(handle, 'w') as temp_file:
+            json.dump(data, temp_file, indent=2, sort_keys=True)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        getattr(os, 'replace', os.rename)(temp_path, self.path)
+
+    def delete(self):
+        with self.lock:
+            self.resources = {}
+            self.completed_stages = []
+            self.failed_stages = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+                print("Removed state file: " + self.path)
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import stage_tracing
+
+
+#
+# stage_scheduler.py version 1
+# boto3
+# python version 2.7.14
+#
+# Dependency graph scheduler used to run the create and teardown stages concurrently:
+#
+# Each Stage declares the resources it requires and the resources it provides
+# A stage is submitted to the worker pool as soon as every stage providing its requirements has finished
+# Stages depending on a failed stage are skipped, independent stages carry on
+# Raises StageFailedError once the graph has drained if any stage failed
+# A stage waiting on AWS returns a PendingWait rather than blocking: its worker blocks on the wait here,
+# while the async engine awaits it on the event loop without holding an executor thread
+
+
+class StageFailedError(Exception):
+    def __init__(self, failures, skipped):
+        self.failures = failures
+        self.skipped = skipped
+        message = "Stages failed: " + ", ".join(
+            "%s (%s)" % (name, error) for name, error in sorted(failures.items()))
+        if skipped:
+            message += "; skipped: " + ", ".join(sorted(skipped))
+        super(StageFailedError, self).__init__(message)
+
+
+class Stage(object):
+    def __init__(self, name, action, requires=(), provides=()):
+        self.name = name
+        self.action = action
+        self.requires = tuple(requires)
+        self.provides = tuple(provides)
+
+    def __repr__(self):
+        return "Stage(%r)" % self.name
+
+
+class PendingWait(object):
+    # The rest of a stage, resume(future) is called once future is done and returns the stage's result
+    # or another PendingWait
+    def __init__(self, future, resume=None):
+        self.future = future
+        self.resume = resume or (lambda done: done.result())
+
+
+def after_wait(future, function, *args):
+    # Carries on with function(*args) once future has resolved, raising its error if it failed
+    def resume(done):
+        done.result()
+        return function(*args)
+    return PendingWait(future, resume)
+
+
+def continue_with(action, continuation):
+    # Calls continuation(outcome) once action, including any wait it returned, has finished,
+    # outcome() returns its result or raises its error
+    try:
+        result = action()
+    except Exception as error:
+        return continuation(raise_error(error))
+    if isinstance(result, PendingWait):
+        return PendingWait(result.future,
+                           lambda done: continue_with(lambda: result.resume(done), continuation))
+    return continuation(lambda: result)
+
+
+def raise_error(error):
+    def outcome():
+        raise error
+    return outcome
+
+
+def finish(result):
+    # Blocks on each wait a stage returned until the stage is done
+    while isinstance(result, PendingWait):
+        wait([result.future])
+        result = result.resume(result.future)
+    return result
+
+
+def finishing(action):
+    return lambda: finish(action())
+
+
+def resolve_dependencies(stages):
+    # Map every required resource onto the stage that provides it
+    providers = {}
+    names = set()
+    for stage in stages:
+        if stage.name in names:
+            raise ValueError("Duplicate stage name: " + stage.name)
+        names.add(stage.name)
+        for resource in stage.provides:
+            if resource in providers:
+                raise ValueError("Resource %s is provided by both %s and %s"
+                                 % (resource, providers[resource], stage.name))
+            providers[resource] = stage.name
+
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage.name] = set()
+        for resource in stage.requires:
+            if resource not in providers:
+                raise ValueError("Stage %s requires %s which no stage provides" % (stage.name, resource))
+            if providers[resource] != stage.name:
+                dependencies[stage.name].add(providers[resource])
+
+    check_for_cycles(dependencies)
+    return dependencies
+
+
+def check_for_cycles(dependencies):
+    remaining = dict((name, set(deps)) for name, deps in dependencies.items())
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError("Stage dependency cycle between: " + ", ".join(sorted(remaining)))
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def run_stages(stages, max_workers=4, stack=None):
+    # stack labels the stage spans (stage_tracing.stack_label) when several stacks run at once
+    dependencies = resolve_dependencies(stages)
+    stage_tracing.tracer.record_dependencies(dependencies, stack)
+    stages_by_name = dict((stage.name, stage) for stage in stages)
+    dependents = dict((name, set()) for name in dependencies)
+    for name, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].add(name)
+
+    results = {}
+    failures = {}
+    skipped = set()
+    waiting = dict((name, set(deps)) for name, deps in dependencies.items())
+
+    def skip_dependents(name):
+        for dependent in dependents[name]:
+            if dependent in waiting:
+                del waiting[dependent]
+                skipped.add(dependent)
+                print("Skipping stage %s as %s did not complete" % (dependent, name))
+                skip_dependents(dependent)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    running = {}
+    try:
+        while waiting or running:
+            ready = sorted(name for name, deps in waiting.items() if not deps)
+            for name in ready:
+                del waiting[name]
+                print("Starting stage: " + name)
+                running[executor.submit(stage_tracing.run_stage, name, finishing(stages_by_name[name].action),
+                                        stack)] = name
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    print("Stage %s failed: %s" % (name, error))
+                    failures[name] = error
+                    skip_dependents(name)
+                    continue
+
+                print("Finished stage: " + name)
+                results[name] = future.result()
+                for dependent in dependents[name]:
+                    if dependent in waiting:
+                        waiting[dependent].discard(name)
+    finally:
+        executor.shutdown(wait=True)
+
+    if failures:
+        raise StageFailedError(failures, skipped)
+    return results
@@ -0,0 +1,307 @@
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from tagging import stack_id
+
+
+#
+# stage_tracing.py version 1
+# boto3
+# python version 2.7.14
+#
+# Timeline of the create and teardown runs as nested spans:
+#
+# Every stage run by the stage schedulers is a span, the create / delete functions inside it are child spans
+# Every waiter is a span from start() until its future resolves, parented to the span that started it
+# Spans record their resource id when the function knows it (annotate)
+# Functions handed to worker threads with in_current_span stay children of the span that handed them over
+# write_trace writes Chrome trace JSON, viewable in chrome://tracing or https://ui.perfetto.dev
+# Stage spans and dependencies are recorded per stack (stack id and region), so the stages of a batch's
+# concurrent stacks, which share their stage names, are kept apart
+# print_critical_path follows the stage dependencies back from the last stage to finish, within its stack,
+# and reports the waiter that dominated the wall time
+# The trace file is set with the optional traceFile variable (default stack_trace.json)
+
+STAGE = 'stage'
+CALL = 'call'
+WAITER = 'waiter'
+
+
+class Span(object):
+    def __init__(self, span_id, name, category, parent_id, track, resource_id=None, stack=None):
+        self.span_id = span_id
+        self.name = name
+        self.category = category
+        self.parent_id = parent_id
+        self.track = track
+        self.resource_id = resource_id
+        # The stack a stage span belongs to, see stack_label
+        self.stack = stack
+        self.start = time.time()
+        self.end = None
+        self.status = 'ok'
+
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def to_event(self, pid):
+        args = {'span_id': self.span_id, 'parent_id': self.parent_id, 'status': self.status}
+        if self.resource_id is not None:
+            args['resource_id'] = self.resource_id
+        if self.stack is not None:
+            args['stack'] = self.stack
+        return {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': int(self.start * 1000000),
+            'dur': int(self.duration() * 1000000),
+            'pid': pid,
+            'tid': self.track,
+            'args': args
+        }
+
+
+class Tracer(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.spans = []
+        self.track_names = {}
+        # Waiter tracks, and those of stages run a step at a time, are numbered from 1,
+        # well clear of the thread idents used for the other tracks
+        self.waiter_tracks = itertools.count(1)
+        self.waiter_track_names = {}
+        # {(stack, stage): set of (stack, stage) it depends on}
+        self.dependencies = {}
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        stack = self.stack()
+        return stack[-1] if stack else None
+
+    def open_span(self, name, category, track=None, parent=None, resource_id=None, stack=None):
+        if parent is None:
+            parent = self.current()
+        with self.lock:
+            if track is None:
+                thread = threading.current_thread()
+                track = thread.ident
+                self.track_names.setdefault(track, thread.name)
+            span = Span(next(self.ids), name, category, parent.span_id if parent else None, track, resource_id,
+                        stack)
+            self.spans.append(span)
+        return span
+
+    def run_in_span(self, name, category, function, *args, **kwargs):
+        return self.run_span(self.open_span(name, category), function, *args, **kwargs)
+
+    def run_span(self, span, function, *args, **kwargs):
+        # Runs function as the whole of span, which ends when it returns
+        try:
+            return self.run_within(span, function, *args, **kwargs)
+        except Exception:
+            span.status = 'error'
+            raise
+        finally:
+            span.end = time.time()
+
+    def run_within(self, span, function, *args, **kwargs):
+        # Runs function on this thread as part of a span opened elsewhere
+        stack = self.stack()
+        stack.append(span)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+
+    def named_track(self, name):
+        with self.lock:
+            track = next(self.waiter_tracks)
+            self.waiter_track_names[track] = name
+        return track
+
+    def trace_future(self, name, future, resource_id=None):
+        # Waiters resolve on other threads, so each one gets its own track in the trace
+        span = self.open_span(name, WAITER, track=self.named_track('waiter: ' + name), resource_id=resource_id)
+
+        def finished(done):
+            span.end = time.time()
+            if done.cancelled() or done.exception() is not None:
+                span.status = 'error'
+
+        future.add_done_callback(finished)
+        return future
+
+    def annotate(self, resource_id):
+        span = self.current()
+        if span is not None:
+            span.resource_id = resource_id
+
+    def record_dependencies(self, dependencies, stack=None):
+        with self.lock:
+            for name, names in dependencies.items():
+                self.dependencies[(stack, name)] = set((stack, dependency) for dependency in names)
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.waiter_track_names = {}
+            self.dependencies = {}
+
+    def trace_events(self):
+        pid = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+            track_names = dict(self.track_names)
+            track_names.update(self.waiter_track_names)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': track, 'args': {'name': name}}
+                  for track, name in track_names.items()]
+        return events + [span.to_event(pid) for span in spans]
+
+    def write_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, trace_file)
+        print("Wrote stage trace: " + path)
+
+    def stage_of(self, span, spans_by_id):
+        while span is not None and span.category != STAGE:
+            span = spans_by_id.get(span.parent_id)
+        return span
+
+    def critical_path(self):
+        with self.lock:
+            spans = list(self.spans)
+            dependencies = dict(self.dependencies)
+        # The latest run of each stage of each stack counts, e.g. after a resume
+        stages = dict(((span.stack, span.name), span) for span in spans if span.category == STAGE and span.end)
+        if not stages:
+            return []
+        current = max(stages.values(), key=lambda span: span.end)
+        path = [current]
+        while True:
+            previous = [stages[key] for key in dependencies.get((current.stack, current.name), ()) if key in stages]
+            if not previous:
+                break
+            current = max(previous, key=lambda span: span.end)
+            path.append(current)
+        return list(reversed(path))
+
+    def print_critical_path(self):
+        with self.lock:
+            spans = list(self.spans)
+        if not spans:
+            return
+        spans_by_id = dict((span.span_id, span) for span in spans)
+        wall_start = min(span.start for span in spans)
+        wall_time = max(span.start + span.duration() for span in spans) - wall_start
+        path = self.critical_path()
+        # Stages are only labelled with their stack when the run covered several stacks
+        several_stacks = len(set(span.stack for span in spans if span.category == STAGE)) > 1
+
+        def label(stage):
+            return "%s %s" % (stage.stack, stage.name) if several_stacks and stage.stack else stage.name
+
+        waiters = [span for span in spans if span.category == WAITER]
+        waiter_stages = dict((waiter.span_id, self.stage_of(waiter, spans_by_id)) for waiter in waiters)
+
+        print("Critical path (%.1fs wall time):" % wall_time)
+        width = max([24] + [len(label(stage)) for stage in path])
+        for stage in path:
+            stage_waiters = [waiter for waiter in waiters if waiter_stages[waiter.span_id] is stage]
+            longest = max(stage_waiters, key=lambda waiter: waiter.duration()) if stage_waiters else None
+            print("  %-*s %8.1fs  starts at %7.1fs%s" % (
+                width, label(stage), stage.duration(), stage.start - wall_start,
+                "  longest waiter: %s (%.1fs)" % (longest.name, longest.duration()) if longest else ""))
+
+        if not waiters:
+            return
+        print("Slowest waiters:")
+        for waiter in sorted(waiters, key=lambda waiter: waiter.duration(), reverse=True)[:5]:
+            stage = waiter_stages[waiter.span_id]
+            print("  %-48s %8.1fs  %3d%% of wall time  stage %s" % (
+                waiter.name, waiter.duration(), 100 * waiter.duration() / wall_time if wall_time else 0,
+                label(stage) if stage else '-'))
+
+        # Waiters on the critical path, or still running after it ended, decide the wall time
+        path_end = path[-1].end if path else wall_start
+        deciding = [waiter for waiter in waiters
+                    if waiter_stages[waiter.span_id] in path or waiter.start + waiter.duration() > path_end]
+        if deciding:
+            dominant = max(deciding, key=lambda waiter: waiter.duration())
+            print("Waiter dominating wall time: %s (%.1fs, %d%%)" % (
+                dominant.name, dominant.duration(), 100 * dominant.duration() / wall_time if wall_time else 0))
+
+
+# One tracer per process, shared by every engine, stage and waiter
+tracer = Tracer()
+
+
+def traced(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return tracer.run_in_span(function.__name__, CALL, function, *args, **kwargs)
+    return wrapper
+
+
+def in_current_span(function):
+    # Work handed to another thread keeps the caller's span as its parent,
+    # so its calls and waiters are still counted in the caller's stage
+    parent = tracer.current()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if parent is None:
+            return function(*args, **kwargs)
+        stack = tracer.stack()
+        stack.append(parent)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+    return wrapper
+
+
+def stack_label(awsvars):
+    # A batch can run the same stack id in several regions, so both tell its stages apart
+    return "%s/%s" % (stack_id(awsvars), awsvars['region'])
+
+
+def run_stage(name, action, stack=None):
+    return tracer.run_span(tracer.open_span(name, STAGE, stack=stack), action)
+
+
+def open_stage(name, stack=None):
+    # For a stage whose steps run on different threads, e.g. before and after a wait in the async engine,
+    # each step runs with run_in_stage and the span ends with close_stage
+    track = tracer.named_track('stage: %s %s' % (stack, name) if stack else 'stage: ' + name)
+    return tracer.open_span(name, STAGE, track=track, stack=stack)
+
+
+def run_in_stage(span, function, *args):
+    return tracer.run_within(span, function, *args)
+
+
+def close_stage(span, failed=False):
+    if failed:
+        span.status = 'error'
+    span.end = time.time()
+
+
+def annotate(resource_id):
+    tracer.annotate(resource_id)
+
+
+def report_run(awsvars):
+    # Prints the critical path and writes the trace file for the run, then starts a new trace
+    tracer.print_critical_path()
+    tracer.write_trace(awsvars.get('traceFile', 'stack_trace.json'))
+    tracer.reset()
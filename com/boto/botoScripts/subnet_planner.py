@@ -0,0 +1,170 @@
+import ipaddress
+import math
+
+
+#
+# subnet_planner.py version 1
+# boto3
+# python version 2.7.14 (pip install ipaddress)
+#
+# Plans the public and private subnets of a stack, one of each per availability zone:
+#
+# With the optional availabilityZones list the VPC CIDR is carved into equal blocks for any number of zones,
+# public subnets first (zone 1..N) then private subnets, named "<publicSubnetNamePrefix> <n>" and
+# "<privateSubnetNamePrefix> <n>"
+# The block size is subnetPrefixLength, or by default the smallest split of the VPC holding every subnet
+# Without availabilityZones the two zones, CIDRs and names set with the publicSubnet1CidrBlock ... variables are used
+# The plan is used by create_vpc, preflight, the stack context lookups, the ASG zones and teardown
+#
+# NAT Gateways are planned the same way: by default one NAT Gateway, Elastic IP and private route table shared
+# by every zone, named natGatewayName, eipName and privateRouteTable
+# With natGatewayPerZone one of each per zone, in that zone's public subnet and named "<name> <n>",
+# so each zone's outbound traffic stays in the zone
+
+PUBLIC = 'public'
+PRIVATE = 'private'
+TIERS = [PUBLIC, PRIVATE]
+
+NAME_PREFIX_VARIABLES = {
+    PUBLIC: 'publicSubnetNamePrefix',
+    PRIVATE: 'privateSubnetNamePrefix'
+}
+
+# The defaults give the same names as the two zone variables, Public Subnet 1 ... Private Subnet 2
+NAME_PREFIX_DEFAULTS = {
+    'publicSubnetNamePrefix': 'Public Subnet',
+    'privateSubnetNamePrefix': 'Private Subnet'
+}
+
+# (CIDR variable, name variable, zone variable) per subnet, when availabilityZones is not set
+LEGACY_SUBNETS = {
+    PUBLIC: [('publicSubnet1CidrBlock', 'publicSubnet1Name', 'availabilityZone1'),
+             ('publicSubnet2CidrBlock', 'publicSubnet2Name', 'availabilityZone2')],
+    PRIVATE: [('privateSubnet1CidrBlock', 'privateSubnet1Name', 'availabilityZone1'),
+              ('privateSubnet2CidrBlock', 'privateSubnet2Name', 'availabilityZone2')]
+}
+
+# AWS allows subnets no smaller than /28
+MAX_PREFIX = 28
+
+
+class PlannedSubnet(object):
+    def __init__(self, tier, index, zone, cidr, name):
+        self.tier = tier
+        # Position of the subnet's zone, 0 for the first zone
+        self.index = index
+        self.zone = zone
+        self.cidr = cidr
+        self.name = name
+
+    @property
+    def stage_name(self):
+        # Teardown stage deleting the subnet, public_subnet_1 ... private_subnet_N
+        return "%s_subnet_%d" % (self.tier, self.index + 1)
+
+    def __repr__(self):
+        return "PlannedSubnet(%s, %s, %s, %s)" % (self.name, self.tier, self.zone, self.cidr)
+
+
+class PlannedNatGateway(object):
+    def __init__(self, index, zone, name, eip_name, route_table_name, stage_suffix):
+        # Position of the zone of the public subnet holding the NAT Gateway
+        self.index = index
+        self.zone = zone
+        self.name = name
+        self.eip_name = eip_name
+        self.route_table_name = route_table_name
+        self.stage_suffix = stage_suffix
+
+    def stage_name(self, resource):
+        # Teardown stage deleting one of the NAT's resources, e.g. nat_gateway or nat_gateway_2
+        return resource + self.stage_suffix
+
+    def __repr__(self):
+        return "PlannedNatGateway(%s, %s)" % (self.name, self.zone)
+
+
+def parse_network(value):
+    # The python 2 ipaddress backport only accepts unicode text
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    return ipaddress.ip_network(u'%s' % value)
+
+
+def is_planned(awsvars):
+    return bool(awsvars.get('availabilityZones'))
+
+
+def zones(awsvars):
+    # Subnet zones in order, one public and one private subnet each
+    if is_planned(awsvars):
+        return list(awsvars['availabilityZones'])
+    return [awsvars['availabilityZone1'], awsvars['availabilityZone2']]
+
+
+def asg_zones(awsvars):
+    if is_planned(awsvars):
+        return list(awsvars['availabilityZones'])
+    return [awsvars['azZone1'], awsvars['azZone2']]
+
+
+def name_prefix(awsvars, tier):
+    variable = NAME_PREFIX_VARIABLES[tier]
+    return awsvars.get(variable, NAME_PREFIX_DEFAULTS[variable])
+
+
+def subnet_prefix_length(awsvars, vpc, count):
+    if 'subnetPrefixLength' in awsvars:
+        return awsvars['subnetPrefixLength']
+    # Enough bits to number every subnet
+    return vpc.prefixlen + int(math.ceil(math.log(max(count, 2), 2)))
+
+
+def plan_subnets(awsvars):
+    # Returns the PlannedSubnets, public then private, each in zone order
+    # Raises ValueError when the VPC CIDR cannot hold them
+    if not is_planned(awsvars):
+        return [PlannedSubnet(tier, index, awsvars[zone], awsvars[cidr], awsvars[name])
+                for tier in TIERS for index, (cidr, name, zone) in enumerate(LEGACY_SUBNETS[tier])]
+
+    zone_list = zones(awsvars)
+    vpc = parse_network(awsvars['vpcCidrBlock'])
+    count = len(TIERS) * len(zone_list)
+    prefix = subnet_prefix_length(awsvars, vpc, count)
+    if not vpc.prefixlen <= prefix <= MAX_PREFIX:
+        raise ValueError("Subnets of /%d do not fit vpcCidrBlock %s, %d subnets between /%d and /%d are needed"
+                         % (prefix, vpc, count, vpc.prefixlen, MAX_PREFIX))
+    if 2 ** (prefix - vpc.prefixlen) < count:
+        raise ValueError("vpcCidrBlock %s holds %d /%d subnets, %d are needed for %d zones"
+                         % (vpc, 2 ** (prefix - vpc.prefixlen), prefix, count, len(zone_list)))
+
+    blocks = vpc.subnets(new_prefix=prefix)
+    planned = []
+    for tier in TIERS:
+        for index, zone in enumerate(zone_list):
+            planned.append(PlannedSubnet(tier, index, zone, str(next(blocks)),
+                                         "%s %d" % (name_prefix(awsvars, tier), index + 1)))
+    return planned
+
+
+def tier_subnets(planned, tier):
+    return [subnet for subnet in planned if subnet.tier == tier]
+
+
+def plan_nat_gateways(awsvars):
+    # Returns the PlannedNatGateways in zone order
+    zone_list = zones(awsvars)
+    if not awsvars.get('natGatewayPerZone'):
+        return [PlannedNatGateway(0, zone_list[0], awsvars['natGatewayName'], awsvars['eipName'],
+                                  awsvars['privateRouteTable'], '')]
+    return [PlannedNatGateway(index, zone, "%s %d" % (awsvars['natGatewayName'], index + 1),
+                              "%s %d" % (awsvars['eipName'], index + 1),
+                              "%s %d" % (awsvars['privateRouteTable'], index + 1), '_%d' % (index + 1))
+            for index, zone in enumerate(zone_list)]
+
+
+def nat_gateway_for(nat_gateways, subnet):
+    # The NAT Gateway, and its private route table, serving the subnet's zone
+    if len(nat_gateways) == 1:
+        return nat_gateways[0]
+    return nat_gateways[subnet.index]
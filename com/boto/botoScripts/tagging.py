@@ -0,0 +1,33 @@
+#
+# tagging.py version 1
+# boto3
+# python version 2.7.14
+#
+# Builds the tags applied to every resource at creation time:
+#
+# Name tag per resource
+# Common StackId tag (stackId in awsVariables.yml, defaults to vpcName) so teardown can find every resource of a stack
+# TagSpecifications for EC2 create calls
+
+STACK_TAG_KEY = 'StackId'
+
+
+def stack_id(awsvars):
+    return awsvars.get('stackId', awsvars['vpcName'])
+
+
+def stack_tags(awsvars):
+    return [{'Key': STACK_TAG_KEY, 'Value': stack_id(awsvars)}]
+
+
+def name_tags(awsvars, name):
+    return [{'Key': 'Name', 'Value': name}] + stack_tags(awsvars)
+
+
+def tag_specifications(awsvars, resource_type, name):
+    return [
+        {
+            'ResourceType': resource_type,
+            'Tags': name_tags(awsvars, name)
+        },
+    ]
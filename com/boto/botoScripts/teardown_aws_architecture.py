@@ -1,4 +1,12 @@
-import boto3
+import client_registry
+import stage_tracing
+import waiter_multiplexer
+from botocore.exceptions import ClientError
+from stack_state import StackState
+from stage_scheduler import Stage, after_wait, continue_with, run_stages
+from stack_context import state_ids
+from subnet_planner import PUBLIC, nat_gateway_for, plan_nat_gateways, plan_subnets
+from tagging import STACK_TAG_KEY, stack_id
 
 
 #
@@ -10,33 +18,58 @@ import boto3
 #
 # Deletes all previously created AWS Architecture Components from specified parameters including:
 #
-# Deletion of all ec2 instances
+# Deletion of all ec2 instances tagged with the stack's StackId, in batches with one waiter for all of them
 # Deletion of RDS instance
-# Deletion of AutoScaling group
+# Deletion of AutoScaling group, waiting until the group and the instances it terminates are gone
 # Deletion of CloudWatch alarms and Scaling Policies
 # Deletion of SNS topics
 # Deletion of Load Balancer
 # Deletion of Security Groups
+# Deletion of NAT Gateways and Elastic IPs, per zone NAT Gateways in parallel
 # Deletion of Internet Gateway
-# Deletion of Subnets
+# Deletion of Subnets, every planned subnet in its own stage
 # Deletion of Route Tables
 # Deletion of VPC
-
+#
+# Deletions run as a graph of dependent stages, each resource is removed as soon as
+# everything depending on it has been deleted.
+# Deletions are confirmed through the waiter multiplexer rather than fixed interval polling,
+# one batched describe call per resource type checks every pending deletion of every stack in the region.
+# A delete function waiting on a deletion returns it as a PendingWait, rather than blocking its stage's thread.
+# Resource ids are read from the stack's state file, resources missing from it are found by their Name
+# and StackId tags, so a stack never finds another stack's resource of the same name.
+# Re-running a teardown skips the resources already deleted, whether looked up by id or by tag.
+# Every delete function is traced as a span within its stage.
+
+# terminate_instances and describe_instances accept at most 1000 instance ids per call
+MAX_INSTANCE_IDS = 1000
+
+# Teardown stages deleting what a create stage can leave behind when it fails part way,
+# the VPC stage's network resources are those of every teardown stage not listed here or in APPLICATION_STAGES
+# The ec2, cloudwatch and sns stages create their resources in one call or idempotently and need none
+PARTIAL_CREATE_CLEANUP = {
+    'rds': ['rds', 'rds_subnet_group'],
+    'alb': ['alb', 'target_group'],
+    'asg': ['asg', 'launch_config']
+}
+APPLICATION_STAGES = ['instances', 'cloudwatch', 'sns', 'state_file']
+
+
+@stage_tracing.traced
 def delete_rds(awsvars, rds):
+    stage_tracing.annotate(awsvars['rdsDBId'])
     db_response = rds.delete_db_instance(
         DBInstanceIdentifier=awsvars['rdsDBId'],
         SkipFinalSnapshot=True
     )
     print("Waiting for RDS Instance Deletion . . .")
-    waiter = rds.get_waiter('db_instance_deleted')
-    waiter.wait(
-        DBInstanceIdentifier=awsvars['rdsDBId'],
-    )
-
-    print("Deleted RDS Instance: ", db_response)
+    return after_wait(db_instance_deleted_waiter(awsvars['rdsDBId'], rds).start(),
+                      deleted, "Deleted RDS Instance: ", db_response)
 
 
+@stage_tracing.traced
 def delete_rds_subnet(awsvars, rds):
+    stage_tracing.annotate(awsvars['rdsSubnetGroupName'])
     sg_response = rds.delete_db_subnet_group(
         DBSubnetGroupName=awsvars['rdsSubnetGroupName']
     )
@@ -44,30 +77,61 @@ def delete_rds_subnet(awsvars, rds):
     print("Deleted DB Subnet Group: ", sg_response)
 
 
-def delete_instances(ec2, ec2_client):
-    # Retrieve running instances
-    running_instances = ec2.instances.filter(Filters=[{
-        'Name': 'instance-state-name',
-        'Values': ['running']}])
-
-    for instance in running_instances:
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@stage_tracing.traced
+def delete_instances(awsvars, ec2_client):
+    # Retrieve the stack's instances, the public server and those launched by the AutoScaling Group
+    # Instances already shutting down, e.g. terminated by the AutoScaling Group, are waited for but not terminated
+    instance_ids = []
+    terminate_ids = []
+    paginator = ec2_client.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[
+        {
+            'Name': 'tag:' + STACK_TAG_KEY,
+            'Values': [stack_id(awsvars)]
+        },
+        {
+            'Name': 'instance-state-name',
+            'Values': ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+        },
+    ]):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                instance_ids.append(instance['InstanceId'])
+                if instance['State']['Name'] != 'shutting-down':
+                    terminate_ids.append(instance['InstanceId'])
+
+    if not instance_ids:
+        print("No Instances to delete")
+        return
+    stage_tracing.annotate(instance_ids)
+
+    for instance_id_chunk in chunks(terminate_ids, MAX_INSTANCE_IDS):
         ec2_response = ec2_client.terminate_instances(
-            InstanceIds=[
-                instance.id,
-            ],
+            InstanceIds=instance_id_chunk,
             DryRun=False
         )
-        print("Waiting for Instance Termination . . . ")
-        waiter = ec2_client.get_waiter('instance_terminated')
-        waiter.wait(
-            InstanceIds=[
-                instance.id,
-            ],
-        )
-        print("Deleted Instance: ", ec2_response)
+        print("Terminating Instances: ", ec2_response)
 
+    print("Waiting for Instance Termination . . . ")
+    return after_wait(instances_terminated_waiter(instance_ids, ec2_client).start(),
+                      deleted, "Deleted Instances: ", instance_ids)
 
+
+@stage_tracing.traced
 def delete_autoscaling_group(awsvars, asg_client):
+    # A missing group is reported as a ValidationError rather than a NotFound error, so it is looked up first
+    groups = asg_client.describe_auto_scaling_groups(
+        AutoScalingGroupNames=[awsvars['autoScalingGroupName']]
+    )
+    if not groups['AutoScalingGroups']:
+        print("No AutoScaling Group to delete")
+        return
+    stage_tracing.annotate(awsvars['autoScalingGroupName'])
     cpu_policy_response = asg_client.delete_policy(
         AutoScalingGroupName=awsvars['autoScalingGroupName'],
         PolicyName=awsvars['scaleOutPolicyNameCPU']
@@ -84,10 +148,15 @@ def delete_autoscaling_group(awsvars, asg_client):
         AutoScalingGroupName=awsvars['autoScalingGroupName'],
         ForceDelete=True
     )
+    print("Waiting for AutoScaling Group Deletion . . .")
 
-    print("Deleted AutoScaling Group: ", asg_response)
+    # The group stays 'Delete in progress' while it terminates its instances, its launch configuration,
+    # target group and instances can only be removed once it has gone
+    return after_wait(autoscaling_group_deleted_waiter(awsvars['autoScalingGroupName'], asg_client).start(),
+                      deleted, "Deleted AutoScaling Group: ", asg_response)
 
 
+@stage_tracing.traced
 def delete_cloudwatch_alarms(awsvars, cw_client):
     cw_response = cw_client.delete_alarms(
         AlarmNames=[
@@ -98,161 +167,180 @@ def delete_cloudwatch_alarms(awsvars, cw_client):
     print("Deleted Cloudwatch Alarms: ", cw_response)
 
 
-def delete_alb(awsvars, elbclient):
-    alb = elbclient.describe_load_balancers(
-        Names=[
-            awsvars['albName'],
-        ]
-    )
-
-    print("Load Balancer Is: " + alb['LoadBalancers'][0]['LoadBalancerArn'])
-
-    listener = elbclient.describe_listeners(
-        LoadBalancerArn=alb['LoadBalancers'][0]['LoadBalancerArn'],
-    )
+@stage_tracing.traced
+def delete_sns_topics(awsvars, sns_client, topic_arns=None):
+    if not topic_arns:
+        topic_names = [awsvars['scaleUpTopicName'], awsvars['scaleDownTopicName']]
+        topic_arns = []
+        paginator = sns_client.get_paginator('list_topics')
+        for page in paginator.paginate():
+            for topic in page['Topics']:
+                if topic['TopicArn'].split(':')[-1] in topic_names:
+                    topic_arns.append(topic['TopicArn'])
+
+    stage_tracing.annotate(topic_arns)
+    for topic_arn in topic_arns:
+        topic_response = sns_client.delete_topic(
+            TopicArn=topic_arn
+        )
+        print("Deleted SNS Topic: ", topic_response)
 
-    rule = elbclient.describe_rules(
-        ListenerArn=listener['Listeners'][0]['ListenerArn'],
-    )
 
-    rule_response = elbclient.delete_rule(
-        RuleArn=rule['Rules'][0]['RuleArn']
-    )
-    print("Deleted Load Balancer Rule: ", rule_response)
+@stage_tracing.traced
+def delete_alb(awsvars, elbclient, load_balancer_arn=None):
+    if load_balancer_arn is None:
+        alb = elbclient.describe_load_balancers(
+            Names=[
+                awsvars['albName'],
+            ]
+        )
+        load_balancer_arn = first(alb['LoadBalancers'], 'LoadBalancerArn')
+    if load_balancer_arn is None:
+        print("No Load Balancer to delete")
+        return
 
-    listener_response = elbclient.delete_listener(
-        ListenerArn=listener['Listeners'][0]['ListenerArn']
-    )
-    print("Deleted Load Balancer Listener: ", listener_response)
+    print("Load Balancer Is: " + load_balancer_arn)
+    stage_tracing.annotate(load_balancer_arn)
 
+    # Deleting the Load Balancer also deletes its Listener and Listener Rules
     alb_response = elbclient.delete_load_balancer(
-        LoadBalancerArn=alb['LoadBalancers'][0]['LoadBalancerArn']
+        LoadBalancerArn=load_balancer_arn
     )
 
     print("Waiting for Load Balancer Deletion . . .")
-    waiter = elbclient.get_waiter('load_balancers_deleted')
-    waiter.wait(
-        LoadBalancerArns=[
-            alb['LoadBalancers'][0]['LoadBalancerArn'],
-        ],
-    )
-
-    print("Deleted Load Balancer: ", alb_response)
+    return after_wait(load_balancer_deleted_waiter(load_balancer_arn, elbclient).start(),
+                      deleted, "Deleted Load Balancer: ", alb_response)
 
 
+@stage_tracing.traced
 def delete_launch_config(awsvars, asg_client):
+    # Like the AutoScaling Group, a missing launch configuration is a ValidationError
+    launch_configs = asg_client.describe_launch_configurations(
+        LaunchConfigurationNames=[awsvars['asgLaunchConfigName']]
+    )
+    if not launch_configs['LaunchConfigurations']:
+        print("No Launch Configuration to delete")
+        return
+    stage_tracing.annotate(awsvars['asgLaunchConfigName'])
     lc_response = asg_client.delete_launch_configuration(
         LaunchConfigurationName=awsvars['asgLaunchConfigName']
     )
     print("Deleted Launch Configuration: ", lc_response)
 
 
-def delete_targetgroup(awsvars, elbclient):
-    targetgroup = elbclient.describe_target_groups(
-        Names=[
-            awsvars['targetGroupName'],
-        ]
-    )
+@stage_tracing.traced
+def delete_targetgroup(awsvars, elbclient, target_group_arn=None):
+    if target_group_arn is None:
+        targetgroup = elbclient.describe_target_groups(
+            Names=[
+                awsvars['targetGroupName'],
+            ]
+        )
+        target_group_arn = first(targetgroup['TargetGroups'], 'TargetGroupArn')
+    if target_group_arn is None:
+        print("No Target Group to delete")
+        return
 
+    stage_tracing.annotate(target_group_arn)
     tg_response = elbclient.delete_target_group(
-        TargetGroupArn=targetgroup['TargetGroups'][0]['TargetGroupArn']
+        TargetGroupArn=target_group_arn
     )
     print("Deleted Target Group: ", tg_response)
 
 
-def delete_internet_gateway(igname, awsvars, ec2_client):
-    gateway = ec2_client.describe_internet_gateways(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    igname,
-                ]
-            },
-        ],
-        DryRun=False,
-    )
-
-    vpc = ec2_client.describe_vpcs(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['vpcName'],
-                ]
-            },
-        ]
-    )
-
-    detach = ec2_client.detach_internet_gateway(
-        DryRun=False,
-        InternetGatewayId=gateway['InternetGateways'][0]['InternetGatewayId'],
-        VpcId=vpc['Vpcs'][0]['VpcId']
-    )
-    print("Detached Internet Gateway: ", detach)
+@stage_tracing.traced
+def delete_internet_gateway(igname, awsvars, ec2_client, gateway_id=None, vpc_id=None):
+    if gateway_id is None:
+        gateway = ec2_client.describe_internet_gateways(
+            Filters=name_filters(igname, stack_id(awsvars)),
+            DryRun=False,
+        )
+        if not gateway['InternetGateways']:
+            print("No Internet Gateway to delete")
+            return
+        gateway_id = gateway['InternetGateways'][0]['InternetGatewayId']
+        vpc_id = first(gateway['InternetGateways'][0]['Attachments'], 'VpcId')
+
+    stage_tracing.annotate(gateway_id)
+    if vpc_id is not None:
+        try:
+            detach = ec2_client.detach_internet_gateway(
+                DryRun=False,
+                InternetGatewayId=gateway_id,
+                VpcId=vpc_id
+            )
+            print("Detached Internet Gateway: ", detach)
+        except ClientError as error:
+            # Detached by an earlier run of the teardown
+            if error_code(error) != 'Gateway.NotAttached':
+                raise
 
     gateway_response = ec2_client.delete_internet_gateway(
         DryRun=False,
-        InternetGatewayId=gateway['InternetGateways'][0]['InternetGatewayId']
+        InternetGatewayId=gateway_id
     )
     print("Deleted Internet Gateway: ", gateway_response)
 
 
-def delete_security_groups(name, ec2_client):
-    sg = ec2_client.describe_security_groups(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    name,
-                ]
-            },
-        ]
-    )
+@stage_tracing.traced
+def delete_security_groups(name, stack, ec2_client, group_id=None):
+    if group_id is None:
+        sg = ec2_client.describe_security_groups(
+            Filters=name_filters(name, stack)
+        )
+        group_id = first(sg['SecurityGroups'], 'GroupId')
+    if group_id is None:
+        print("No Security Group %s to delete" % name)
+        return
 
-    print('Security Group to delete is: ', sg)
+    print('Security Group to delete is: ', group_id)
+    stage_tracing.annotate(group_id)
 
     sg_response = ec2_client.delete_security_group(
-        GroupId=sg['SecurityGroups'][0]['GroupId'],
+        GroupId=group_id,
         DryRun=False
     )
 
     print("Deleted Security Group: ", sg_response)
 
 
-def delete_subnet(name, ec2_client):
-    subnet = ec2_client.describe_subnets(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    name,
-                ]
-            },
-        ],
-        DryRun=False
-    )
+@stage_tracing.traced
+def delete_subnet(name, stack, ec2_client, subnet_id=None):
+    if subnet_id is None:
+        subnet = ec2_client.describe_subnets(
+            Filters=name_filters(name, stack),
+            DryRun=False
+        )
+        subnet_id = first(subnet['Subnets'], 'SubnetId')
+    if subnet_id is None:
+        print("No Subnet %s to delete" % name)
+        return
 
+    stage_tracing.annotate(subnet_id)
     subnet_response = ec2_client.delete_subnet(
-        SubnetId=subnet['Subnets'][0]['SubnetId'],
+        SubnetId=subnet_id,
         DryRun=False
     )
     print("Deleted Subnet: ", subnet_response)
 
 
-def delete_route_table(name, ec2_client):
-    route_table = ec2_client.describe_route_tables(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    name,
-                ]
-            },
-        ],
-        DryRun=False
-    )
+@stage_tracing.traced
+def delete_route_table(name, stack, ec2_client, route_table_id=None):
+    if route_table_id is None:
+        route_table = ec2_client.describe_route_tables(
+            Filters=name_filters(name, stack),
+            DryRun=False
+        )
+    else:
+        route_table = ec2_client.describe_route_tables(
+            RouteTableIds=[route_table_id],
+            DryRun=False
+        )
+    if not route_table['RouteTables']:
+        print("No Route Table %s to delete" % name)
+        return
     print('Association: ', route_table['RouteTables'][0]['Associations'])
+    stage_tracing.annotate(route_table['RouteTables'][0]['RouteTableId'])
 
     for subnet in route_table['RouteTables'][0]['Associations']:
         ec2_client.disassociate_route_table(
@@ -266,127 +354,294 @@ def delete_route_table(name, ec2_client):
     print("Deleted RouteTable: ", rt_response)
 
 
-def delete_nat_gateway(awsvars, ec2_client):
-    nat = ec2_client.describe_nat_gateways(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['natGatewayName'],
-                ]
-            },
-        ]
-    )
+@stage_tracing.traced
+def delete_nat_gateway(name, stack, ec2_client, nat_gateway_id=None):
+    if nat_gateway_id is None:
+        nat = ec2_client.describe_nat_gateways(
+            Filters=name_filters(name, stack) + [
+                {
+                    'Name': 'state',
+                    'Values': ['pending', 'available']
+                },
+            ]
+        )
+        nat_gateway_id = first(nat['NatGateways'], 'NatGatewayId')
+    if nat_gateway_id is None:
+        print("No NAT Gateway %s to delete" % name)
+        return
 
+    stage_tracing.annotate(nat_gateway_id)
     nat_response = ec2_client.delete_nat_gateway(
-        NatGatewayId=nat['NatGateways'][0]['NatGatewayId']
-    )
-    print("Deleted NAT: ", nat_response)
-
-
-def delete_elastic_ip(awsvars, ec2_client):
-    eip = ec2_client.describe_addresses(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['eipName'],
-                ]
-            },
-        ]
+        NatGatewayId=nat_gateway_id
     )
-    print('eip is: ', eip)
+    print("Waiting for NAT Gateway Deletion . . .")
+
+    # The subnet and elastic ip used by the NAT can only be removed once it has been deleted
+    return after_wait(nat_gateway_deleted_waiter(nat_gateway_id, ec2_client).start(),
+                      deleted, "Deleted NAT: ", nat_response)
 
+
+@stage_tracing.traced
+def delete_elastic_ip(name, stack, ec2_client, allocation_id=None):
+    if allocation_id is None:
+        eip = ec2_client.describe_addresses(
+            Filters=name_filters(name, stack)
+        )
+        print('eip is: ', eip)
+        allocation_id = first(eip['Addresses'], 'AllocationId')
+    if allocation_id is None:
+        print("No Elastic IP %s to delete" % name)
+        return
+
+    stage_tracing.annotate(allocation_id)
     eip_response = ec2_client.release_address(
-        AllocationId=eip['Addresses'][0]['AllocationId']
+        AllocationId=allocation_id
     )
     print("Deleted Elastic IP: ", eip_response)
 
 
-def delete_vpc(awsvars, ec2_client):
-    vpc = ec2_client.describe_vpcs(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    awsvars['vpcName'],
-                ]
-            },
-        ]
-    )
+@stage_tracing.traced
+def delete_vpc(awsvars, ec2_client, vpc_id=None):
+    if vpc_id is None:
+        vpc = ec2_client.describe_vpcs(
+            Filters=name_filters(awsvars['vpcName'], stack_id(awsvars))
+        )
+        vpc_id = first(vpc['Vpcs'], 'VpcId')
+    if vpc_id is None:
+        print("No VPC to delete")
+        return
 
+    stage_tracing.annotate(vpc_id)
     vpc_response = ec2_client.delete_vpc(
-        VpcId=vpc['Vpcs'][0]['VpcId'],
+        VpcId=vpc_id,
         DryRun=False
     )
 
     print("Deleted VPC: ", vpc_response)
 
 
-def run_delete_script(awsvars, access_key_id, secret_access_key):
-    ec2 = boto3.resource(
-        'ec2',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
-
-    ec2_client = boto3.client(
-        'ec2',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
-
-    asg_client = boto3.client(
-        'autoscaling',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
-
-    rds = boto3.client(
-        'rds',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
+def deleted(message, response):
+    print(message, response)
+
+
+def error_code(error):
+    return error.response['Error']['Code']
+
+
+def db_instance_deleted_waiter(db_instance_id, rds):
+    return waiter_multiplexer.waiter('RDS instance deletion ' + db_instance_id, waiter_multiplexer.DB_INSTANCE_DELETED,
+                                     rds, db_instance_id, timeout=3600)
+
+
+def instances_terminated_waiter(instance_ids, ec2_client):
+    return waiter_multiplexer.waiter('termination of %d instances' % len(instance_ids),
+                                     waiter_multiplexer.INSTANCE_TERMINATED, ec2_client, instance_ids, timeout=1200)
+
+
+def autoscaling_group_deleted_waiter(group_name, asg_client):
+    return waiter_multiplexer.waiter('AutoScaling Group deletion ' + group_name,
+                                     waiter_multiplexer.AUTOSCALING_GROUP_DELETED, asg_client, group_name, timeout=1200)
+
+
+def load_balancer_deleted_waiter(load_balancer_arn, elbclient):
+    return waiter_multiplexer.waiter('Load Balancer deletion', waiter_multiplexer.LOAD_BALANCER_DELETED,
+                                     elbclient, load_balancer_arn, timeout=900)
+
+
+def nat_gateway_deleted_waiter(nat_gateway_id, ec2_client):
+    return waiter_multiplexer.waiter('NAT Gateway deletion ' + nat_gateway_id, waiter_multiplexer.NAT_GATEWAY_DELETED,
+                                     ec2_client, nat_gateway_id, timeout=900)
+
+
+def delete_stages(awsvars, access_key_id, secret_access_key):
+    ec2_client = client_registry.get_client('ec2', awsvars, access_key_id, secret_access_key)
+
+    asg_client = client_registry.get_client('autoscaling', awsvars, access_key_id, secret_access_key)
+
+    rds = client_registry.get_client('rds', awsvars, access_key_id, secret_access_key)
+
+    cw_client = client_registry.get_client('cloudwatch', awsvars, access_key_id, secret_access_key)
+
+    sns_client = client_registry.get_client('sns', awsvars, access_key_id, secret_access_key)
+
+    elbclient = client_registry.get_client('elbv2', awsvars, access_key_id, secret_access_key)
+
+    # Ids recorded at creation time, any id missing from the state file is discovered by tag instead
+    state = load_teardown_state(awsvars, ec2_client)
+    public_subnets = state.get('public_subnet_ids', [])
+    private_subnets = state.get('private_subnet_ids', [])
+    security_groups = state.get('security_group_ids', {})
+
+    planned_subnets = plan_subnets(awsvars)
+    nat_gateways = plan_nat_gateways(awsvars)
+    stack = stack_id(awsvars)
+
+    stages = [subnet_stage(subnet, nat_gateways, stack, ec2_client, public_subnets, private_subnets)
+              for subnet in planned_subnets]
+    for nat_gateway in nat_gateways:
+        stages.extend(nat_gateway_stages(nat_gateway, stack, ec2_client, state))
+    stages += [
+        Stage('asg', lambda: delete_autoscaling_group(awsvars, asg_client),
+              provides=['asg']),
+        Stage('cloudwatch', lambda: delete_cloudwatch_alarms(awsvars, cw_client),
+              provides=['cloudwatch']),
+        Stage('sns', lambda: delete_sns_topics(awsvars, sns_client, state.get('sns_topic_arns')),
+              provides=['sns']),
+        Stage('rds', lambda: delete_rds(awsvars, rds),
+              provides=['rds']),
+        Stage('rds_subnet_group', lambda: delete_rds_subnet(awsvars, rds),
+              requires=['rds'], provides=['rds_subnet_group']),
+        Stage('instances', lambda: delete_instances(awsvars, ec2_client),
+              requires=['asg'], provides=['instances']),
+        Stage('alb', lambda: delete_alb(awsvars, elbclient, state.get('load_balancer_arn')),
+              provides=['alb']),
+        Stage('launch_config', lambda: delete_launch_config(awsvars, asg_client),
+              requires=['asg'], provides=['launch_config']),
+        Stage('target_group', lambda: delete_targetgroup(awsvars, elbclient, state.get('target_group_arn')),
+              requires=['asg', 'alb'], provides=['target_group']),
+        Stage('rds_security_group',
+              lambda: delete_security_groups(awsvars['rdsSecurityGroupName'], stack, ec2_client,
+                                             security_groups.get('rds')),
+              requires=['rds'], provides=['rds_security_group']),
+        Stage('app_security_group',
+              lambda: delete_security_groups(awsvars['applicationSecurityGroupName'], stack, ec2_client,
+                                             security_groups.get('app')),
+              requires=['instances', 'rds_security_group'], provides=['app_security_group']),
+        Stage('alb_security_group',
+              lambda: delete_security_groups(awsvars['albSecurityGroupName'], stack, ec2_client,
+                                             security_groups.get('alb')),
+              requires=['alb', 'instances', 'app_security_group'], provides=['alb_security_group']),
+        Stage('public_route_table',
+              lambda: delete_route_table(awsvars['publicRouteTable'], stack, ec2_client,
+                                         state.get('public_route_table_id')),
+              provides=['public_route_table']),
+        Stage('internet_gateway',
+              lambda: delete_internet_gateway(awsvars['igName'], awsvars, ec2_client,
+                                              state.get('internet_gateway_id'), state.get('vpc_id')),
+              requires=['alb', 'instances'] + [nat_gateway.stage_name('elastic_ip') for nat_gateway in nat_gateways],
+              provides=['internet_gateway']),
+        Stage('vpc', lambda: delete_vpc(awsvars, ec2_client, state.get('vpc_id')),
+              requires=[subnet.stage_name for subnet in planned_subnets] + [
+                        'rds_security_group', 'app_security_group', 'alb_security_group',
+                        'public_route_table', 'internet_gateway'] +
+                       [nat_gateway.stage_name('private_route_table') for nat_gateway in nat_gateways],
+              provides=['vpc']),
+    ]
+    for stage in stages:
+        stage.action = skip_if_deleted(stage.name, stage.action)
+
+    # The state file is removed only once every other stage has completed
+    stages.append(Stage('state_file', state.delete, requires=[stage.name for stage in stages]))
+    return stages
+
+
+def cleanup_stages(create_stage, awsvars, access_key_id, secret_access_key):
+    # The teardown stages deleting the resources a create stage made before failing part way,
+    # each only waiting for the others in the list
+    stages = delete_stages(awsvars, access_key_id, secret_access_key)
+    if create_stage == 'vpc':
+        excluded = set(APPLICATION_STAGES).union(*PARTIAL_CREATE_CLEANUP.values())
+        stages = [stage for stage in stages if stage.name not in excluded]
+    else:
+        stages = [stage for stage in stages if stage.name in PARTIAL_CREATE_CLEANUP.get(create_stage, [])]
+    provided = set(resource for stage in stages for resource in stage.provides)
+    for stage in stages:
+        stage.requires = tuple(resource for resource in stage.requires if resource in provided)
+    return stages
+
+
+def subnet_stage(subnet, nat_gateways, stack, ec2_client, public_subnets, private_subnets):
+    # One stage per planned subnet, public_subnet_1 ... private_subnet_N
+    if subnet.tier == PUBLIC:
+        subnet_id = list_item(public_subnets, subnet.index)
+        requires = ['alb', 'instances', 'public_route_table']
+        # A Public Subnet holding a NAT Gateway can only be removed once the NAT Gateway has been deleted
+        requires.extend(nat_gateway.stage_name('nat_gateway') for nat_gateway in nat_gateways
+                        if nat_gateway.index == subnet.index)
+    else:
+        subnet_id = list_item(private_subnets, subnet.index)
+        requires = ['rds_subnet_group', 'instances',
+                    nat_gateway_for(nat_gateways, subnet).stage_name('private_route_table')]
+    return Stage(subnet.stage_name, lambda: delete_subnet(subnet.name, stack, ec2_client, subnet_id),
+                 requires=requires, provides=[subnet.stage_name])
+
+
+def nat_gateway_stages(nat_gateway, stack, ec2_client, state):
+    # The NAT Gateway, Elastic IP and Private Route Table stages of one planned NAT Gateway,
+    # per zone NAT Gateways are deleted in parallel and each one waited for on its own
+    nat_gateway_id = list_item(state_ids(state.resources, 'nat_gateway_ids'), nat_gateway.index)
+    allocation_id = list_item(state_ids(state.resources, 'eip_allocation_ids'), nat_gateway.index)
+    route_table_id = list_item(state_ids(state.resources, 'private_route_table_ids'), nat_gateway.index)
+    return [
+        Stage(nat_gateway.stage_name('nat_gateway'),
+              lambda: delete_nat_gateway(nat_gateway.name, stack, ec2_client, nat_gateway_id),
+              provides=[nat_gateway.stage_name('nat_gateway')]),
+        Stage(nat_gateway.stage_name('elastic_ip'),
+              lambda: delete_elastic_ip(nat_gateway.eip_name, stack, ec2_client, allocation_id),
+              requires=[nat_gateway.stage_name('nat_gateway')], provides=[nat_gateway.stage_name('elastic_ip')]),
+        Stage(nat_gateway.stage_name('private_route_table'),
+              lambda: delete_route_table(nat_gateway.route_table_name, stack, ec2_client, route_table_id),
+              provides=[nat_gateway.stage_name('private_route_table')])
+    ]
+
+
+def load_teardown_state(awsvars, ec2_client):
+    state = StackState(awsvars)
+    vpc_id = state.get('vpc_id')
+    if vpc_id is None:
+        return state
+    try:
+        ec2_client.describe_vpcs(VpcIds=[vpc_id])
+        print("Read stack resources from state file: " + state.path)
+    except ClientError as error:
+        if not is_not_found(error):
+            raise
+        # The recorded VPC no longer exists, so the file describes a stack that has since been replaced
+        print("Ignoring stale state file: " + state.path)
+        state.resources = {}
+    return state
+
+
+def name_filters(name, stack):
+    # Name tags are only unique within a stack, so a lookup by name also matches the stack's StackId tag
+    return [
+        {
+            'Name': 'tag:Name',
+            'Values': [name]
+        },
+        {
+            'Name': 'tag:' + STACK_TAG_KEY,
+            'Values': [stack]
+        },
+    ]
+
+
+def first(items, key):
+    # The id of the first resource a lookup found, None when nothing matched
+    return items[0][key] if items else None
+
+
+def list_item(items, index):
+    return items[index] if index < len(items) else None
+
+
+def is_not_found(error):
+    # Covers the EC2 'Invalid*.NotFound' codes as well as NatGatewayNotFound, LoadBalancerNotFound etc.
+    return 'NotFound' in error_code(error)
+
+
+def skip_if_deleted(name, action):
+    # Re-running a teardown treats resources that are already gone as deleted
+    def skipped(outcome):
+        try:
+            return outcome()
+        except ClientError as error:
+            if not is_not_found(error):
+                raise
+            print("Stage %s: resource already deleted (%s)" % (name, error_code(error)))
+    return lambda: continue_with(action, skipped)
 
-    cw_client = boto3.client('cloudwatch',
-                             aws_access_key_id=access_key_id,
-                             aws_secret_access_key=secret_access_key,
-                             region_name=awsvars['region']
-                             )
-
-    sns_client = boto3.client(
-        'sns',
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        region_name=awsvars['region']
-    )
 
-    elbclient = boto3.client('elbv2', aws_access_key_id=access_key_id,
-                             aws_secret_access_key=secret_access_key,
-                             region_name=awsvars['region'])
-
-    delete_autoscaling_group(awsvars, asg_client)
-    delete_rds(awsvars, rds)
-    delete_rds_subnet(awsvars, rds)
-    delete_instances(ec2, ec2_client)
-    delete_cloudwatch_alarms(awsvars, cw_client)
-    delete_alb(awsvars, elbclient)
-    delete_launch_config(awsvars, asg_client)
-    delete_targetgroup(awsvars, elbclient)
-    delete_security_groups(awsvars['rdsSecurityGroupName'], ec2_client)
-    delete_security_groups(awsvars['applicationSecurityGroupName'], ec2_client)
-    delete_route_table(awsvars['publicRouteTable'], ec2_client)
-    delete_route_table(awsvars['privateRouteTable'], ec2_client)
-    delete_nat_gateway(awsvars, ec2_client)
-    delete_subnet(awsvars['publicSubnet2Name'], ec2_client)
-    delete_subnet(awsvars['privateSubnet1Name'], ec2_client)
-    delete_subnet(awsvars['privateSubnet2Name'], ec2_client)
-    delete_internet_gateway(awsvars['igName'], awsvars, ec2_client)
-    delete_security_groups(awsvars['albSecurityGroupName'], ec2_client)
-    delete_elastic_ip(awsvars, ec2_client)
-    delete_subnet(awsvars['publicSubnet1Name'], ec2_client)
-    delete_vpc(awsvars, ec2_client)
+def run_delete_script(awsvars, access_key_id, secret_access_key):
+    stages = delete_stages(awsvars, access_key_id, secret_access_key)
+    run_stages(stages, max_workers=awsvars.get('maxStageWorkers', 8), stack=stage_tracing.stack_label(awsvars))
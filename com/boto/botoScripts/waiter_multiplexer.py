@@ -0,0 +1,409 @@
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from api_metrics import THROTTLING_ERROR_CODES
+import stage_tracing
+
+
+#
+# waiter_multiplexer.py version 1
+# boto3
+# python version 2.7.14
+#
+# One poller for every resource waited on, across stages, stacks and regions:
+#
+# Pending resources are registered by type (NAT Gateway available, instances terminated, RDS deleted ...)
+# and grouped per type and client, so per region
+# Each tick makes one batched describe per group covering every pending resource in it,
+# e.g. describe_nat_gateways with every pending NAT Gateway id, describe_instances with up to 1000 instance ids
+# Every resource has its own Future, resolved or failed as soon as a tick sees it reach its final state
+# A group is polled when its most overdue resource is due, with per resource exponential backoff and jitter,
+# resources registered later ride along on the same calls
+# A throttled, failed (5xx) or unreachable describe is retried with the same backoff, only the resources whose deadline
+# has passed are failed by it. Any other describe error fails every resource of the call
+# One scheduler thread and a small pool run the ticks however many resources are pending
+# set_time_scale compresses every poll delay and timeout, used by the offline benchmark and tests
+#
+# waiter() wraps one or more resources of a type in a waiter: start() returns a traced Future, wait() blocks on it
+# When one resource of a waiter fails, the waiter fails and its other resources stop being polled for it,
+# their futures fail with WaiterFailedError unless another waiter still needs them
+# WaiterTimeoutError once a resource's deadline has passed, WaiterFailedError once it can never reach its state
+
+
+# Multiplier applied to every poll delay and timeout
+time_scale = 1.0
+
+
+def set_time_scale(factor):
+    global time_scale
+    time_scale = factor
+
+
+class WaiterTimeoutError(Exception):
+    pass
+
+
+class WaiterFailedError(Exception):
+    pass
+
+
+def print_progress(name, attempt, elapsed, status):
+    print("Waiting for %s: %s (check %d, %ds elapsed)" % (name, status, attempt, elapsed))
+
+
+class ResourceType(object):
+    # describe(client, resource_ids) returns {resource_id: (state, item)} for the resources it found
+    def __init__(self, name, describe, batch_size, done_states, failed_states=(), missing_done=False,
+                 not_found_codes=(), result=None, initial_delay=5, max_delay=20):
+        self.name = name
+        self.describe = describe
+        self.batch_size = batch_size
+        self.done_states = done_states
+        self.failed_states = failed_states
+        # Whether a resource no longer described has reached the final state, true for deletions
+        self.missing_done = missing_done
+        # Errors meaning an id in the call does not exist, the ids of that call are then described one at a time
+        self.not_found_codes = not_found_codes
+        # Value a resource's Future resolves to, from (state, item), the state by default
+        self.result = result or (lambda state, item: state)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+    def describe_states(self, client, resource_ids):
+        states = {}
+        for start in range(0, len(resource_ids), self.batch_size):
+            batch = resource_ids[start:start + self.batch_size]
+            try:
+                states.update(self.describe(client, batch))
+            except ClientError as error:
+                if error.response['Error']['Code'] not in self.not_found_codes:
+                    raise
+                if len(batch) > 1:
+                    for resource_id in batch:
+                        states.update(self.describe_states(client, [resource_id]))
+        return states
+
+
+def describe_nat_gateways(client, nat_gateway_ids):
+    # Filtering by id, unlike NatGatewayIds, does not fail while a new NAT Gateway is not yet visible
+    states = {}
+    paginator = client.get_paginator('describe_nat_gateways')
+    for page in paginator.paginate(Filters=[{'Name': 'nat-gateway-id', 'Values': nat_gateway_ids}]):
+        for nat_gateway in page['NatGateways']:
+            states[nat_gateway['NatGatewayId']] = (nat_gateway['State'], nat_gateway)
+    return states
+
+
+def describe_instances(client, instance_ids):
+    states = {}
+    paginator = client.get_paginator('describe_instances')
+    for page in paginator.paginate(InstanceIds=instance_ids):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                states[instance['InstanceId']] = (instance['State']['Name'], instance)
+    return states
+
+
+def describe_db_instances(client, db_instance_ids):
+    states = {}
+    paginator = client.get_paginator('describe_db_instances')
+    for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': db_instance_ids}]):
+        for db_instance in page['DBInstances']:
+            states[db_instance['DBInstanceIdentifier']] = (db_instance['DBInstanceStatus'], db_instance)
+    return states
+
+
+def describe_load_balancers(client, load_balancer_arns):
+    response = client.describe_load_balancers(LoadBalancerArns=load_balancer_arns)
+    return dict((load_balancer['LoadBalancerArn'], (load_balancer['State']['Code'], load_balancer))
+                for load_balancer in response['LoadBalancers'])
+
+
+def describe_auto_scaling_groups(client, group_names):
+    # A group being deleted is still described, with a Status of 'Delete in progress'
+    states = {}
+    paginator = client.get_paginator('describe_auto_scaling_groups')
+    for page in paginator.paginate(AutoScalingGroupNames=group_names):
+        for group in page['AutoScalingGroups']:
+            states[group['AutoScalingGroupName']] = (group.get('Status', 'InService'), group)
+    return states
+
+
+def db_endpoint(state, db_instance):
+    host = db_instance['Endpoint']['Address']
+    print("DB instance ready with host: %s" % host)
+    return host
+
+
+# Filters take at most 200 values, describe_instances up to 1000 instance ids, describe_load_balancers 20 ARNs
+# and describe_auto_scaling_groups is kept to 50 names
+NAT_GATEWAY_AVAILABLE = ResourceType(
+    'NAT Gateway', describe_nat_gateways, 200, ['available'], failed_states=['failed', 'deleting', 'deleted'])
+NAT_GATEWAY_DELETED = ResourceType(
+    'NAT Gateway deletion', describe_nat_gateways, 200, ['deleted', 'failed'], missing_done=True)
+INSTANCE_TERMINATED = ResourceType(
+    'instance termination', describe_instances, 1000, ['terminated'], missing_done=True,
+    not_found_codes=['InvalidInstanceID.NotFound'], max_delay=30)
+DB_INSTANCE_AVAILABLE = ResourceType(
+    'RDS instance', describe_db_instances, 100, ['available'],
+    failed_states=['failed', 'incompatible-parameters', 'incompatible-network', 'storage-full'],
+    result=db_endpoint, initial_delay=15, max_delay=60)
+DB_INSTANCE_DELETED = ResourceType(
+    'RDS instance deletion', describe_db_instances, 100, [], missing_done=True, initial_delay=15, max_delay=60)
+AUTOSCALING_GROUP_DELETED = ResourceType(
+    'AutoScaling Group deletion', describe_auto_scaling_groups, 50, [], missing_done=True, max_delay=30)
+LOAD_BALANCER_DELETED = ResourceType(
+    'Load Balancer deletion', describe_load_balancers, 20, [], missing_done=True,
+    not_found_codes=['LoadBalancerNotFound'])
+
+
+class _PendingResource(object):
+    def __init__(self, resource_id, timeout, now):
+        self.resource_id = resource_id
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+        self.started = now
+        self.deadline = now + timeout * time_scale
+        self.attempt = 0
+        self.due = now
+        self.state = 'pending'
+        # Waiters sharing this registration, it is only polled while one of them still needs it
+        self.waiters = 1
+
+
+class _ResourceGroup(object):
+    # The pending resources of one type polled through one client
+    def __init__(self, resource_type, client):
+        self.resource_type = resource_type
+        self.client = client
+        self.pending = {}
+        self.polling = False
+        self.ticks = 0
+
+    def due(self):
+        return min(pending.due for pending in self.pending.values()) if self.pending else None
+
+    def next_delay(self, attempt):
+        delay = min(self.resource_type.max_delay, self.resource_type.initial_delay * (2 ** attempt))
+        return delay * (1 - 0.5 * random.random()) * time_scale
+
+
+class WaiterMultiplexer(object):
+    def __init__(self, poll_workers=4, on_progress=print_progress):
+        self.condition = threading.Condition()
+        # _ResourceGroups keyed by (type name, client)
+        self.groups = {}
+        self.thread = None
+        self.executor = None
+        self.poll_workers = poll_workers
+        self.on_progress = on_progress
+
+    def register(self, resource_type, client, resource_id, timeout=1800):
+        # Returns a Future resolving to the resource's result once it reaches a done state
+        with self.condition:
+            if self.thread is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.poll_workers)
+                self.thread = threading.Thread(target=self.run, name='waiter-multiplexer')
+                self.thread.daemon = True
+                self.thread.start()
+            key = (resource_type.name, id(client))
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = _ResourceGroup(resource_type, client)
+            pending = group.pending.get(resource_id)
+            if pending is None:
+                # The first check of a new resource waits one initial delay, or joins a tick already due
+                now = time.time()
+                pending = group.pending[resource_id] = _PendingResource(resource_id, timeout, now)
+                pending.due = now + group.next_delay(0)
+                self.condition.notify()
+            else:
+                pending.waiters += 1
+            return pending.future
+
+    def release(self, resource_type, client, resource_id, future):
+        # A waiter no longer needs the resource, it stops being polled once no other waiter shares it
+        with self.condition:
+            group = self.groups.get((resource_type.name, id(client)))
+            pending = group.pending.get(resource_id) if group is not None else None
+            if pending is None or pending.future is not future:
+                return
+            pending.waiters -= 1
+            if pending.waiters > 0:
+                return
+            del group.pending[resource_id]
+            self.drop_if_empty(group)
+        # Anyone still holding the future gets an error rather than waiting on it forever
+        future.set_exception(WaiterFailedError("Stopped waiting for %s %s, no waiter needs it any more"
+                                               % (resource_type.name, resource_id)))
+
+    def drop_if_empty(self, group):
+        # Called with the condition held, a group without pending resources is forgotten until one is registered again
+        key = (group.resource_type.name, id(group.client))
+        if not group.pending and self.groups.get(key) is group:
+            del self.groups[key]
+
+    def run(self):
+        while True:
+            with self.condition:
+                now = time.time()
+                due_groups = [group for group in self.groups.values()
+                              if group.pending and not group.polling and group.due() <= now]
+                if not due_groups:
+                    waiting = [group.due() for group in self.groups.values() if group.pending and not group.polling]
+                    self.condition.wait(max(0, min(waiting) - now) if waiting else None)
+                    continue
+                for group in due_groups:
+                    group.polling = True
+            for group in due_groups:
+                self.executor.submit(self.poll, group)
+
+    def describe_failed(self, group, pending, error):
+        now = time.time()
+        retryable = is_retryable(error)
+        failed = []
+        with self.condition:
+            for resource_id, resource in pending.items():
+                resource.attempt += 1
+                if retryable and now < resource.deadline:
+                    resource.due = min(now + group.next_delay(resource.attempt - 1), resource.deadline)
+                    continue
+                # A resource released in the meantime has already been failed by release
+                if group.pending.get(resource_id) is resource:
+                    del group.pending[resource_id]
+                    failed.append(resource)
+            self.drop_if_empty(group)
+        if retryable and len(failed) < len(pending):
+            print("Checking %s failed, retrying: %s" % (group.resource_type.name, error))
+        for resource in failed:
+            if retryable:
+                resource.future.set_exception(WaiterTimeoutError(
+                    "Timed out after %ds waiting for %s %s, last error: %s" % (
+                        resource.deadline - resource.started, group.resource_type.name, resource.resource_id, error)))
+            else:
+                resource.future.set_exception(error)
+
+    def poll(self, group):
+        resource_type = group.resource_type
+        with self.condition:
+            pending = dict(group.pending)
+        try:
+            try:
+                states = resource_type.describe_states(group.client, sorted(pending))
+            except Exception as error:
+                self.describe_failed(group, pending, error)
+                return
+
+            now = time.time()
+            outcomes = {}
+            for resource_id, resource in pending.items():
+                if resource_id in states:
+                    state, item = states[resource_id]
+                elif resource_type.missing_done:
+                    state, item = 'deleted', None
+                else:
+                    state, item = 'not yet visible', None
+                resource.state = state
+                resource.attempt += 1
+                try:
+                    if state in resource_type.failed_states:
+                        raise WaiterFailedError("%s %s is %s" % (resource_type.name, resource_id, state))
+                    if state in resource_type.done_states or (item is None and resource_type.missing_done):
+                        outcomes[resource_id] = (resource_type.result(state, item), None)
+                    elif now >= resource.deadline:
+                        raise WaiterTimeoutError("Timed out after %ds waiting for %s %s, last status: %s" % (
+                            resource.deadline - resource.started, resource_type.name, resource_id, state))
+                    else:
+                        resource.due = min(now + group.next_delay(resource.attempt - 1), resource.deadline)
+                        continue
+                except Exception as error:
+                    outcomes[resource_id] = (None, error)
+
+            with self.condition:
+                group.ticks += 1
+                for resource_id in list(outcomes):
+                    # A resource released while it was being checked has already been failed by release
+                    if group.pending.get(resource_id) is pending[resource_id]:
+                        del group.pending[resource_id]
+                    else:
+                        del outcomes[resource_id]
+                remaining = [resource for resource in group.pending.values() if resource.resource_id in pending]
+                self.drop_if_empty(group)
+            for resource_id, (result, error) in sorted(outcomes.items()):
+                if error is None:
+                    pending[resource_id].future.set_result(result)
+                else:
+                    pending[resource_id].future.set_exception(error)
+            if remaining and self.on_progress is not None:
+                oldest = min(resource.started for resource in remaining)
+                self.on_progress("%s (%d pending)" % (resource_type.name, len(remaining)), group.ticks, now - oldest,
+                                 ", ".join(sorted(set(resource.state for resource in remaining))))
+        finally:
+            with self.condition:
+                group.polling = False
+                self.condition.notify()
+
+
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return error.response['Error']['Code'] in THROTTLING_ERROR_CODES or status >= 500
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError))
+
+
+class MultiplexedWaiter(object):
+    # Waits for one resource (resource_ids a string, resolving to its result)
+    # or several (a list, resolving to their results in order) through the multiplexer
+    def __init__(self, name, resource_type, client, resource_ids, timeout=1800):
+        self.name = name
+        self.resource_type = resource_type
+        self.client = client
+        self.resource_ids = resource_ids
+        self.timeout = timeout
+
+    def start(self):
+        single = not isinstance(self.resource_ids, list)
+        resource_ids = [self.resource_ids] if single else self.resource_ids
+        futures = [multiplexer.register(self.resource_type, self.client, resource_id, self.timeout)
+                   for resource_id in resource_ids]
+        combined = Future()
+        combined.set_running_or_notify_cancel()
+        lock = threading.Lock()
+        remaining = [len(futures)]
+
+        def finished(future):
+            with lock:
+                if combined.done():
+                    return
+                if future.exception() is not None:
+                    combined.set_exception(future.exception())
+                else:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        results = [done.result() for done in futures]
+                        combined.set_result(results[0] if single else results)
+                    return
+            # The waiter has failed, so the resources it was still waiting for are no longer polled for it
+            for resource_id, sibling in zip(resource_ids, futures):
+                if not sibling.done():
+                    multiplexer.release(self.resource_type, self.client, resource_id, sibling)
+
+        if not futures:
+            combined.set_result(None if single else [])
+        for future in futures:
+            future.add_done_callback(finished)
+        return stage_tracing.tracer.trace_future(self.name, combined, self.resource_ids)
+
+    def wait(self):
+        return self.start().result()
+
+
+# One multiplexer per process, shared by every engine, stage and stack
+multiplexer = WaiterMultiplexer()
+
+
+def waiter(name, resource_type, client, resource_ids, timeout=1800):
+    return MultiplexedWaiter(name, resource_type, client, resource_ids, timeout)
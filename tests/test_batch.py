@@ -0,0 +1,123 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+from test_resume import VARIABLES
+
+
+#
+# test_batch.py version 1
+# boto3
+# python version 3
+#
+# Name-spacing each stack's resource names by its stack id, and loading the stacks of a batch from a stacks file
+#
+# command to run example: python -m pytest tests
+
+
+@unittest.skipIf(boto3 is None, "boto3 is not installed")
+class NamespaceNamesTest(unittest.TestCase):
+    def setUp(self):
+        import batch
+        import config_loader
+        self.batch = batch
+        self.awsvars = config_loader.parse_yaml(VARIABLES)
+
+    def test_names_are_prefixed_with_the_stack_id(self):
+        stack_vars = self.batch.namespace_names(self.awsvars, 'team-a')
+        self.assertEqual(stack_vars['stackId'], 'team-a')
+        self.assertEqual(stack_vars['vpcName'], 'team-a-CloudArchVPC')
+        self.assertEqual(stack_vars['albName'], 'team-a-CloudArchALB')
+        self.assertEqual(stack_vars['scaleUpTopicName'], 'team-a-' + self.awsvars['scaleUpTopicName'])
+        # Everything else is left alone, and the stack's variables are a copy
+        self.assertEqual(stack_vars['vpcCidrBlock'], '10.0.0.0/16')
+        self.assertEqual(self.awsvars['vpcName'], 'CloudArchVPC')
+        self.assertNotIn('stackId', self.awsvars)
+
+    def test_rds_names_are_lower_case(self):
+        stack_vars = self.batch.namespace_names(dict(self.awsvars, rdsDBId='CloudArchDB'), 'Team-A')
+        self.assertEqual(stack_vars['rdsDBId'], 'team-a-cloudarchdb')
+        self.assertEqual(stack_vars['rdsSubnetGroupName'], 'team-a-cloudarchdbsubnet')
+        self.assertEqual(stack_vars['vpcName'], 'Team-A-CloudArchVPC')
+
+    def test_planned_subnet_names_are_prefixed_by_default(self):
+        import subnet_planner
+        stack_vars = self.batch.namespace_names(self.awsvars, 'team-a')
+        self.assertEqual(stack_vars['publicSubnetNamePrefix'], 'team-a-Public Subnet')
+        self.assertEqual(subnet_planner.plan_subnets(stack_vars)[2].name, 'team-a-Private Subnet 1')
+        stack_vars = self.batch.namespace_names(dict(self.awsvars, publicSubnetNamePrefix='Web'), 'team-a')
+        self.assertEqual(stack_vars['publicSubnetNamePrefix'], 'team-a-Web')
+
+    def test_invalid_stack_ids(self):
+        for stack in ['', '1team', 'team_a', 'team a', '-team']:
+            self.assertRaises(ValueError, self.batch.namespace_names, self.awsvars, stack)
+
+
+@unittest.skipIf(boto3 is None, "boto3 is not installed")
+class LoadStacksTest(unittest.TestCase):
+    def setUp(self):
+        import batch
+        self.batch = batch
+        self.directory = tempfile.mkdtemp()
+        self.base = self.write('awsVariables.yml', VARIABLES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as yaml_file:
+            yaml_file.write(text)
+        return path
+
+    def load(self, text, regions=None):
+        return self.batch.load_stacks(base_file=self.base, stacks_file=self.write('stacks.yml', text), regions=regions)
+
+    def test_stacks_and_regions(self):
+        stacks = self.load("stacks:\n"
+                           "  - stackId: first\n"
+                           "  - stackId: second\n"
+                           "    vpcCidrBlock: 10.1.0.0/16\n"
+                           "    regions: [eu-west-1, us-east-1]\n")
+        self.assertEqual([(stack['stackId'], stack['region']) for stack in stacks],
+                         [('first', 'eu-west-1'), ('second', 'eu-west-1'), ('second', 'us-east-1')])
+        self.assertEqual(stacks[1]['vpcCidrBlock'], '10.1.0.0/16')
+        self.assertEqual(stacks[2]['vpcName'], 'second-CloudArchVPC')
+
+    def test_stacks_file_must_hold_a_stacks_list(self):
+        for text in ["- stackId: first\n", "stacks:\n  stackId: first\n", "stackId: first\n"]:
+            with self.assertRaises(ValueError) as raised:
+                self.load(text)
+            self.assertIn("must be a mapping with a stacks list", str(raised.exception))
+
+    def test_entries_must_be_mappings_with_a_stack_id(self):
+        with self.assertRaises(ValueError) as raised:
+            self.load("stacks:\n  - stackId: first\n  - second\n")
+        self.assertIn("Entry 1 in", str(raised.exception))
+        self.assertIn("must be a mapping of variables, not str 'second'", str(raised.exception))
+        with self.assertRaises(ValueError) as raised:
+            self.load("stacks:\n  - vpcCidrBlock: 10.1.0.0/16\n")
+        self.assertIn("Entry 0 in", str(raised.exception))
+        self.assertIn("needs a stackId", str(raised.exception))
+
+    def test_entries_are_validated(self):
+        import config_loader
+        self.assertRaises(config_loader.ConfigError, self.load, "stacks:\n  - stackId: first\n    ec2Count: one\n")
+
+    def test_a_stack_listed_twice_for_a_region(self):
+        with self.assertRaises(ValueError) as raised:
+            self.load("stacks:\n  - stackId: first\n  - stackId: first\n")
+        self.assertEqual(str(raised.exception), "Stack first is listed twice for region eu-west-1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+from test_resume import VARIABLES
+
+
+#
+# test_config_loader.py version 1
+# boto3
+# python version 3
+#
+# The variable schema's error messages, and the validated configs cached by the SHA-256 of their file
+#
+# command to run example: python -m pytest tests
+
+
+class ValidateTest(unittest.TestCase):
+    def setUp(self):
+        import config_loader
+        self.config_loader = config_loader
+        self.awsvars = config_loader.parse_yaml(VARIABLES)
+
+    def errors(self, **variables):
+        awsvars = dict(self.awsvars, **variables)
+        with self.assertRaises(self.config_loader.ConfigError) as raised:
+            self.config_loader.validate(awsvars, 'test.yml')
+        return raised.exception.errors
+
+    def test_valid_variables(self):
+        self.assertIs(self.config_loader.validate(self.awsvars), self.awsvars)
+
+    def test_missing_variables(self):
+        del self.awsvars['region']
+        del self.awsvars['rdsDBId']
+        self.assertEqual(self.errors(), ["missing: rdsDBId, region"])
+
+    def test_subnet_variables_are_required_without_availability_zones(self):
+        del self.awsvars['availabilityZones']
+        errors = self.errors()
+        self.assertEqual(len(errors), 1)
+        self.assertIn('publicSubnet1CidrBlock', errors[0])
+        self.assertIn('availabilityZone2', errors[0])
+
+    def test_unknown_variable_suggests_the_closest_name(self):
+        self.assertEqual(self.errors(vpcCidrBlok='10.0.0.0/16'),
+                         ["unknown variable vpcCidrBlok, did you mean vpcCidrBlock?"])
+
+    def test_types_choices_and_ranges(self):
+        self.assertEqual(self.errors(rdsStorage='20'), ["rdsStorage must be an integer, not str '20'"])
+        self.assertEqual(self.errors(ec2Count=True), ["ec2Count must be an integer, not True"])
+        self.assertEqual(self.errors(scheme='public'),
+                         ["scheme must be one of internet-facing, internal, not 'public'"])
+        self.assertEqual(self.errors(asgMinSize=-1), ["asgMinSize must not be negative, not -1"])
+        self.assertEqual(self.errors(maxStageWorkers=0), ["maxStageWorkers must be at least 1, not 0"])
+        self.assertEqual(self.errors(availabilityZones=['eu-west-1a', 2]),
+                         ["availabilityZones[1] must be a string, not int 2"])
+
+    def test_every_error_is_reported_together(self):
+        errors = self.errors(rdsStorage='20', scheme='public', asyncWorkers=0)
+        self.assertEqual(len(errors), 3)
+
+    def test_rate_limits(self):
+        self.assertEqual(self.errors(rateLimits={'ec2': {'mutate': 5}}),
+                         ["rateLimits ec2 mutate must be a mapping, not int 5"])
+        self.assertEqual(self.errors(rateLimits={'ec2': {'mutate': {'rate': 0, 'burst': 0.5}}}),
+                         ["rateLimits ec2 mutate rate must be greater than 0, not 0",
+                          "rateLimits ec2 mutate burst must be at least 1, not 0.5"])
+        self.assertEqual(self.errors(rateLimits={'ec2': {'mutate': {'rates': 5}}}),
+                         ["unknown rateLimits ec2 mutate setting rates, use rate or burst"])
+        self.assertIn("unknown rateLimits service autoscalin, did you mean autoscaling?",
+                      self.errors(rateLimits={'autoscalin': {'mutate': {'rate': 5}}})[0])
+        self.assertEqual(self.errors(rateLimits={'ec2': {'write': {'rate': 5}}}),
+                         ["unknown rateLimits ec2 category write, use describe or mutate"])
+
+    def test_security_group_rules(self):
+        self.assertEqual(self.errors(securityGroupRules={'web': []}),
+                         ["unknown securityGroupRules tier web, use alb, app, rds"])
+        errors = self.errors(securityGroupRules={'app': [{'protocol': 'icmp', 'ports': ['443-80', 70000]}]})
+        self.assertEqual(errors, [
+            "securityGroupRules app[0] protocol must be one of tcp, udp, not 'icmp'",
+            "securityGroupRules app[0] port '443-80' must be within 0-65535, the lower port first",
+            "securityGroupRules app[0] port 70000 must be within 0-65535, the lower port first",
+            "securityGroupRules app[0] needs cidrs or sourceGroups"])
+        self.assertEqual(self.errors(securityGroupRules={'rds': [{'protocol': 'TCP', 'ports': [3306],
+                                                                  'sourceGroups': ['db']}]}),
+                         ["securityGroupRules rds[0] source group 'db' is not a tier, use alb, app, rds"])
+
+    def test_region_overrides_are_checked_as_partial_configs(self):
+        self.assertEqual(self.errors(regionOverrides={'us-east-1': {'asgMinSize': -1}}),
+                         ["regionOverrides us-east-1: asgMinSize must not be negative, not -1"])
+
+
+class LoadConfigTest(unittest.TestCase):
+    def setUp(self):
+        import config_loader
+        self.config_loader = config_loader
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as config_file:
+            config_file.write(text)
+        return path
+
+    def test_each_load_returns_an_independent_copy(self):
+        path = self.write('awsVariables.yml', VARIABLES)
+        awsvars = self.config_loader.load_config(path)
+        awsvars['availabilityZones'].append('eu-west-1c')
+        awsvars['region'] = 'us-east-1'
+        reloaded = self.config_loader.load_config(path)
+        self.assertEqual(reloaded['region'], 'eu-west-1')
+        self.assertEqual(reloaded['availabilityZones'], ['eu-west-1a', 'eu-west-1b'])
+
+    def test_configs_are_cached_by_their_contents(self):
+        self.config_loader._configs.clear()
+        self.config_loader.load_config(self.write('one.yml', VARIABLES))
+        self.config_loader.load_config(self.write('two.yml', VARIABLES))
+        self.assertEqual(len(self.config_loader._configs), 1)
+        self.config_loader.load_config(self.write('three.yml', VARIABLES + "ec2Count: 2\n"))
+        self.assertEqual(len(self.config_loader._configs), 2)
+
+    def test_invalid_files_are_not_cached(self):
+        self.config_loader._configs.clear()
+        path = self.write('awsVariables.yml', VARIABLES + "rdsStorage: twenty\n")
+        with self.assertRaises(self.config_loader.ConfigError) as raised:
+            self.config_loader.load_config(path)
+        self.assertEqual(raised.exception.source, path)
+        self.assertEqual(self.config_loader._configs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
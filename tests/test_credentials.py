@@ -0,0 +1,92 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+try:
+    import cryptography
+except ImportError:
+    cryptography = None
+
+
+#
+# test_credentials.py version 1
+# cryptography
+# python version 3
+#
+# The encrypted credential cache: expiry, stale and foreign files, and the private directory it needs
+#
+# command to run example: python -m pytest tests
+
+KEY_DATA = {'aws_access_key_id': 'AKIATEST', 'aws_secret_access_key': 'secret'}
+
+
+@unittest.skipIf(cryptography is None, "cryptography is not installed")
+class CredentialCacheTest(unittest.TestCase):
+    def setUp(self):
+        import credentials
+        self.credentials = credentials
+        # The real iteration count makes every read and write take most of a second
+        self.iterations = credentials.CACHE_KDF_ITERATIONS
+        credentials.CACHE_KDF_ITERATIONS = 1000
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, 'cache')
+        self.path = os.path.join(self.cache, 'keys.json')
+
+    def tearDown(self):
+        self.credentials.CACHE_KDF_ITERATIONS = self.iterations
+        shutil.rmtree(self.directory)
+
+    def test_round_trip_in_a_private_directory(self):
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache).st_mode), 0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(self.credentials.read_cache(self.path, 'password', 100.0, 3600), KEY_DATA)
+
+    def test_expired_cache_is_removed(self):
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        # Fernet timestamps have a resolution of one second
+        time.sleep(1.1)
+        self.assertIsNone(self.credentials.read_cache(self.path, 'password', 100.0, 0))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_another_password_keeps_the_cache(self):
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        self.assertIsNone(self.credentials.read_cache(self.path, 'other', 100.0, 3600))
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_cache_for_an_earlier_vault_is_removed(self):
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        self.assertIsNone(self.credentials.read_cache(self.path, 'password', 200.0, 3600))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unreadable_cache_is_removed(self):
+        os.mkdir(self.cache, 0o700)
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('not json')
+        self.assertIsNone(self.credentials.read_cache(self.path, 'password', 100.0, 3600))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_directory_open_to_others_is_not_used(self):
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        os.chmod(self.cache, 0o755)
+        self.assertIsNone(self.credentials.read_cache(self.path, 'password', 100.0, 3600))
+        os.remove(self.path)
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_symlinked_directory_is_not_used(self):
+        target = os.path.join(self.directory, 'target')
+        os.mkdir(target, 0o700)
+        os.symlink(target, self.cache)
+        self.credentials.write_cache(self.path, 'password', 100.0, KEY_DATA)
+        self.assertEqual(os.listdir(target), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
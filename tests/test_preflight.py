@@ -0,0 +1,146 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+from test_resume import VARIABLES
+
+
+#
+# test_preflight.py version 1
+# boto3
+# python version 3
+#
+# The offline checks run before any resource is created, for one stack and across a batch of stacks
+#
+# command to run example: python -m pytest tests
+
+LEGACY_SUBNETS = {
+    'publicSubnet1CidrBlock': '10.0.1.0/24',
+    'publicSubnet2CidrBlock': '10.0.2.0/24',
+    'privateSubnet1CidrBlock': '10.0.3.0/24',
+    'privateSubnet2CidrBlock': '10.0.4.0/24',
+    'publicSubnet1Name': 'Public 1',
+    'publicSubnet2Name': 'Public 2',
+    'privateSubnet1Name': 'Private 1',
+    'privateSubnet2Name': 'Private 2',
+    'availabilityZone1': 'eu-west-1a',
+    'availabilityZone2': 'eu-west-1b',
+    'azZone1': 'eu-west-1a',
+    'azZone2': 'eu-west-1b'
+}
+
+
+class CheckTest(unittest.TestCase):
+    def setUp(self):
+        import config_loader
+        import preflight
+        self.preflight = preflight
+        self.awsvars = config_loader.parse_yaml(VARIABLES)
+
+    def errors(self, **variables):
+        return self.preflight.stack_errors(dict(self.awsvars, **variables))
+
+    def legacy(self, **variables):
+        awsvars = dict(self.awsvars, **dict(LEGACY_SUBNETS, **variables))
+        del awsvars['availabilityZones']
+        return self.preflight.stack_errors(awsvars)
+
+    def test_valid_variables_pass(self):
+        self.assertIsNone(self.preflight.check(self.awsvars))
+        self.assertEqual(self.legacy(), [])
+
+    def test_errors_are_raised_together(self):
+        awsvars = dict(self.awsvars, asgMinSize=5, albName='internal-alb')
+        with self.assertRaises(self.preflight.PreflightError) as raised:
+            self.preflight.check(awsvars)
+        self.assertEqual(len(raised.exception.errors), 2)
+
+    def test_networks(self):
+        errors = self.errors(vpcCidrBlock='10.0.0.0/12')
+        self.assertEqual(errors[0], "vpcCidrBlock 10.0.0.0/12 must be between /16 and /28")
+        self.assertEqual(errors[1], "Public Subnet 1 10.0.0.0/14 must be between /16 and /28")
+        self.assertIn("is not a valid CIDR block", self.errors(vpcCidrBlock='10.0.0.300/16')[0])
+        self.assertEqual(self.legacy(privateSubnet2CidrBlock='10.0.1.128/25'),
+                         ["Public 1 10.0.1.0/24 overlaps Private 2 10.0.1.128/25"])
+        self.assertEqual(self.legacy(privateSubnet2CidrBlock='10.1.4.0/24'),
+                         ["Private 2 10.1.4.0/24 is outside vpcCidrBlock 10.0.0.0/16"])
+
+    def test_zones(self):
+        self.assertEqual(self.errors(availabilityZones=['eu-west-1a', 'us-east-1b']),
+                         ["Availability zone us-east-1b is not in region eu-west-1"])
+        self.assertEqual(self.errors(availabilityZones=['eu-west-1a', 'eu-west-1a', 'eu-west-1b']),
+                         ["Availability zones are listed more than once: eu-west-1a, eu-west-1a, eu-west-1b"])
+        self.assertEqual(self.errors(availabilityZones=['eu-west-1a']),
+                         ["The subnets need at least two availability zones, not eu-west-1a"])
+        self.assertEqual(self.legacy(azZone2='eu-west-1c'),
+                         ["ASG zones azZone1/azZone2 (eu-west-1a, eu-west-1c) do not match the subnet zones "
+                          "availabilityZone1/2 (eu-west-1a, eu-west-1b)"])
+
+    def test_capacity(self):
+        self.assertEqual(self.errors(asgMinSize=3, asgDesiredSize=2, asgMaxSize=4),
+                         ["AutoScaling sizes must be ordered asgMinSize <= asgDesiredSize <= asgMaxSize, not 3, 2, 4"])
+        self.assertEqual(self.errors(asgMinSize=0, asgDesiredSize=0, asgMaxSize=0), ["asgMaxSize must be at least 1"])
+
+    def test_names(self):
+        self.assertEqual(self.errors(rdsDBId='1db'), ["rdsDBId '1db' must be %s" % self.preflight.RDS_IDENTIFIER[1]])
+        self.assertEqual(self.errors(albName='internal-alb'), ["albName 'internal-alb' must not start with internal-"])
+        self.assertEqual(self.errors(scaleUpTopicName='scale up'),
+                         ["scaleUpTopicName 'scale up' must be %s" % self.preflight.TOPIC_NAME[1]])
+
+    def test_security_group_rule_cidrs(self):
+        rules = {'app': [{'protocol': 'tcp', 'ports': [22], 'cidrs': ['10.0.0.300/32', '2001:db8::/32']}]}
+        errors = self.errors(securityGroupRules=rules)
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith("app security group rule CIDR 10.0.0.300/32 is not a valid CIDR block"))
+        self.assertEqual(errors[1], "app security group rule CIDR 2001:db8::/32 must be an IPv4 CIDR block")
+
+
+@unittest.skipIf(boto3 is None, "boto3 is not installed")
+class CheckStacksTest(unittest.TestCase):
+    def setUp(self):
+        import batch
+        import config_loader
+        import preflight
+        self.preflight = preflight
+        awsvars = config_loader.parse_yaml(VARIABLES)
+        self.first = batch.namespace_names(awsvars, 'first')
+        self.second = batch.namespace_names(dict(awsvars, vpcCidrBlock='10.1.0.0/16'), 'second')
+
+    def test_name_spaced_stacks_pass(self):
+        self.assertIsNone(self.preflight.check_stacks([self.first, self.second]))
+
+    def test_shared_names_in_a_region(self):
+        self.second['albName'] = self.first['albName']
+        self.assertEqual(self.preflight.cross_stack_errors([self.first, self.second]),
+                         ["albName first-CloudArchALB is used by stacks first, second in eu-west-1"])
+        self.second['region'] = 'us-east-1'
+        self.assertEqual(self.preflight.cross_stack_errors([self.first, self.second]), [])
+
+    def test_overlapping_vpcs(self):
+        self.second['vpcCidrBlock'] = '10.0.0.0/20'
+        self.assertEqual(self.preflight.cross_stack_errors([self.first, self.second]),
+                         ["vpcCidrBlock 10.0.0.0/16 of stack first overlaps 10.0.0.0/20 of stack second in eu-west-1"])
+        self.assertEqual(self.preflight.cross_stack_errors([self.first, self.second], allow_cidr_overlap=True), [])
+
+    def test_rate_limits_must_match(self):
+        self.second['rateLimits'] = {'ec2': {'mutate': {'rate': 1}}}
+        self.assertEqual(self.preflight.cross_stack_errors([self.first, self.second]),
+                         ["rateLimits differs between stacks, the rate limiter is configured once for the whole batch"])
+
+    def test_errors_name_their_stack(self):
+        self.second['asgMinSize'] = 9
+        with self.assertRaises(self.preflight.PreflightError) as raised:
+            self.preflight.check_stacks([self.first, self.second])
+        self.assertEqual(len(raised.exception.errors), 1)
+        self.assertTrue(raised.exception.errors[0].startswith("second in eu-west-1: AutoScaling sizes"))
+
+
+if __name__ == '__main__':
+    unittest.main()
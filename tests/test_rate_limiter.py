@@ -0,0 +1,115 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+import rate_limiter
+from rate_limiter import MIN_RATE, RateLimiter, TokenBucket
+
+
+#
+# test_rate_limiter.py version 1
+# boto3
+# python version 3
+#
+# The token buckets and their AIMD rate tuning, and the limiter's configure-once settings, offline
+#
+# command to run example: python -m pytest tests
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_is_spent_before_calls_wait(self):
+        # 1 token per second compressed to 100 per wall second, so the fourth call waits about 10ms
+        bucket = TokenBucket('test', rate=1, burst=3, time_scale=0.01)
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.waits, 0)
+        self.assertGreater(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquired, 4)
+        self.assertEqual(bucket.waits, 1)
+
+    def test_refill_follows_the_time_scale(self):
+        bucket = TokenBucket('test', rate=2, burst=10, time_scale=0.01)
+        bucket.tokens = 0
+        bucket.refill(bucket.updated + 0.01)
+        self.assertAlmostEqual(bucket.tokens, 2, places=3)
+        bucket.refill(bucket.updated + 1)
+        self.assertEqual(bucket.tokens, 10)
+
+    def test_throttle_halves_the_rate_once_per_cooldown(self):
+        bucket = TokenBucket('test', rate=8, burst=10)
+        bucket.on_throttle()
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 4)
+        self.assertEqual(bucket.throttles, 2)
+        self.assertEqual(bucket.min_seen_rate, 4)
+
+    def test_success_adds_the_rate_back_up_to_the_configured_rate(self):
+        bucket = TokenBucket('test', rate=8, burst=10)
+        bucket.on_throttle()
+        for _ in range(5):
+            bucket.on_success()
+        self.assertAlmostEqual(bucket.rate, 4.5)
+        for _ in range(100):
+            bucket.on_success()
+        self.assertEqual(bucket.rate, 8)
+
+    def test_rate_never_falls_below_the_minimum(self):
+        bucket = TokenBucket('test', rate=8, burst=10)
+        for _ in range(10):
+            # Every throttle is a new congestion event
+            bucket.last_decrease = 0
+            bucket.on_throttle()
+        self.assertEqual(bucket.rate, MIN_RATE)
+        self.assertEqual(bucket.min_seen_rate, MIN_RATE)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_api_category(self):
+        self.assertEqual(rate_limiter.api_category('DescribeVpcs'), rate_limiter.DESCRIBE)
+        self.assertEqual(rate_limiter.api_category('ListTopics'), rate_limiter.DESCRIBE)
+        self.assertEqual(rate_limiter.api_category('GetTopicAttributes'), rate_limiter.DESCRIBE)
+        self.assertEqual(rate_limiter.api_category('CreateVpc'), rate_limiter.MUTATE)
+
+    def test_limits_merge_defaults_and_service_settings(self):
+        limiter = RateLimiter()
+        limiter.configure({'region': 'eu-west-1', 'rateLimits': {
+            'default': {'mutate': {'rate': 2}},
+            'ec2': {'describe': {'burst': 7}}
+        }})
+        self.assertEqual(limiter.limit('ec2', 'describe'), {'rate': 20, 'burst': 7})
+        self.assertEqual(limiter.limit('ec2', 'mutate'), {'rate': 2, 'burst': 50})
+        self.assertEqual(limiter.limit('rds', 'describe'), {'rate': 20, 'burst': 100})
+
+    def test_only_the_first_configuration_applies(self):
+        limiter = RateLimiter()
+        limiter.configure({'region': 'eu-west-1', 'rateLimits': {'ec2': {'mutate': {'rate': 1}}}})
+        limiter.configure({'region': 'eu-west-1', 'rateLimiting': False})
+        self.assertTrue(limiter.enabled)
+        self.assertEqual(limiter.limit('ec2', 'mutate')['rate'], 1)
+        self.assertEqual(limiter.ignored, [(False, {})])
+
+    def test_buckets_are_kept_per_service_region_and_category(self):
+        limiter = RateLimiter()
+        bucket = limiter.bucket('ec2', 'eu-west-1', 'mutate')
+        self.assertIs(limiter.bucket('ec2', 'eu-west-1', 'mutate'), bucket)
+        self.assertIsNot(limiter.bucket('ec2', 'us-east-1', 'mutate'), bucket)
+        self.assertIsNot(limiter.bucket('ec2', 'eu-west-1', 'describe'), bucket)
+
+    def test_reset_starts_again_with_fresh_buckets_and_configuration(self):
+        limiter = RateLimiter()
+        limiter.configure({'region': 'eu-west-1', 'rateLimiting': False})
+        bucket = limiter.bucket('ec2', 'eu-west-1', 'mutate')
+        bucket.on_throttle()
+        limiter.reset(0.01)
+        self.assertTrue(limiter.enabled)
+        self.assertIsNone(limiter.settings)
+        fresh = limiter.bucket('ec2', 'eu-west-1', 'mutate')
+        self.assertIsNot(fresh, bucket)
+        self.assertEqual(fresh.rate, 5)
+        self.assertEqual(fresh.time_scale, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
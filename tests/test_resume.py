@@ -0,0 +1,206 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+#
+# test_resume.py version 1
+# boto3, moto 5
+# python version 3
+#
+# Resuming a create after a stage failed part way, against moto and the benchmark's stand-in for the calls
+# moto does not implement: the failed stage's partial resources are deleted before it runs again,
+# so nothing is duplicated
+#
+# command to run example: python -m pytest tests
+
+VARIABLES = """
+region: eu-west-1
+vpcCidrBlock: 10.0.0.0/16
+availabilityZones: [eu-west-1a, eu-west-1b]
+natGatewayPerZone: true
+vpcName: CloudArchVPC
+igName: CloudArchIG
+publicRouteTable: Public Route Table
+privateRouteTable: Private Route Table
+eipName: CloudArchEIP
+natGatewayName: CloudArchNAT
+appGroupName: app_sg
+albGroupName: alb_sg
+rdsGroupName: rds_sg
+applicationSecurityGroupName: Application Security Group
+albSecurityGroupName: ALB Security Group
+rdsSecurityGroupName: RDS Security Group
+sshCidrBlock1: 1.2.3.4/32
+sshCidrBlock2: 5.6.7.8/32
+sshCidrBlock3: 9.9.9.9/32
+albName: CloudArchALB
+scheme: internet-facing
+albTag: CloudArchALB
+lbType: application
+ipAddressType: ipv4
+targetGroupName: CloudArchTG
+protocol: HTTP
+port: 80
+httpPort: "80"
+pathPattern: /
+healthCheckIntervalSeconds: 30
+healthCheckTimeoutSeconds: 5
+healthyThresholdCount: 2
+unhealthyThresholdCount: 2
+httpCode: "200"
+targetType: instance
+listenerType: forward
+forwardType: path-pattern
+rdsSubnetGroupName: cloudarchdbsubnet
+subnetGroupDesc: DB subnet group
+rdsDBId: cloudarchdb
+rdsStorage: 20
+rdsDBName: aws
+rdsEngine: mysql
+rdsStorageType: gp2
+rdsMasterUser: admin
+rdsMasterPassword: password123
+rdsInstanceClass: db.t2.micro
+publicServerAMI: ami-12c6146b
+publicServerName: CloudArchPublic
+instanceType: t2.micro
+keyPairName: mykey
+ec2Count: 1
+asgLaunchConfigName: CloudArchLC
+asgAMI: ami-12c6146b
+autoScalingGroupName: CloudArchASG
+asgMinSize: 1
+asgMaxSize: 3
+asgDesiredSize: 2
+asgCoolDown: 300
+asgHealthCheckType: ELB
+asgTerminationPolicies: Default
+autoScalingGroupTag: CloudArchASGInstance
+scaleOutPolicyNameSC: scOut
+scaleInPolicyNameSC: scIn
+scaleOutPolicyNameCPU: cpuOut
+scaleInPolicyNameCPU: cpuIn
+scalingPolicyType: SimpleScaling
+adjustmentType: ChangeInCapacity
+adjustmentCount: 1
+scaleInAdjustment: -1
+scalingCoolDown: 300
+statusCheckAlarmName: scAlarm
+cpuAlarmName: cpuAlarm
+operator: GreaterThanThreshold
+evaluationPeriods: 1
+statusCheckMetric: StatusCheckFailed
+cpuMetric: CPUUtilization
+nameSpace: AWS/EC2
+period: 60
+scStatistic: Maximum
+cpuStatistic: Average
+scThreshold: 0
+cpuThreshold: 70
+scFailDescription: status check
+cpuHighDescription: cpu high
+scUnit: Count
+cpuUnit: Percent
+scaleUpTopicName: scaleUp
+scaleDownTopicName: scaleDown
+attributeName: DisplayName
+scaleUpNotificationName: ScaleUp
+scaleDownNotificationName: ScaleDown
+topicProtocol: email
+emailAddress: a@b.com
+instanceLaunchNotification: autoscaling:EC2_INSTANCE_LAUNCH
+instanceTerminateNotification: autoscaling:EC2_INSTANCE_TERMINATE
+"""
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+def fail(*args, **kwargs):
+    raise InjectedFailure("injected failure")
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class ResumeAfterPartialStageTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import benchmark
+        import client_registry
+        benchmark.AwsStandIn(0.001).register(client_registry.get_session('testing', 'testing').events)
+
+    def setUp(self):
+        import config_loader
+        import waiter_multiplexer
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'awsVariables.yml')
+        with open(path, 'w') as variables:
+            variables.write(VARIABLES + "stateDir: %s\n" % os.path.join(self.directory, 'state'))
+        self.awsvars = config_loader.load_config(path)
+        waiter_multiplexer.set_time_scale(0.001)
+        self.mock = mock_aws()
+        self.mock.start()
+
+    def tearDown(self):
+        import waiter_multiplexer
+        self.mock.stop()
+        waiter_multiplexer.set_time_scale(1.0)
+        shutil.rmtree(self.directory)
+
+    def create(self, resume=False):
+        import create_architecture
+        create_architecture.run_create_script(self.awsvars, 'testing', 'testing', resume=resume)
+
+    def test_resume_after_vpc_and_rds_stages_failed_part_way(self):
+        import create_rds
+        import create_vpc
+        from stage_scheduler import StageFailedError
+        from stack_state import StackState
+
+        # The VPC stage fails once its VPC, subnets, NAT Gateways and security groups exist
+        apply_security_group_rules = create_vpc.apply_security_group_rules
+        create_vpc.apply_security_group_rules = fail
+        try:
+            self.assertRaises(StageFailedError, self.create)
+        finally:
+            create_vpc.apply_security_group_rules = apply_security_group_rules
+        self.assertTrue(StackState(self.awsvars).is_failed('vpc'))
+
+        # The RDS stage fails after creating its DB subnet group
+        create_rds_instance = create_rds.create_rds_instance
+        create_rds.create_rds_instance = fail
+        try:
+            self.assertRaises(StageFailedError, self.create, True)
+        finally:
+            create_rds.create_rds_instance = create_rds_instance
+        state = StackState(self.awsvars)
+        self.assertTrue(state.is_completed('vpc'))
+        self.assertTrue(state.is_failed('rds'))
+
+        self.create(resume=True)
+
+        ec2 = boto3.client('ec2', region_name='eu-west-1')
+        vpcs = [vpc['VpcId'] for vpc in ec2.describe_vpcs()['Vpcs'] if not vpc['IsDefault']]
+        self.assertEqual(vpcs, [StackState(self.awsvars).get('vpc_id')])
+        nat_gateways = ec2.describe_nat_gateways(
+            Filters=[{'Name': 'state', 'Values': ['pending', 'available']}])['NatGateways']
+        self.assertEqual(len(nat_gateways), 2)
+        self.assertEqual(len(ec2.describe_addresses()['Addresses']), 2)
+        rds = boto3.client('rds', region_name='eu-west-1')
+        self.assertEqual(len(rds.describe_db_instances()['DBInstances']), 1)
+        self.assertEqual(StackState(self.awsvars).failed_stages, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
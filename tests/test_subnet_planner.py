@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+import subnet_planner
+from subnet_planner import PRIVATE, PUBLIC
+
+
+#
+# test_subnet_planner.py version 1
+# boto3
+# python version 3
+#
+# Subnet and NAT Gateway plans for the availabilityZones list and for the two zone variables
+#
+# command to run example: python -m pytest tests
+
+PLANNED = {
+    'vpcCidrBlock': '10.0.0.0/16',
+    'availabilityZones': ['eu-west-1a', 'eu-west-1b', 'eu-west-1c'],
+    'natGatewayName': 'NAT',
+    'eipName': 'EIP',
+    'privateRouteTable': 'Private Route Table'
+}
+
+LEGACY = {
+    'vpcCidrBlock': '10.0.0.0/16',
+    'publicSubnet1CidrBlock': '10.0.1.0/24',
+    'publicSubnet2CidrBlock': '10.0.2.0/24',
+    'privateSubnet1CidrBlock': '10.0.3.0/24',
+    'privateSubnet2CidrBlock': '10.0.4.0/24',
+    'publicSubnet1Name': 'Public 1',
+    'publicSubnet2Name': 'Public 2',
+    'privateSubnet1Name': 'Private 1',
+    'privateSubnet2Name': 'Private 2',
+    'availabilityZone1': 'eu-west-1a',
+    'availabilityZone2': 'eu-west-1b',
+    'natGatewayName': 'NAT',
+    'eipName': 'EIP',
+    'privateRouteTable': 'Private Route Table'
+}
+
+
+class PlanSubnetsTest(unittest.TestCase):
+    def test_planned_subnets_split_the_vpc_public_first(self):
+        # 6 subnets need 3 more bits than the /16
+        planned = subnet_planner.plan_subnets(PLANNED)
+        self.assertEqual([subnet.cidr for subnet in planned],
+                         ['10.0.0.0/19', '10.0.32.0/19', '10.0.64.0/19',
+                          '10.0.96.0/19', '10.0.128.0/19', '10.0.160.0/19'])
+        self.assertEqual([subnet.tier for subnet in planned], [PUBLIC] * 3 + [PRIVATE] * 3)
+        self.assertEqual([subnet.zone for subnet in planned], PLANNED['availabilityZones'] * 2)
+        self.assertEqual(planned[0].name, 'Public Subnet 1')
+        self.assertEqual(planned[5].name, 'Private Subnet 3')
+        self.assertEqual(planned[5].stage_name, 'private_subnet_3')
+
+    def test_subnet_prefix_length_and_name_prefixes(self):
+        awsvars = dict(PLANNED, subnetPrefixLength=24, publicSubnetNamePrefix='Web', privateSubnetNamePrefix='Data')
+        planned = subnet_planner.plan_subnets(awsvars)
+        self.assertEqual(planned[1].cidr, '10.0.1.0/24')
+        self.assertEqual(planned[3].cidr, '10.0.3.0/24')
+        self.assertEqual([planned[0].name, planned[3].name], ['Web 1', 'Data 1'])
+
+    def test_too_many_zones_for_the_prefix_length(self):
+        awsvars = dict(PLANNED, vpcCidrBlock='10.0.0.0/27', subnetPrefixLength=28)
+        self.assertRaises(ValueError, subnet_planner.plan_subnets, awsvars)
+        awsvars = dict(PLANNED, vpcCidrBlock='10.0.0.0/26')
+        self.assertRaises(ValueError, subnet_planner.plan_subnets, awsvars)
+
+    def test_two_zone_variables_without_availability_zones(self):
+        planned = subnet_planner.plan_subnets(LEGACY)
+        self.assertEqual([(subnet.name, subnet.cidr, subnet.zone) for subnet in planned], [
+            ('Public 1', '10.0.1.0/24', 'eu-west-1a'),
+            ('Public 2', '10.0.2.0/24', 'eu-west-1b'),
+            ('Private 1', '10.0.3.0/24', 'eu-west-1a'),
+            ('Private 2', '10.0.4.0/24', 'eu-west-1b')])
+
+
+class PlanNatGatewaysTest(unittest.TestCase):
+    def test_one_shared_nat_gateway_by_default(self):
+        nat_gateways = subnet_planner.plan_nat_gateways(PLANNED)
+        self.assertEqual(len(nat_gateways), 1)
+        self.assertEqual((nat_gateways[0].name, nat_gateways[0].eip_name, nat_gateways[0].route_table_name),
+                         ('NAT', 'EIP', 'Private Route Table'))
+        self.assertEqual(nat_gateways[0].stage_name('nat_gateway'), 'nat_gateway')
+        for subnet in subnet_planner.plan_subnets(PLANNED):
+            self.assertIs(subnet_planner.nat_gateway_for(nat_gateways, subnet), nat_gateways[0])
+
+    def test_one_nat_gateway_per_zone(self):
+        awsvars = dict(PLANNED, natGatewayPerZone=True)
+        nat_gateways = subnet_planner.plan_nat_gateways(awsvars)
+        self.assertEqual([nat_gateway.name for nat_gateway in nat_gateways], ['NAT 1', 'NAT 2', 'NAT 3'])
+        self.assertEqual([nat_gateway.zone for nat_gateway in nat_gateways], PLANNED['availabilityZones'])
+        self.assertEqual(nat_gateways[2].stage_name('elastic_ip'), 'elastic_ip_3')
+        private = subnet_planner.tier_subnets(subnet_planner.plan_subnets(awsvars), PRIVATE)
+        self.assertIs(subnet_planner.nat_gateway_for(nat_gateways, private[1]), nat_gateways[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
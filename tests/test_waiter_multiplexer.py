@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'com', 'boto', 'botoScripts'))
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    ClientError = None
+
+
+#
+# test_waiter_multiplexer.py version 1
+# boto3
+# python version 3
+#
+# Batched describes per resource group, retries and the failure of a waiter's other resources,
+# against a fake describe so no AWS calls are made
+#
+# command to run example: python -m pytest tests
+
+
+class FakeService(object):
+    # Stands in for the client, describe(client, ids) answers from states and records every call
+    def __init__(self, states, errors=()):
+        self.states = dict(states)
+        self.errors = list(errors)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def describe(self, client, resource_ids):
+        with self.lock:
+            self.calls.append(list(resource_ids))
+            if self.errors:
+                raise self.errors.pop(0)
+            return dict((resource_id, (self.states[resource_id], {'Id': resource_id}))
+                        for resource_id in resource_ids if resource_id in self.states)
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, 'DescribeFakes')
+
+
+@unittest.skipIf(ClientError is None, "botocore is not installed")
+class WaiterMultiplexerTest(unittest.TestCase):
+    def setUp(self):
+        import waiter_multiplexer
+        self.waiter_multiplexer = waiter_multiplexer
+        # 1s of modelled time per ms, the first check of a resource comes 25-50ms after it is registered
+        waiter_multiplexer.set_time_scale(0.001)
+
+    def tearDown(self):
+        self.waiter_multiplexer.set_time_scale(1.0)
+
+    def resource_type(self, service, batch_size=100, missing_done=False):
+        return self.waiter_multiplexer.ResourceType(
+            'fake', service.describe, batch_size, done_states=['available'], failed_states=['failed'],
+            missing_done=missing_done, initial_delay=50, max_delay=50)
+
+    def wait_until(self, condition):
+        deadline = time.time() + 5
+        while not condition():
+            self.assertLess(time.time(), deadline, "timed out")
+            time.sleep(0.001)
+
+    def test_one_describe_covers_every_pending_resource(self):
+        service = FakeService({'a': 'available', 'b': 'available', 'c': 'available'})
+        resource_type = self.resource_type(service)
+        waiter = self.waiter_multiplexer.waiter('fake', resource_type, service, ['a', 'b', 'c'])
+        self.assertEqual(waiter.start().result(5), ['available'] * 3)
+        self.assertEqual(service.calls, [['a', 'b', 'c']])
+
+    def test_describes_are_split_by_batch_size(self):
+        service = FakeService({'a': 'available', 'b': 'available', 'c': 'available'})
+        resource_type = self.resource_type(service, batch_size=2)
+        self.waiter_multiplexer.waiter('fake', resource_type, service, ['a', 'b', 'c']).wait()
+        self.assertEqual(service.calls, [['a', 'b'], ['c']])
+
+    def test_pending_resources_are_polled_again(self):
+        service = FakeService({'a': 'pending'})
+        resource_type = self.resource_type(service)
+        future = self.waiter_multiplexer.waiter('fake', resource_type, service, 'a').start()
+        self.wait_until(lambda: len(service.calls) >= 2)
+        service.states['a'] = 'available'
+        self.assertEqual(future.result(5), 'available')
+
+    def test_missing_resources_are_done_for_deletions(self):
+        service = FakeService({})
+        resource_type = self.resource_type(service, missing_done=True)
+        self.assertEqual(self.waiter_multiplexer.waiter('fake', resource_type, service, ['a']).wait(), ['deleted'])
+
+    def test_throttled_describes_are_retried(self):
+        service = FakeService({'a': 'available'}, errors=[client_error('Throttling')])
+        resource_type = self.resource_type(service)
+        self.assertEqual(self.waiter_multiplexer.waiter('fake', resource_type, service, 'a').wait(), 'available')
+        self.assertEqual(len(service.calls), 2)
+
+    def test_other_describe_errors_fail_the_waiter(self):
+        service = FakeService({'a': 'available'}, errors=[client_error('UnauthorizedOperation')])
+        resource_type = self.resource_type(service)
+        with self.assertRaises(ClientError):
+            self.waiter_multiplexer.waiter('fake', resource_type, service, 'a').wait()
+
+    def test_timeout(self):
+        service = FakeService({'a': 'pending'})
+        resource_type = self.resource_type(service)
+        with self.assertRaises(self.waiter_multiplexer.WaiterTimeoutError):
+            self.waiter_multiplexer.waiter('fake', resource_type, service, 'a', timeout=100).wait()
+
+    def test_a_failed_resource_fails_its_siblings(self):
+        multiplexer = self.waiter_multiplexer.multiplexer
+        service = FakeService({'a': 'pending', 'b': 'pending'})
+        resource_type = self.resource_type(service)
+        combined = self.waiter_multiplexer.waiter('fake', resource_type, service, ['a', 'b']).start()
+        sibling = multiplexer.groups[('fake', id(service))].pending['b'].future
+        service.states['a'] = 'failed'
+        with self.assertRaises(self.waiter_multiplexer.WaiterFailedError):
+            combined.result(5)
+        with self.assertRaises(self.waiter_multiplexer.WaiterFailedError):
+            sibling.result(5)
+        # Nothing is left to poll, so the group is forgotten
+        self.assertNotIn(('fake', id(service)), multiplexer.groups)
+
+    def test_a_shared_resource_is_still_polled_for_its_other_waiter(self):
+        service = FakeService({'a': 'pending', 'b': 'pending'})
+        resource_type = self.resource_type(service)
+        shared = self.waiter_multiplexer.waiter('fake', resource_type, service, 'b').start()
+        combined = self.waiter_multiplexer.waiter('fake', resource_type, service, ['a', 'b']).start()
+        service.states['a'] = 'failed'
+        with self.assertRaises(self.waiter_multiplexer.WaiterFailedError):
+            combined.result(5)
+        calls = len(service.calls)
+        self.wait_until(lambda: len(service.calls) > calls)
+        self.assertFalse(shared.done())
+        service.states['b'] = 'available'
+        self.assertEqual(shared.result(5), 'available')
+
+
+if __name__ == '__main__':
+    unittest.main()